@@ -0,0 +1,95 @@
+import os
+import time
+import pytest
+"""
+Corpus scaling: analyzing a corpus with several worker processes gives
+the same records as with one, and finishes close to workers times
+faster. The corpus is the fixture pages (tests/fixtures/corpus), each
+copied under many DOIs with its body repeated, so the parsing outweighs
+the cost of the worker processes.
+
+    pytest tests/test_corpus_scaling.py
+"""
+
+pytest.importorskip('articledownloader.articledownloader')
+pytest.importorskip('pybliometrics.scopus')
+
+from text_mining_tools.article import Article
+from text_mining_tools.corpus import Corpus
+from text_mining_tools.ingest import records_equal
+from text_mining_tools.sentence_tokenizer import SentenceTokenizer, default_tokenizer, load_punkt
+
+FIXTURE_CORPUS = os.path.join(os.path.dirname(__file__), 'fixtures', 'corpus')
+COPIES = 12             # DOIs made from each fixture page
+BODY_REPEATS = 15       # times each page body is repeated
+SCALING_WORKERS = min(4, os.cpu_count() or 1)
+# Speedup over one worker, divided by the number of workers. Below 1
+# for the process start-up, the pickled records and uneven chunks.
+MIN_EFFICIENCY = 0.6
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch):
+    # Punkt, as by default, if its NLTK data is installed. Else the
+    # rule-based splitter. Set on the class, so forked workers use it.
+    try:
+        load_punkt()
+        monkeypatch.setattr(Article, 'sentence_tokenizer', default_tokenizer)
+    except LookupError:
+        monkeypatch.setattr(Article, 'sentence_tokenizer', SentenceTokenizer('rules'))
+
+
+@pytest.fixture
+def scaling_corpus(tmp_path):
+    basepath = str(tmp_path / 'corpus')
+    for prefix in sorted(os.listdir(FIXTURE_CORPUS)):
+        os.makedirs(os.path.join(basepath, prefix))
+        for filename in sorted(os.listdir(os.path.join(FIXTURE_CORPUS, prefix))):
+            with open(os.path.join(FIXTURE_CORPUS, prefix, filename), encoding='utf-8') as f:
+                page = f.read()
+            start = page.index('>', page.index('<body')) + 1
+            end = page.index('</body>')
+            page = page[:start] + page[start:end] * BODY_REPEATS + page[end:]
+            name, extension = os.path.splitext(filename)
+            for i in range(COPIES):
+                path = os.path.join(basepath, prefix, name+'.'+str(i)+extension)
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(page)
+    return basepath
+
+
+def timed_analysis(basepath, workers):
+    corpus = Corpus(basepath, workers=workers, chunksize=2)
+    start = time.perf_counter()
+    records = list(corpus.analyze())
+    return time.perf_counter() - start, records, corpus.failures
+
+
+def assert_same_records(records, reference):
+    assert [doi for doi, _ in records] == [doi for doi, _ in reference]
+    for (doi, record), (_, expected) in zip(records, reference):
+        differing = [field for field in expected
+                     if not records_equal(record[field], expected[field])]
+        assert differing == [], doi+' differs in '+', '.join(differing)
+
+
+def test_workers_give_serial_records(scaling_corpus):
+    _, reference, failures = timed_analysis(scaling_corpus, 1)
+    assert failures == {}
+    assert len(reference) == COPIES * len(os.listdir(FIXTURE_CORPUS))
+    _, records, failures = timed_analysis(scaling_corpus, 2)
+    assert failures == {}
+    assert_same_records(records, reference)
+
+
+@pytest.mark.skipif(SCALING_WORKERS < 2, reason='Needs at least 2 cores.')
+def test_corpus_scaling(scaling_corpus):
+    serial_sec, reference, _ = timed_analysis(scaling_corpus, 1)
+    parallel_sec, records, failures = timed_analysis(scaling_corpus, SCALING_WORKERS)
+    assert failures == {}
+    assert_same_records(records, reference)
+    efficiency = serial_sec / parallel_sec / SCALING_WORKERS
+    assert efficiency >= MIN_EFFICIENCY, (
+        str(SCALING_WORKERS)+' workers took '+str(round(parallel_sec, 2))+' s against '+
+        str(round(serial_sec, 2))+' s for one: efficiency '+str(round(efficiency, 2))+
+        ', expected at least '+str(MIN_EFFICIENCY)+'.')
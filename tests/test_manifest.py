@@ -0,0 +1,76 @@
+import os
+import shutil
+import pytest
+"""
+Manifest: pipelines that share one manifest each process new files
+once, and each drop the results of a removed file from their own
+output, whichever of them runs first after the removal.
+
+    pytest tests/test_manifest.py
+"""
+
+pytest.importorskip('articledownloader.articledownloader')
+pytest.importorskip('pybliometrics.scopus')
+
+from text_mining_tools.corpus import iter_corpus
+from text_mining_tools.manifest import Manifest
+
+FIXTURE_CORPUS = os.path.join(os.path.dirname(__file__), 'fixtures', 'corpus')
+PIPELINES = ['thermal', 'solvent']
+REMOVED_DOI = '10.1039/c9sc00001a'
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    basepath = str(tmp_path / 'corpus')
+    shutil.copytree(FIXTURE_CORPUS, basepath)
+    return basepath
+
+
+def run_pipeline(basepath, pipeline, output):
+    # As the MOF stability scripts do: process the pending files,
+    # drop the removed ones, write the output, then save the manifest.
+    # Returns the DOIs processed.
+    manifest = Manifest(basepath)
+    processed = []
+    for handle in manifest.pending(pipeline, '1', iter_corpus(basepath)):
+        output[handle.doi] = pipeline
+        processed.append(handle.doi)
+        manifest.mark_done(pipeline, '1', handle)
+    removed = manifest.missing(pipeline)
+    for doi in removed:
+        output.pop(doi, None)
+    manifest.forget(pipeline, removed)
+    manifest.save()
+    return processed
+
+
+def test_pipelines_forget_removed_file(corpus):
+    outputs = dict((pipeline, {}) for pipeline in PIPELINES)
+    dois = sorted(handle.doi for handle in iter_corpus(corpus))
+    for pipeline in PIPELINES:
+        assert sorted(run_pipeline(corpus, pipeline, outputs[pipeline])) == dois
+    for pipeline in PIPELINES:
+        assert run_pipeline(corpus, pipeline, outputs[pipeline]) == []
+
+    os.remove(os.path.join(corpus, REMOVED_DOI+'.html'))
+    run_pipeline(corpus, 'thermal', outputs['thermal'])
+    assert REMOVED_DOI not in outputs['thermal']
+    # The other pipeline still has it, so the file record is kept.
+    manifest = Manifest(corpus)
+    assert REMOVED_DOI in manifest.files
+
+    run_pipeline(corpus, 'solvent', outputs['solvent'])
+    assert REMOVED_DOI not in outputs['solvent']
+    manifest = Manifest(corpus)
+    assert REMOVED_DOI not in manifest.files
+    for pipeline in PIPELINES:
+        assert sorted(outputs[pipeline]) == [doi for doi in dois if doi != REMOVED_DOI]
+
+
+def test_reset_processes_every_file_again(corpus):
+    run_pipeline(corpus, 'thermal', {})
+    manifest = Manifest(corpus)
+    manifest.reset('thermal')
+    manifest.save()
+    assert len(run_pipeline(corpus, 'thermal', {})) == len(os.listdir(FIXTURE_CORPUS))
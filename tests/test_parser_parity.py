@@ -0,0 +1,87 @@
+import os
+import shutil
+import pytest
+from bs4.builder import builder_registry
+"""
+Parser parity: every extractor gives the same output with each
+installed parser backend as with html.parser, on small fixture pages
+of each supported publisher (tests/fixtures/corpus, laid out as a
+corpus: <doi prefix>/<rest of doi>.html).
+
+    pytest tests/test_parser_parity.py
+"""
+
+pytest.importorskip('articledownloader.articledownloader')
+pytest.importorskip('pybliometrics.scopus')
+
+from text_mining_tools.article import Article, PARSER_BACKENDS, FALLBACK_PARSER
+from text_mining_tools.ingest import records_equal
+from text_mining_tools.sentence_tokenizer import SentenceTokenizer, default_tokenizer, load_punkt
+
+FIXTURE_CORPUS = os.path.join(os.path.dirname(__file__), 'fixtures', 'corpus')
+FIXTURE_DOIS = {'acs': '10.1021/jacs.9b00001',
+                'rsc': '10.1039/c9sc00001a',
+                'wiley': '10.1002/anie.201900001',
+                'nature': '10.1038/s41557-019-0001-1'}
+OTHER_PARSERS = [val for val in PARSER_BACKENDS if val != FALLBACK_PARSER]
+
+
+def fixture_tokenizer():
+    # Punkt, as by default, if its NLTK data is installed. Else the
+    # rule-based splitter, which the parser comparison does not
+    # depend on.
+    try:
+        load_punkt()
+        return default_tokenizer
+    except LookupError:
+        return SentenceTokenizer('rules')
+
+
+TOKENIZER = fixture_tokenizer()
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # A copy of the fixtures, as Articles may write next to them.
+    basepath = str(tmp_path / 'corpus')
+    shutil.copytree(FIXTURE_CORPUS, basepath)
+    return basepath
+
+
+def analyze(doi, basepath, parser):
+    article = Article(doi, basepath, download=False, parser=parser)
+    article.sentence_tokenizer = TOKENIZER
+    article.full_analysis()
+    return article.to_record()
+
+
+@pytest.mark.parametrize('publisher', sorted(FIXTURE_DOIS))
+def test_fixture_is_extracted(corpus, publisher):
+    # The fixtures exercise the getters of their publisher.
+    record = analyze(FIXTURE_DOIS[publisher], corpus, FALLBACK_PARSER)
+    assert record['title']
+    assert len(record['authors']) > 0
+    assert len(record['abstract_sentences']) > 0
+    assert len(record['section_name_dict']) >= 2
+    assert len(record['section_text_dict_sentences']) >= 1
+    assert len(record['citation_dict']) > 0
+    assert len(record['full_paper_sentences']) > 0
+
+
+@pytest.mark.parametrize('parser', OTHER_PARSERS)
+@pytest.mark.parametrize('publisher', sorted(FIXTURE_DOIS))
+def test_parser_parity(corpus, publisher, parser):
+    if builder_registry.lookup(parser) is None:
+        pytest.skip(parser+' is not installed.')
+    doi = FIXTURE_DOIS[publisher]
+    reference = analyze(doi, corpus, FALLBACK_PARSER)
+    record = analyze(doi, corpus, parser)
+    # lxml drops the whitespace between the doctype and <html>, which
+    # html.parser keeps at the start of the full paper text. Only the
+    # raw full_paper string sees it (its sentences do not).
+    for output in [reference, record]:
+        output['full_paper'] = (output['full_paper'] or '').strip()
+    differing = [field for field in reference
+                 if not records_equal(record[field], reference[field])]
+    assert differing == [], (parser+' differs from '+FALLBACK_PARSER+' on '+doi+
+                             ' in '+', '.join(differing))
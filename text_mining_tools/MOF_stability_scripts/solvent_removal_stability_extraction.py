@@ -10,6 +10,9 @@ from chemdataextractor import Document
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from nltk.corpus import wordnet as wn
 import chemdataextractor
+from text_mining_tools.keyword_matcher import KeywordMatcher
+from text_mining_tools.corpus import iter_corpus
+from text_mining_tools.manifest import Manifest
 from textblob import TextBlob
 import os
 import re
@@ -26,62 +29,80 @@ nlp = stanza.Pipeline('en')
 #### Lastly, we define keywords for collapse, stability, and solvent.
 
 basedir = '/Users/adityanandy/Documents/MIT/Kulik/TextMining/Papers/CoRECorpus/'
+# Only new or changed files are processed (see manifest.py). Their results are
+# merged into the existing output. Bump PIPELINE_VERSION when this script changes
+# what it extracts, to process every file again. The output is kept next to the
+# manifest, in basedir/AnalyzedResults.
+PIPELINE = 'solvent_removal_stability_extraction'
+PIPELINE_VERSION = '1'
+manifest = Manifest(basedir)
+output_filename = os.path.join(basedir, 'AnalyzedResults', 'collapse_keyword_searches.json')
 solvent_keyword_dict = {}
+if os.path.exists(output_filename):
+    with open(output_filename) as g:
+        solvent_keyword_dict = json.load(g)
+else:
+    # Without the output, nothing this script processed before is kept.
+    manifest.reset(PIPELINE)
 single_word_collapse = ['collaps', 'deform','amorph','blockage','degrad','transform','unstable','instability','destroy', 'one step weight', 
                         'one-step weight','one‐step weight', 'single-step weight','single‐step weight','single step weight','one weight']
 single_word_stable = ['stability',' stable','integrity','preserv','transparency','crystallinity','coordinatively unsaturat','porosity',
                       'microporosity','retain','maintain','two step weight','two-step weight','two‐step weight','second weight','third weight','two weight']
 single_word_solvent = ['solvent','solvate', 'guest', 'desolv','remov','capillary','activat','evacuat','dehydrat','eliminat', 'lose', 'losing',
                        'water','DMF', 'DMA','DEF','H2O','EtOH','MeOH','ethanol','methylamine','diamine','formamide','pyrrolidone']
+# All three keyword lists are screened in one pass per sentence.
+keyword_matcher = KeywordMatcher({'solvent': single_word_solvent,
+                                  'collapse': single_word_collapse,
+                                  'stable': single_word_stable})
+
+#### Phrases that flag false positives. Each list is compiled once into a matcher.
+linker_phrase_matcher = KeywordMatcher(['decomposition of the organic', 'decomposition of the linker',
+                                        'linker combustion'])
+water_phrase_matcher = KeywordMatcher(['soak', 'suspend', 'boil', 'water stability', 'water-stability',
+                                       'water stable', 'water-stable', 'exposure to water', 'stable to water',
+                                       'stable in water', 'water unstable', 'water instability',
+                                       'stability to water', 'water treatment', 'hydrothermal stability'])
+air_phrase_matcher = KeywordMatcher(['air stability', 'air-stability', 'air stable', 'air-stable',
+                                     'exposure to air', 'stable to air', 'stability to air'])
+fake_loss_matcher = KeywordMatcher(['loss of crystallinity', 'crystallinity loss', 'crystallinity is lost',
+                                    'loss of porosity', 'loss of microporosity', 'porosity loss',
+                                    'porosity is lost'])
+block_phrase_matcher = KeywordMatcher(['building block', 'd-block', 'd block'])
+bond_activation_matcher = KeywordMatcher(['bond activation', 'unsaturated bonds', 'activated bonds',
+                                          'C-H activation', 'C-C activation', 'C=C activation',
+                                          'activated C–H', 'small molecule activation',
+                                          'oxygen activation'])
+decomposed_guest_matcher = KeywordMatcher(['decomposition product', 'solvent decomposition',
+                                           'guest decomposition', 'solvent decompose',
+                                           'guest decompose'])
 
 
 def organic_linker_phrase(temp_sent):
     '''
     This identifies when there is an organic linker decomposition phrase.
     '''
-    if (('decomposition of the organic' in temp_sent) or ('decomposition of the linker' in temp_sent) 
-        or ('decomposition of the linker' in temp_sent) or ('linker combustion' in temp_sent)):
-        linker_decomposed = True
-    else:
-        linker_decomposed = False
+    linker_decomposed = linker_phrase_matcher.search(temp_sent)
     return linker_decomposed
 
 def water_phrase(temp_sent):
     '''
     This identifies when there is an water related phrase --> for water stability identification to eliminate false positives.
     '''
-    if (('soak' in temp_sent) or ('suspend' in temp_sent) or ('boil' in temp_sent)):
-        water = True
-    elif (('water stability' in temp_sent) or ('water-stability' in temp_sent) or ('water stable' in temp_sent) or 
-        ('water-stable' in temp_sent) or ('exposure to water' in temp_sent) or ('stable to water' in temp_sent) or 
-        ('stable in water' in temp_sent) or ('water unstable' in temp_sent) or ('water instability' in temp_sent) or 
-        ('stability to water' in temp_sent) or ('water treatment' in temp_sent) or ('hydrothermal stability' in temp_sent)):
-        water = True
-    else:
-        water = False
+    water = water_phrase_matcher.search(temp_sent)
     return water
 
 def air_phrase(temp_sent):
     '''
     This identifies when there is an air related phrase --> for air stability identification to eliminate false positives.
     '''
-    if (('air stability' in temp_sent) or ('air-stability' in temp_sent) or ('air stable' in temp_sent) or 
-        ('air-stable' in temp_sent) or ('exposure to air' in temp_sent) or ('stable to air' in temp_sent) or 
-        ('stability to air' in temp_sent)):
-        air = True
-    else:
-        air = False
+    air = air_phrase_matcher.search(temp_sent)
     return air
 
 def check_fake_loss(temp_sent):
     '''
     This identifies when a "loss" keyword is not loss of solvent, but rather loss of crystallinity.
     '''
-    if (('loss of crystallinity' in temp_sent) or ('crystallinity loss' in temp_sent) or ('crystallinity is lost' in temp_sent) or 
-        ('loss of porosity' in temp_sent) or ('loss of microporosity' in temp_sent) or ('porosity loss' in temp_sent) or ('porosity is lost' in temp_sent)):
-        fake = True
-    else:
-        fake = False
+    fake = fake_loss_matcher.search(temp_sent)
     return fake
 
 def check_fake_kw(temp_sent):
@@ -92,21 +113,17 @@ def check_fake_kw(temp_sent):
     bad = False
     if ('activ' in temp_sent) and ('carbon' in temp_sent):
         bad = True
-    if ('building block' in temp_sent) or ('d-block' in temp_sent) or ('d block' in temp_sent):
+    if block_phrase_matcher.search(temp_sent):
         bad = True
     if ('unsaturated bond' in temp_sent):
         bad = True
-    if ('activ' in temp_sent) and (('bond activation' in temp_sent) or ('unsaturated bonds' in temp_sent) or 
-       ('activated bonds' in temp_sent) or ('C-H activation' in temp_sent) or ('C-C activation' in temp_sent) or 
-       ('C=C activation' in temp_sent) or ('activated C–H' in temp_sent) or ('small molecule activation' in temp_sent) or
-       ('oxygen activation' in temp_sent)):
+    if ('activ' in temp_sent) and bond_activation_matcher.search(temp_sent):
         bad = True 
     if ('deactivation' in temp_sent):
         bad = True
     if ('inactivation' in temp_sent):
         bad = True
-    if (('decomposition product' in temp_sent) or ('solvent decomposition' in temp_sent) or ('guest decomposition' in temp_sent)
-        or ('solvent decompose' in temp_sent) or ('guest decompose' in temp_sent)):
+    if decomposed_guest_matcher.search(temp_sent):
         bad = True
     if ('stable' in temp_sent) and ('homogeneous catalyst' in temp_sent):
         bad = True
@@ -246,150 +263,157 @@ def check_dependencies_given_solvent(sent, collapse, stable):
             reason = 'TGA sentence, rule based parsing will fail for multistep procedure'
     return solvent_removal_flag, reason
 
-for journal in os.listdir(basedir):
-    if not os.path.isdir(basedir+journal):
-        continue
-    for article in os.listdir(basedir+'/'+journal):
-        if 'html' not in article:
+# Walks the corpus in the same order on every run, one file at a time (see corpus.py).
+for handle in manifest.pending(PIPELINE, PIPELINE_VERSION, iter_corpus(basedir)):
+    journal, article = handle.prefix, handle.filename
+    print(article)
+    print('--------')
+    f = handle.open()
+    doc = Document.from_file(f)
+    # Use Chem Data Extractor to tokenize the sections
+    cwt = ChemWordTokenizer()
+    header_counter = 0
+    sent_counter = 0
+    length_counter = 0
+    header_list = []
+    flag = False
+    title = False
+    intro_found = False
+    search_results = []
+    current_heading = 'nothing'
+    for elem in doc.elements:
+        # First store the title
+        if isinstance(elem,chemdataextractor.doc.text.Title):
+            title = elem.text
             continue
-        print(article)
-        print('--------')
-        f = open(basedir+journal+'/'+article, 'rb')
-        doc = Document.from_file(f)
-        # Use Chem Data Extractor to tokenize the sections
-        cwt = ChemWordTokenizer()
-        header_counter = 0
-        sent_counter = 0
-        length_counter = 0
-        header_list = []
-        flag = False
-        title = False
-        intro_found = False
-        search_results = []
-        current_heading = 'nothing'
-        for elem in doc.elements:
-            # First store the title
-            if isinstance(elem,chemdataextractor.doc.text.Title):
-                title = elem.text
+        # Look for the headers that may not be relevant (E.g. supporting info, supplementary info, citations, etc.)
+        if isinstance(elem,chemdataextractor.doc.text.Heading):
+            if (('reference' in elem.text.lower()) or ('crossref' in elem.text.lower()) or ('citation' in elem.text.lower()) or 
+                ('citing' in elem.text.lower()) or ('supporting' in elem.text.lower()) or ('supplementary' in elem.text.lower())):
+                flag = True
+            else:
+                flag = False
+            if flag:
+                # If those sections are identified, skip that part for now.
                 continue
-            # Look for the headers that may not be relevant (E.g. supporting info, supplementary info, citations, etc.)
-            if isinstance(elem,chemdataextractor.doc.text.Heading):
-                if (('reference' in elem.text.lower()) or ('crossref' in elem.text.lower()) or ('citation' in elem.text.lower()) or 
-                    ('citing' in elem.text.lower()) or ('supporting' in elem.text.lower()) or ('supplementary' in elem.text.lower())):
-                    flag = True
-                else:
-                    flag = False
-                if flag:
-                    # If those sections are identified, skip that part for now.
-                    continue
-                # Check to see if an introduction exists
-                if 'intro' in elem.text.lower():
-                    intro_found = True
-                    current_heading = 'intro'
-                    for i, sentence in enumerate(elem.sentences):
-                        print(sentence)
-                        sent_counter += 1
-                        length_counter += len(sentence.text)
-                else: 
-                    current_heading = 'nothing'
-                header_list.append(elem.text)
-                header_counter += 1
-            elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (current_heading=='intro'):
+            # Check to see if an introduction exists
+            if 'intro' in elem.text.lower():
+                intro_found = True
+                current_heading = 'intro'
                 for i, sentence in enumerate(elem.sentences):
+                    print(sentence)
                     sent_counter += 1
                     length_counter += len(sentence.text)
-            elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (current_heading=='nothing'):
-                if ('ARTICLE SECTIONS' in elem.text) or (elem.text == 'Jump To'):
+            else: 
+                current_heading = 'nothing'
+            header_list.append(elem.text)
+            header_counter += 1
+        elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (current_heading=='intro'):
+            for i, sentence in enumerate(elem.sentences):
+                sent_counter += 1
+                length_counter += len(sentence.text)
+        elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (current_heading=='nothing'):
+            if ('ARTICLE SECTIONS' in elem.text) or (elem.text == 'Jump To'):
+                continue
+            checked = set()
+            for sentence in elem.sentences:
+                # For each sentence, first check for false positive phrases.
+                linker_bool = organic_linker_phrase(sentence.text)
+                water_bool = water_phrase(sentence.text)
+                air_bool = air_phrase(sentence.text)
+                fake = check_fake_kw(sentence.text)
+                if (linker_bool or water_bool or fake or air_bool):
+                    # skip if any of the phrases are false positives
                     continue
-                checked = set()
-                for sentence in elem.sentences:
-                    # For each sentence, first check for false positive phrases.
-                    linker_bool = organic_linker_phrase(sentence.text)
-                    water_bool = water_phrase(sentence.text)
-                    air_bool = air_phrase(sentence.text)
-                    fake = check_fake_kw(sentence.text)
-                    if (linker_bool or water_bool or fake or air_bool):
-                        # skip if any of the phrases are false positives
-                        continue
 
-                    ### Next, check for the keywords we would care about 
-                    solvent_check = [val for val in single_word_solvent if val in sentence.text]
-                    collapse_check = [val for val in single_word_collapse if val in sentence.text]
-                    stable_check = [val for val in single_word_stable if val in sentence.text]
+                ### Next, check for the keywords we would care about 
+                found = keyword_matcher.found_by_label(sentence.text)
+                solvent_check = found['solvent']
+                collapse_check = found['collapse']
+                stable_check = found['stable']
 
-                    if (len(solvent_check) == 1) and ('loss' in solvent_check):
-                        # Make sure solvent identification isnt only "loss of crystallinity" because of the word "loss"
-                        fake_loss = check_fake_loss(sentence.text)
-                        if fake_loss:
-                            # If it is, skip...
-                            continue
-                    if any(['stable' in val for val in stable_check]):
-                        for val in stable_check:
-                            # remove substring matches for stable that don't mean what we want.
-                            if 'unstable' in val:
-                                stable_check.remove(val)
-                            if 'instable' in val:
-                                stable_check.remove(val)
-                            if 'adjustable' in val:
-                                stable_check.remove(val)
-                    if any(['stability' in val for val in stable_check]):
-                        for val in stable_check:
-                            # remove substring matches for stable that don't mean what we want.
-                            if 'instability' in val:
-                                stable_check.remove(val)
-                    if any(['activat' in val for val in solvent_check]):
-                        for val in solvent_check:
-                            # remove substring matches for stable that don't mean what we want.
-                            if 'deactivat' in val:
-                                solvent_check.remove(val)
-                    if (len(collapse_check) == 0) and (len(stable_check) == 0):
-                        # If we do not have any words that are stable keywords or collapse keywords, continue. We cannot determine stability.
-                        sent_counter += 1
-                        length_counter += len(sentence.text)
+                if (len(solvent_check) == 1) and ('loss' in solvent_check):
+                    # Make sure solvent identification isnt only "loss of crystallinity" because of the word "loss"
+                    fake_loss = check_fake_loss(sentence.text)
+                    if fake_loss:
+                        # If it is, skip...
                         continue
-                    elif (len(solvent_check)>0) and ((len(collapse_check)>0) or (len(stable_check)>0)):
-                        # Case where both solvent and stability info present. We can attempt to assign a label here.
-                        solvent = True
-                        stability = True
-                        # For the cases that look promising, do the dependency parsing to analyze everything.
-                        solvent_removal_flag, reason = check_dependencies_given_solvent(sentence.text, collapse_check, stable_check)
-                        if solvent_removal_flag == -100:
-                            solvent = False
-                            stability = True
-                            solvent_removal_flag = 0
-                            solvent_check = []
-                    elif (len(solvent_check)==0) and ((len(collapse_check)>0) or (len(stable_check)>0)):
-                        # Case where only stability info present.
-                        solvent_removal_flag = 0
-                        solvent = False
-                        stability = True
-                        reason = 'no solvent kw'
-                    # Perform sentiment analysis with textblob and VADER to store the information for later use
-                    sid = SentimentIntensityAnalyzer()
-                    ss = sid.polarity_scores(sentence.text)
-                    textblob_sentiment = TextBlob(sentence.text)
-                    textblob_sentiment.correct()
-                    textblob_dict = {'polarity':textblob_sentiment.sentiment.polarity, 'subjectivity':textblob_sentiment.sentiment.subjectivity}
-                    search_results.append({'filename': journal+'/'+article,
-                                                       'title': title,
-                                                       'sentence': sentence.text, 
-                                                       'sentence_counter': sent_counter,
-                                                       'stability_keyword': stable_check,
-                                                       'collapse_keyword': collapse_check,
-                                                       'solvent_keyword': solvent_check,
-                                                       'solvent_removal_flag': solvent_removal_flag,
-                                                       'solvent_removal_flag_reason': reason,
-                                                       'solvent': solvent,
-                                                       'stability': stability,
-                                                       'VADER': ss,
-                                                       'TEXTBLOB':textblob_dict})
+                if any(['stable' in val for val in stable_check]):
+                    for val in stable_check:
+                        # remove substring matches for stable that don't mean what we want.
+                        if 'unstable' in val:
+                            stable_check.remove(val)
+                        if 'instable' in val:
+                            stable_check.remove(val)
+                        if 'adjustable' in val:
+                            stable_check.remove(val)
+                if any(['stability' in val for val in stable_check]):
+                    for val in stable_check:
+                        # remove substring matches for stable that don't mean what we want.
+                        if 'instability' in val:
+                            stable_check.remove(val)
+                if any(['activat' in val for val in solvent_check]):
+                    for val in solvent_check:
+                        # remove substring matches for stable that don't mean what we want.
+                        if 'deactivat' in val:
+                            solvent_check.remove(val)
+                if (len(collapse_check) == 0) and (len(stable_check) == 0):
+                    # If we do not have any words that are stable keywords or collapse keywords, continue. We cannot determine stability.
                     sent_counter += 1
                     length_counter += len(sentence.text)
+                    continue
+                elif (len(solvent_check)>0) and ((len(collapse_check)>0) or (len(stable_check)>0)):
+                    # Case where both solvent and stability info present. We can attempt to assign a label here.
+                    solvent = True
+                    stability = True
+                    # For the cases that look promising, do the dependency parsing to analyze everything.
+                    solvent_removal_flag, reason = check_dependencies_given_solvent(sentence.text, collapse_check, stable_check)
+                    if solvent_removal_flag == -100:
+                        solvent = False
+                        stability = True
+                        solvent_removal_flag = 0
+                        solvent_check = []
+                elif (len(solvent_check)==0) and ((len(collapse_check)>0) or (len(stable_check)>0)):
+                    # Case where only stability info present.
+                    solvent_removal_flag = 0
+                    solvent = False
+                    stability = True
+                    reason = 'no solvent kw'
+                # Perform sentiment analysis with textblob and VADER to store the information for later use
+                sid = SentimentIntensityAnalyzer()
+                ss = sid.polarity_scores(sentence.text)
+                textblob_sentiment = TextBlob(sentence.text)
+                textblob_sentiment.correct()
+                textblob_dict = {'polarity':textblob_sentiment.sentiment.polarity, 'subjectivity':textblob_sentiment.sentiment.subjectivity}
+                search_results.append({'filename': journal+'/'+article,
+                                                   'title': title,
+                                                   'sentence': sentence.text, 
+                                                   'sentence_counter': sent_counter,
+                                                   'stability_keyword': stable_check,
+                                                   'collapse_keyword': collapse_check,
+                                                   'solvent_keyword': solvent_check,
+                                                   'solvent_removal_flag': solvent_removal_flag,
+                                                   'solvent_removal_flag_reason': reason,
+                                                   'solvent': solvent,
+                                                   'stability': stability,
+                                                   'VADER': ss,
+                                                   'TEXTBLOB':textblob_dict})
+                sent_counter += 1
+                length_counter += len(sentence.text)
+
+            ### At this point, we have the text that we need to search through for matches.
+    # Next, store the data in a dictionary. Each article has one dictionary tied to it.
+    temp_dict = {'intro':intro_found,'num_sections':header_counter, 'sections':header_list,'num_sentences':sent_counter,'num_char':length_counter, 'search_results':search_results}
+    solvent_keyword_dict[journal+'/'+article] = temp_dict
+    manifest.mark_done(PIPELINE, PIPELINE_VERSION, handle)
 
-                ### At this point, we have the text that we need to search through for matches.
-        # Next, store the data in a dictionary. Each article has one dictionary tied to it.
-        temp_dict = {'intro':intro_found,'num_sections':header_counter, 'sections':header_list,'num_sentences':sent_counter,'num_char':length_counter, 'search_results':search_results}
-        solvent_keyword_dict[journal+'/'+article] = temp_dict
+# Drop the results of files that were removed from the corpus.
+removed = manifest.missing(PIPELINE)
+for doi in removed:
+    solvent_keyword_dict.pop(doi+'.html', None)
+manifest.forget(PIPELINE, removed)
 
-with open('collapse_keyword_searches.json','w') as g:
+with open(output_filename,'w') as g:
     json.dump(solvent_keyword_dict,g)
+# Saved after the output, so files are only marked done once their results are written.
+manifest.save()
@@ -11,9 +11,11 @@ from chemdataextractor.nlp.pos import ChemCrfPosTagger
 from chemdataextractor import Document
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from nltk.corpus import wordnet as wn
+from text_mining_tools.keyword_matcher import KeywordMatcher
+from text_mining_tools.corpus import iter_corpus
+from text_mining_tools.manifest import Manifest
 import chemdataextractor
 import os
-import re
 import json
 
 
@@ -22,98 +24,119 @@ import json
 #### We also start the dictionary that we will fill up by manuscript
 #### Lastly, we define keywords for TGA identification. We also define units.
 basedir = '/Users/adityanandy/Documents/MIT/Kulik/TextMining/Papers/CoRECorpus/'
+# Only new or changed files are processed (see manifest.py). Their results are
+# merged into the existing output. Bump PIPELINE_VERSION when this script changes
+# what it extracts, to process every file again. The output is kept next to the
+# manifest, in basedir/AnalyzedResults.
+PIPELINE = 'thermal_stability_extraction'
+PIPELINE_VERSION = '1'
+manifest = Manifest(basedir)
+output_filename = os.path.join(basedir, 'AnalyzedResults', 'thermal_decomposition_keyword_searches.json')
 thermal_keyword_dict = {}
+if os.path.exists(output_filename):
+    with open(output_filename) as g:
+        thermal_keyword_dict = json.load(g)
+else:
+    # Without the output, nothing this script processed before is kept.
+    manifest.reset(PIPELINE)
 phrases_to_search_for = ['TGA','TG', 'thermogravimetric analysis', 'thermo-gravimetric analysis', 'thermal analysis',
                          'thermal gravimetric','thermal-gravimetric', 'thermo gravimetric', 
                          'thermalgravimetric analysis', 'weight loss', 'temperature range', 'mass loss','decomposition']
 units = ['°C','° C','degC','°F','° F','degF', '°K','° K','degK', 'K']
+# Compiled once, each finds all of its keywords in one pass per sentence.
+phrase_matcher = KeywordMatcher(phrases_to_search_for, ignore_case=True)
+unit_matcher = KeywordMatcher(units)
 
-for journal in os.listdir(basedir):
-    if not os.path.isdir(basedir+journal):
-        continue
-    for article in os.listdir(basedir+'/'+journal):
-        if 'html' not in article:
-            continue
-        header_counter = 0
-        sent_counter = 0
-        length_counter = 0
-        found_intro = False
-        header_list = []
-        f = open(basedir+journal+'/'+article, 'rb')
-        # Use chem data extractor to parse the file
-        doc = Document.from_file(f)
-        flag = False
-        title = False
-        search_results = []
-        heading = 'nothing'
-        # Look through the sections as identified by ChemDataExtractor
-        for elem in doc.elements:
-            if isinstance(elem,chemdataextractor.doc.text.Title):
-                title = elem.text
-            if isinstance(elem,chemdataextractor.doc.text.Heading):
-                # Skip the sections that are the references or the links
-                if ('additional links' in elem.text.lower()) or ('references' in elem.text.lower()):
-                    flag = True
-                else: 
-                    flag = False
-                if flag:
-                    # Skip unnecessary sections
-                    continue
-                # Next identify introductions
-                if 'intro' in elem.text.lower():
-                    found_intro = True
-                    # count sentences then move on, do not allow them to be mined.
-                    print('==== INTRO ====')
-                    heading = 'intro'
-                    for i, sent in enumerate(elem.sentences):
-                        sent_counter += 1
-                        length_counter += len(sent.text)
-                else:
-                    heading = 'nothing'
-                header_list.append(elem.text)
-                header_counter += 1
-            elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (heading=='intro'):
-                for i, sentence in enumerate(elem.sentences):
-                    sent_counter += 1
-                    length_counter += len(sentence.text)
-            # If not an introduction or an irrelevant section, perform analysis
-            elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (heading == 'nothing'):
+# Walks the corpus in the same order on every run, one file at a time (see corpus.py).
+for handle in manifest.pending(PIPELINE, PIPELINE_VERSION, iter_corpus(basedir)):
+    journal, article = handle.prefix, handle.filename
+    header_counter = 0
+    sent_counter = 0
+    length_counter = 0
+    found_intro = False
+    header_list = []
+    f = handle.open()
+    # Use chem data extractor to parse the file
+    doc = Document.from_file(f)
+    flag = False
+    title = False
+    search_results = []
+    heading = 'nothing'
+    # Look through the sections as identified by ChemDataExtractor
+    for elem in doc.elements:
+        if isinstance(elem,chemdataextractor.doc.text.Title):
+            title = elem.text
+        if isinstance(elem,chemdataextractor.doc.text.Heading):
+            # Skip the sections that are the references or the links
+            if ('additional links' in elem.text.lower()) or ('references' in elem.text.lower()):
+                flag = True
+            else: 
+                flag = False
+            if flag:
+                # Skip unnecessary sections
+                continue
+            # Next identify introductions
+            if 'intro' in elem.text.lower():
+                found_intro = True
+                # count sentences then move on, do not allow them to be mined.
+                print('==== INTRO ====')
+                heading = 'intro'
                 for i, sent in enumerate(elem.sentences):
-                    for j, kw in enumerate(phrases_to_search_for):
-                        if re.search(kw, sent.text, re.IGNORECASE):
-                            temp_flag = True
-                            count_down_limit = 8
-                            count_down_flag = 0
-                            to_analyze = []
-                            sentence_idx_list = []
-                            # Check the nearest 8 sentences and store them in case they are useful later.
-                            while count_down_flag <= count_down_limit:
-                                try:
-                                    new_sentence = elem.sentences[i+count_down_flag]
-                                except:
-                                    count_down_flag += 1
-                                    continue
-                                for unit in units:
-                                    if unit in new_sentence.text:
-                                        sentence_idx_list.append(sent_counter+i+count_down_flag)
-                                        to_analyze.append(new_sentence.text)
-                                count_down_flag += 1
-                            if len(to_analyze) == 0:
-                                # if there is nothing to analyze, continue
-                                continue
-                            search_results.append({'filename': journal+'/'+article,
-                                                   'title': title,
-                                                   'sentence': sent.text, 
-                                                   'sentence_counter': sent_counter,
-                                                   'keyword': kw,
-                                                   'additional_sentences': to_analyze,
-                                                   'additional_sentence_idxs':sentence_idx_list})
                     sent_counter += 1
                     length_counter += len(sent.text)
-                    ### we now have everything we could need from this manuscript
-        # Next, store the data in a dictionary. Each article has one dictionary tied to it.
-        temp_dict = {'num_sections':header_counter, 'sections':header_list,'num_sentences':sent_counter,'num_char':length_counter, 'search_results':search_results,'intro':found_intro}
-        thermal_keyword_dict[journal+'/'+article] = temp_dict
+            else:
+                heading = 'nothing'
+            header_list.append(elem.text)
+            header_counter += 1
+        elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (heading=='intro'):
+            for i, sentence in enumerate(elem.sentences):
+                sent_counter += 1
+                length_counter += len(sentence.text)
+        # If not an introduction or an irrelevant section, perform analysis
+        elif isinstance(elem,chemdataextractor.doc.text.Paragraph) and (heading == 'nothing'):
+            for i, sent in enumerate(elem.sentences):
+                for kw in phrase_matcher.found(sent.text):
+                    temp_flag = True
+                    count_down_limit = 8
+                    count_down_flag = 0
+                    to_analyze = []
+                    sentence_idx_list = []
+                    # Check the nearest 8 sentences and store them in case they are useful later.
+                    while count_down_flag <= count_down_limit:
+                        try:
+                            new_sentence = elem.sentences[i+count_down_flag]
+                        except:
+                            count_down_flag += 1
+                            continue
+                        for unit in unit_matcher.found(new_sentence.text):
+                            sentence_idx_list.append(sent_counter+i+count_down_flag)
+                            to_analyze.append(new_sentence.text)
+                        count_down_flag += 1
+                    if len(to_analyze) == 0:
+                        # if there is nothing to analyze, continue
+                        continue
+                    search_results.append({'filename': journal+'/'+article,
+                                           'title': title,
+                                           'sentence': sent.text, 
+                                           'sentence_counter': sent_counter,
+                                           'keyword': kw,
+                                           'additional_sentences': to_analyze,
+                                           'additional_sentence_idxs':sentence_idx_list})
+                sent_counter += 1
+                length_counter += len(sent.text)
+                ### we now have everything we could need from this manuscript
+    # Next, store the data in a dictionary. Each article has one dictionary tied to it.
+    temp_dict = {'num_sections':header_counter, 'sections':header_list,'num_sentences':sent_counter,'num_char':length_counter, 'search_results':search_results,'intro':found_intro}
+    thermal_keyword_dict[journal+'/'+article] = temp_dict
+    manifest.mark_done(PIPELINE, PIPELINE_VERSION, handle)
+
+# Drop the results of files that were removed from the corpus.
+removed = manifest.missing(PIPELINE)
+for doi in removed:
+    thermal_keyword_dict.pop(doi+'.html', None)
+manifest.forget(PIPELINE, removed)
 
-with open('thermal_decomposition_keyword_searches.json','w') as g:
+with open(output_filename,'w') as g:
     json.dump(thermal_keyword_dict,g)
+# Saved after the output, so files are only marked done once their results are written.
+manifest.save()
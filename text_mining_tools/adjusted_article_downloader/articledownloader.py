@@ -1,29 +1,586 @@
 import requests
+from requests.adapters import HTTPAdapter
 from requests.utils import quote
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from email.utils import parsedate_to_datetime
 import re
 import json
+import gzip
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 import articledownloader.scrapers
 from autologging import logged, traced
 from csv import reader
 from time import sleep
+try:
+  import fcntl
+except ImportError:
+  # No file locks (Windows): the rate limits are only shared by the threads of a process.
+  fcntl = None
+
+# Where get_html_from_doi fetches articles, by mode. 'doi' is the DOI
+# resolver used by the modes that follow its redirect.
+HTML_BASE_URLS = {
+  'doi': 'https://doi.org/',
+  'springer': 'http://link.springer.com/',
+  'wiley': 'http://onlinelibrary.wiley.com/doi/',
+  'acs': 'http://pubs.acs.org/doi/full/',
+  'emerald': 'http://www.emeraldinsight.com/doi/full/'
+}
+
+# Responses retried (with backoff) as transient failures. Retry-After
+# is respected on 429 and 503.
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RETRY_AFTER_STATUSES = [429, 503]
+
+class RequestTimings:
+  '''
+  A timing hook that keeps every timing record, and sums them up by host and phase
+
+  downloader = ArticleDownloader(timing_hooks=[timings])
+  '''
+
+  def __init__(self):
+    self.records = []
+    self.lock = threading.Lock()
+
+  def __call__(self, timing):
+    with self.lock:
+      self.records.append(timing)
+
+  def summary(self):
+    '''
+    Returns a dict of (host, phase) -> count, retries, errors, total_sec and mean_sec
+    '''
+    summary = {}
+    with self.lock:
+      records = list(self.records)
+    for timing in records:
+      entry = summary.setdefault((timing['host'], timing['phase']), {
+        'count': 0, 'retries': 0, 'errors': 0, 'total_sec': 0.0})
+      entry['count'] += 1
+      entry['retries'] += 1 if timing.get('attempt') else 0
+      entry['errors'] += 1 if timing.get('error') or (timing['status'] or 0) >= 400 else 0
+      entry['total_sec'] += timing['total_sec']
+    for entry in summary.values():
+      entry['mean_sec'] = entry['total_sec'] / entry['count']
+    return summary
+
+# Token bucket of each publisher (the mode of the fetch methods) and of
+# the CrossRef API: rate is the starting rate (requests per second),
+# burst the most requests made back to back. The rate is cut on 429/503
+# responses, errors and slow responses (over slow_sec), and raised by
+# step on every other response, within [min_rate, max_rate]. Hosts and
+# publishers not listed get 'default'.
+RATE_LIMITS = {
+  'default': {'rate': 1.0, 'burst': 1, 'min_rate': 0.05, 'max_rate': 2.0, 'step': 0.05, 'slow_sec': 10.0},
+  'crossref': {'rate': 5.0, 'burst': 5, 'min_rate': 0.2, 'max_rate': 20.0, 'step': 0.5, 'slow_sec': 10.0},
+  'elsevier': {'rate': 2.0, 'burst': 2, 'min_rate': 0.1, 'max_rate': 5.0, 'step': 0.1, 'slow_sec': 10.0},
+  'springer': {'rate': 1.0, 'burst': 2, 'min_rate': 0.05, 'max_rate': 3.0, 'step': 0.05, 'slow_sec': 10.0},
+  'nature': {'rate': 1.0, 'burst': 2, 'min_rate': 0.05, 'max_rate': 3.0, 'step': 0.05, 'slow_sec': 10.0},
+  'rsc': {'rate': 1.0, 'burst': 2, 'min_rate': 0.05, 'max_rate': 2.0, 'step': 0.05, 'slow_sec': 10.0},
+  'wiley': {'rate': 0.5, 'burst': 1, 'min_rate': 0.02, 'max_rate': 1.0, 'step': 0.02, 'slow_sec': 10.0},
+  'aaas': {'rate': 0.5, 'burst': 1, 'min_rate': 0.02, 'max_rate': 1.0, 'step': 0.02, 'slow_sec': 10.0},
+  'acs': {'rate': 0.2, 'burst': 1, 'min_rate': 0.02, 'max_rate': 0.5, 'step': 0.01, 'slow_sec': 10.0}
+}
+# Rate cuts (multipliers) on 429/503 responses, and on errors or slow responses.
+RATE_THROTTLED_CUT = 0.5
+RATE_SLOW_CUT = 0.8
+# Shared bucket state older than this, or saved under other limits, is started afresh.
+# RateLimiter().reset() drops the saved state at once.
+RATE_STATE_TTL_SEC = 3600
+RATE_STATE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'articledownloader_rate_limits')
+
+class RateLimiter:
+  '''
+  Adaptive token buckets, one per publisher or host, shared by every thread and
+  (through small locked state files) every process using the same state_dir
+
+  limiter.acquire('wiley')    # waits for a token
+  limiter.update('wiley', response.status_code, latency_sec)
+
+  Adapted rates are saved with the limits they were adapted under, and reloaded for
+  up to RATE_STATE_TTL_SEC by runs with the same limits. A run with other limits
+  starts from its own. limiter.reset() starts every bucket afresh.
+  '''
+
+  def __init__(self, limits=None, state_dir=RATE_STATE_DIRECTORY, shared=True):
+    '''
+    :param limits: Overrides of RATE_LIMITS, by publisher or host
+    :type limits: dict
+    :param state_dir: Directory of the bucket state files shared by processes
+    :type state_dir: str
+    :param shared: Share the buckets with other processes (needs fcntl)
+    :type shared: bool
+    '''
+    self.limits = dict(RATE_LIMITS)
+    for key, limit in (limits or {}).items():
+      self.limits[key] = dict(self.limits.get(key, RATE_LIMITS['default']), **limit)
+    self.state_dir = state_dir
+    self.shared = shared and fcntl is not None
+    if self.shared:
+      os.makedirs(self.state_dir, exist_ok=True)
+    self.buckets = {}
+    self.locks = {}
+    self.locks_lock = threading.Lock()
+
+  def limit(self, key):
+    return self.limits.get(key, self.limits['default'])
+
+  def new_bucket(self, key):
+    limit = self.limit(key)
+    return {'rate': limit['rate'], 'tokens': float(limit['burst']),
+            'updated': time.time(), 'blocked_until': 0.0, 'limit': limit}
+
+  def state_path(self, key):
+    return os.path.join(self.state_dir, re.sub(r'[^\w.-]', '_', key) + '.json')
+
+  @contextmanager
+  def bucket(self, key):
+    '''
+    Holds the bucket of a key, locked against other threads and processes,
+    and saves it on exit
+    '''
+    with self.locks_lock:
+      lock = self.locks.setdefault(key, threading.Lock())
+    with lock:
+      if not self.shared:
+        if key not in self.buckets:
+          self.buckets[key] = self.new_bucket(key)
+        yield self.buckets[key]
+        return
+      fd = os.open(self.state_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+      with os.fdopen(fd, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+          try:
+            bucket = json.loads(f.read())
+          except ValueError:
+            bucket = None
+          if (bucket is None or time.time() - bucket['updated'] > RATE_STATE_TTL_SEC or
+              bucket.get('limit') != self.limit(key)):
+            bucket = self.new_bucket(key)
+          yield bucket
+          f.seek(0)
+          f.truncate()
+          f.write(json.dumps(bucket))
+          f.flush()
+        finally:
+          fcntl.flock(f, fcntl.LOCK_UN)
+
+  def refill(self, key, bucket, now):
+    elapsed = max(0.0, now - bucket['updated'])
+    bucket['tokens'] = min(float(self.limit(key)['burst']), bucket['tokens'] + elapsed * bucket['rate'])
+    bucket['updated'] = now
+
+  def acquire(self, key):
+    '''
+    Waits until the bucket of a key has a token, and takes it
+
+    :returns: the time waited (in seconds)
+    :rtype: float
+    '''
+    waited = 0.0
+    while True:
+      with self.bucket(key) as bucket:
+        now = time.time()
+        self.refill(key, bucket, now)
+        if now >= bucket['blocked_until'] and bucket['tokens'] >= 1:
+          bucket['tokens'] -= 1
+          return waited
+        delay = max(bucket['blocked_until'] - now, (1 - bucket['tokens']) / bucket['rate'])
+      sleep(delay)
+      waited += delay
+
+  def update(self, key, status, latency_sec=None, retry_after=None):
+    '''
+    Adapts the rate of a key to a response: cut on 429/503 (and blocked for
+    Retry-After), errors (status None, or 5xx) and slow responses, raised otherwise
+    '''
+    limit = self.limit(key)
+    with self.bucket(key) as bucket:
+      now = time.time()
+      self.refill(key, bucket, now)
+      if status in RETRY_AFTER_STATUSES:
+        bucket['rate'] *= RATE_THROTTLED_CUT
+        if retry_after:
+          bucket['blocked_until'] = max(bucket['blocked_until'], now + retry_after)
+      elif status is None or status >= 500 or (latency_sec or 0) > limit['slow_sec']:
+        bucket['rate'] *= RATE_SLOW_CUT
+      else:
+        bucket['rate'] += limit['step']
+      bucket['rate'] = min(limit['max_rate'], max(limit['min_rate'], bucket['rate']))
+      return bucket['rate']
+
+  def rate(self, key):
+    with self.bucket(key) as bucket:
+      return bucket['rate']
+
+  def reset(self, key=None):
+    '''
+    Drops the saved bucket of a key (default: every key), adapted rate included
+    '''
+    keys = [key] if key is not None else list(self.buckets)
+    for bucket_key in keys:
+      self.buckets.pop(bucket_key, None)
+    if not self.shared:
+      return
+    if key is None:
+      paths = [os.path.join(self.state_dir, filename) for filename in os.listdir(self.state_dir)
+               if filename.endswith('.json')]
+    else:
+      paths = [self.state_path(key)]
+    for path in paths:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+# Default lifetime of cached API responses (7 days).
+RESPONSE_CACHE_TTL_SEC = 7 * 24 * 3600
+# The CrossRef item fields get_metadata_from_journal_issn reads.
+METADATA_FIELDS = ['DOI', 'ISSN', 'title', 'prefix', 'container-title', 'publisher', 'volume',
+                   'issue', 'page', 'published-print', 'references-count', 'is-referenced-by-count']
+
+def normalize_url(url):
+  '''
+  Normalizes a URL for caching: lowercase scheme and host, sorted query parameters, no fragment
+  '''
+  parts = urlparse(url)
+  query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+  return urlunparse((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.params, query, ''))
+
+class ResponseCache:
+  '''
+  An on-disk cache of API responses (parsed JSON), keyed by normalized request URL.
+  Entries are gzipped JSON files under directory/ab/ab12...ef.json.gz, written to a
+  temporary file and moved into place, so processes can share a cache.
+
+  cache = ResponseCache('/path/to/ResponseCache', ttl_sec=24 * 3600)
+  downloader = ArticleDownloader(response_cache=cache)
+  '''
+
+  def __init__(self, directory, ttl_sec=RESPONSE_CACHE_TTL_SEC, refresh=False):
+    '''
+    :param directory: Where the entries are stored
+    :type directory: str
+    :param ttl_sec: Age after which an entry is fetched again (None = never)
+    :type ttl_sec: float
+    :param refresh: Ignore existing entries (every request is made, and cached again)
+    :type refresh: bool
+    '''
+    self.directory = directory
+    self.ttl_sec = ttl_sec
+    self.refresh = refresh
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    os.makedirs(self.directory, exist_ok=True)
+
+  def key(self, url):
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+  def entry_path(self, url):
+    key = self.key(url)
+    return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+  def get(self, url):
+    '''
+    Returns the cached data of a URL, or None if it is not cached, expired or refresh is set
+    '''
+    data = self.lookup(url)
+    with self.lock:
+      if data is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    return data
+
+  def lookup(self, url):
+    if self.refresh:
+      return None
+    try:
+      with gzip.open(self.entry_path(url), 'rt', encoding='utf-8') as f:
+        entry = json.load(f)
+    except (OSError, EOFError, ValueError):
+      return None
+    if self.ttl_sec is not None and time.time() - entry['time'] > self.ttl_sec:
+      return None
+    return entry['data']
+
+  def put(self, url, data):
+    path = self.entry_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+      json.dump({'url': normalize_url(url), 'time': time.time(), 'data': data}, f)
+    os.replace(temp_path, path)
+
+  def forget(self, url):
+    '''
+    Drops the entry of a URL, so it is fetched again
+    '''
+    try:
+      os.remove(self.entry_path(url))
+    except OSError:
+      pass
+
+  def clear(self):
+    '''
+    Drops every entry. Returns the number of entries dropped.
+    '''
+    n_removed = 0
+    for subdirectory in os.listdir(self.directory):
+      subpath = os.path.join(self.directory, subdirectory)
+      if not os.path.isdir(subpath):
+        continue
+      for filename in os.listdir(subpath):
+        if filename.endswith('.json.gz'):
+          os.remove(os.path.join(subpath, filename))
+          n_removed += 1
+    return n_removed
 
 @logged
 class ArticleDownloader:
 
-  def __init__(self, els_api_key=None, sleep_sec=1, timeout_sec=30):
+  def __init__(self, els_api_key=None, sleep_sec=1, timeout_sec=30, base_urls=None,
+               pool_connections=10, pool_maxsize=10, max_retries=3, backoff_sec=1,
+               max_backoff_sec=60, timing_hooks=None, rate_limits=None, rate_limiter=None,
+               response_cache=None):
     '''
     Initialize and set up API keys
 
     :param els_api_key: API key for Elsevier (for Elsevier's API)
     :type els_api_key: str
-    :param sleep_sec: Sleep time between API calls (default = 1s)
-    :type sleep_sec: int
+    :param sleep_sec: Starting time between calls to a publisher or host with no entry in RATE_LIMITS (default = 1s)
+    :type sleep_sec: float
     :param timeout_sec: Max time before timeout (default = 30s)
     :type timeout_sec: int
+    :param base_urls: Overrides of HTML_BASE_URLS (e.g. a local test server)
+    :type base_urls: dict
+    :param pool_connections: Number of connection pools per host session (default = 10)
+    :type pool_connections: int
+    :param pool_maxsize: Max kept-alive connections per pool (default = 10)
+    :type pool_maxsize: int
+    :param max_retries: Retries of a request after a connection error, timeout or RETRY_STATUSES response (default = 3)
+    :type max_retries: int
+    :param backoff_sec: Base of the exponential backoff between retries (default = 1s)
+    :type backoff_sec: float
+    :param max_backoff_sec: Longest wait before a retry, Retry-After included (default = 60s)
+    :type max_backoff_sec: float
+    :param timing_hooks: Functions called with the timing record (a dict) of every request
+    :type timing_hooks: list
+    :param rate_limits: Overrides of RATE_LIMITS, by publisher or host
+    :type rate_limits: dict
+    :param rate_limiter: The RateLimiter to use (default = a RateLimiter shared through RATE_STATE_DIRECTORY)
+    :type rate_limiter: RateLimiter
+    :param response_cache: Cache of the CrossRef API responses (default = no cache)
+    :type response_cache: ResponseCache
     '''
     self.els_api_key = els_api_key
     self.sleep_sec = sleep_sec
     self.timeout_sec = timeout_sec
+    self.base_urls = dict(HTML_BASE_URLS)
+    if base_urls:
+      self.base_urls.update(base_urls)
+    self.pool_connections = pool_connections
+    self.pool_maxsize = pool_maxsize
+    self.max_retries = max_retries
+    self.backoff_sec = backoff_sec
+    self.max_backoff_sec = max_backoff_sec
+    self.timing_hooks = list(timing_hooks or [])
+    if rate_limiter is None:
+      rate_limits = dict(rate_limits or {})
+      if sleep_sec and 'default' not in rate_limits:
+        rate_limits['default'] = {'rate': 1.0 / sleep_sec,
+                                  'max_rate': 2.0 / sleep_sec}
+      rate_limiter = RateLimiter(rate_limits)
+    self.rate_limiter = rate_limiter
+    self.response_cache = response_cache
+    # One pooled, kept-alive session per host.
+    self.sessions = {}
+    self.sessions_lock = threading.Lock()
+
+  def session_for(self, url):
+    '''
+    Returns the pooled session of the host of a URL, made on first use
+    '''
+    host = urlparse(url).netloc
+    with self.sessions_lock:
+      session = self.sessions.get(host)
+      if session is None:
+        session = requests.Session()
+        # Retries are done by get, which also honours Retry-After.
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.sessions[host] = session
+    return session
+
+  def close(self):
+    '''
+    Closes the pooled sessions
+    '''
+    with self.sessions_lock:
+      for session in self.sessions.values():
+        session.close()
+      self.sessions = {}
+
+  def retry_after(self, response):
+    '''
+    Returns the wait (in seconds) asked by the Retry-After header of a response, or None
+    '''
+    if response is None or response.status_code not in RETRY_AFTER_STATUSES:
+      return None
+    value = response.headers.get('Retry-After')
+    if value is None:
+      return None
+    try:
+      return max(0.0, float(value))
+    except ValueError:
+      pass
+    try:
+      return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+      return None
+
+  def backoff(self, attempt):
+    '''
+    Exponential backoff with full jitter for a retry attempt (0 for the first retry)
+    '''
+    return random.uniform(0, min(self.max_backoff_sec, self.backoff_sec * 2 ** attempt))
+
+  def record_timing(self, timing):
+    for hook in self.timing_hooks:
+      hook(timing)
+
+  def get(self, url, rate_key=None, **kwargs):
+    '''
+    GET through the pooled session of the host, retrying connection errors,
+    timeouts and RETRY_STATUSES responses with backoff. Every attempt waits
+    for a token of the rate limiter, and adapts its rate.
+
+    :param url: the URL to get
+    :type url: str
+
+    :param rate_key: the publisher (or API) whose rate limit applies (default = the host)
+    :type rate_key: str
+
+    :returns: the last response (raises the last error if every attempt failed to connect)
+    :rtype: requests.Response
+    '''
+    kwargs.setdefault('timeout', self.timeout_sec)
+    session = self.session_for(url)
+    host = urlparse(url).netloc
+    rate_key = rate_key or host
+    attempt = 0
+    while True:
+      throttle_sec = self.rate_limiter.acquire(rate_key)
+      start = time.perf_counter()
+      response, error = None, None
+      try:
+        response = session.get(url, **kwargs)
+      except (requests.ConnectionError, requests.Timeout) as e:
+        error = e
+      status = response.status_code if response is not None else None
+      wait_sec = response.elapsed.total_seconds() if response is not None else None
+      retry_after = self.retry_after(response)
+      self.rate_limiter.update(rate_key, status, wait_sec, retry_after)
+      # wait_sec is the time to the response headers, total_sec the whole call
+      # (the body too, unless stream=True, see write_content). throttle_sec is
+      # the time waited for the rate limiter before the call.
+      self.record_timing({
+        'url': url, 'host': host, 'phase': 'request', 'rate_key': rate_key,
+        'attempt': attempt, 'status': status,
+        'error': type(error).__name__ if error is not None else None,
+        'throttle_sec': throttle_sec, 'wait_sec': wait_sec,
+        'total_sec': time.perf_counter() - start
+      })
+      if response is not None and response.status_code not in RETRY_STATUSES:
+        return response
+      if attempt >= self.max_retries:
+        if response is not None:
+          return response
+        raise error
+      delay = retry_after
+      if delay is None:
+        delay = self.backoff(attempt)
+      elif delay > self.max_backoff_sec:
+        # Not worth waiting for, the caller gets the response.
+        return response
+      if response is not None:
+        response.close()
+      sleep(delay)
+      attempt += 1
+
+  def write_content(self, response, writefile, chunk_size=2048):
+    '''
+    Writes a (streamed) response body to a file, timing the transfer
+    '''
+    start = time.perf_counter()
+    n_bytes = 0
+    for chunk in response.iter_content(chunk_size):
+      writefile.write(chunk)
+      n_bytes += len(chunk)
+    self.record_timing({
+      'url': response.url, 'host': urlparse(response.url).netloc, 'phase': 'body',
+      'status': response.status_code, 'bytes': n_bytes,
+      'total_sec': time.perf_counter() - start
+    })
+
+  def get_json(self, url, headers, rate_key='crossref'):
+    '''
+    Returns the parsed JSON of an API response, from the response cache if it holds
+    a fresh copy. Only 200 responses are cached.
+    '''
+    if self.response_cache is not None:
+      data = self.response_cache.get(url)
+      if data is not None:
+        return data
+    r = self.get(url, rate_key=rate_key, headers=headers, timeout=self.timeout_sec)
+    data = r.json()
+    if self.response_cache is not None and r.status_code == 200:
+      self.response_cache.put(url, data)
+    return data
+
+  def get_crossref_items(self, url, headers, fields, rows=1000):
+    '''
+    Pages through a CrossRef cursor query and returns every item, with only the given
+    fields. The trimmed items of all the pages are cached together (under the URL of the
+    first page and the fields), as CrossRef cursors expire.
+
+    :param fields: The item fields the caller reads, e.g. ['DOI']
+    :type fields: list
+    '''
+    first_url = url + "&rows=" + str(rows) + "&cursor=*"
+    cache_url = first_url + "&fields=" + ",".join(sorted(fields))
+    if self.response_cache is not None:
+      items = self.response_cache.get(cache_url)
+      if items is not None:
+        return items
+
+    items = []
+    cursor = "*"
+    keep_paging = True
+    while (keep_paging):
+      r = self.get(url + "&rows=" + str(rows) + "&cursor=" + cursor, rate_key='crossref',
+                       headers=headers, timeout=self.timeout_sec)
+      cursor = quote(r.json()['message']['next-cursor'], safe='')
+      if len(r.json()['message']['items']) == 0:
+        keep_paging = False
+
+      items += [dict((field, item[field]) for field in fields if field in item)
+                for item in r.json()['message']['items']]
+
+    if self.response_cache is not None:
+      self.response_cache.put(cache_url, items)
+    return items
 
   @traced
   def get_dois_from_search(self, query, rows=500, prefix=None, issn=None, mailto="null@null.com"):
@@ -58,24 +615,14 @@ class ArticleDownloader:
 
     if rows <= max_rows: #No multi-query needed
       search_url = base_url + query + '&rows=' + str(rows)+'&sort=score'+'&filter=from-pub-date:1998-01-01,type:journal-article,issn:'+str(issn)
-      response = requests.get(search_url, headers=headers, timeout=self.timeout_sec).json()
+      response = self.get_json(search_url, headers)
 
       for item in response["message"]["items"]:
         dois.append(item["DOI"])
 
     else: #Need to split queries
-      cursor = "*"
-      keep_paging = True
-      while (keep_paging):
-        sleep(self.sleep_sec)
-        r = requests.get(base_url + query + "&rows=" + str(max_rows) + "&cursor=" + cursor,
-                         headers=headers, timeout=self.timeout_sec)
-        cursor = quote(r.json()['message']['next-cursor'], safe='')
-        if len(r.json()['message']['items']) == 0:
-          keep_paging = False
-
-        for item in r.json()['message']['items']:
-          dois.append(item['DOI'])
+      for item in self.get_crossref_items(base_url + query, headers, ['DOI'], rows=max_rows):
+        dois.append(item['DOI'])
 
     return list(set(dois))
 
@@ -111,24 +658,14 @@ class ArticleDownloader:
 
     if rows <= max_rows: #No multi-query needed
       search_url = str(base_url) + '&rows=' + str(rows)
-      response = requests.get(search_url, headers=headers, timeout=self.timeout_sec).json()
+      response = self.get_json(search_url, headers)
 
       for item in response["message"]["items"]:
         dois.append(item["DOI"])
 
     else: #Need to split queries
-      cursor = "*"
-      keep_paging = True
-      while (keep_paging):
-        sleep(self.sleep_sec)
-        r = requests.get(base_url + "&rows=" + str(max_rows) + "&cursor=" + cursor,
-                         headers=headers, timeout=self.timeout_sec)
-        cursor = quote(r.json()['message']['next-cursor'], safe='')
-        if len(r.json()['message']['items']) == 0:
-          keep_paging = False
-
-        for item in r.json()['message']['items']:
-          dois.append(item['DOI'])
+      for item in self.get_crossref_items(base_url, headers, ['DOI'], rows=max_rows):
+        dois.append(item['DOI'])
 
     return list(set(dois))
 
@@ -142,7 +679,7 @@ class ArticleDownloader:
     }
 
     search_url = str(base_url)
-    response = requests.get(search_url, headers=headers, timeout=self.timeout_sec).json()
+    response = self.get_json(search_url, headers)
 
     item = response["message"]
     metadata_record = None
@@ -218,7 +755,7 @@ class ArticleDownloader:
 
     if rows <= max_rows: #No multi-query needed
       search_url = str(base_url) + '&rows=' + str(rows)
-      response = requests.get(search_url, headers=headers, timeout=self.timeout_sec).json()
+      response = self.get_json(search_url, headers)
 
       for item in response["message"]["items"]:
         try:
@@ -259,54 +796,44 @@ class ArticleDownloader:
         except:
           pass
     else: #Need to split queries
-      cursor = "*"
-      keep_paging = True
-      while (keep_paging):
-        sleep(self.sleep_sec)
-        r = requests.get(base_url + "&rows=" + str(max_rows) + "&cursor=" + cursor,
-                         headers=headers, timeout=self.timeout_sec)
-        cursor = quote(r.json()['message']['next-cursor'], safe='')
-        if len(r.json()['message']['items']) == 0:
-          keep_paging = False
-
-        for item in r.json()['message']['items']:
-          try:
-            if "volume" in item: 
-              volume = item["volume"]
-            else:
-              volume = None
-
-            if "published-print" in item: 
-              year = item['published-print']['date-parts'][0][0] 
-            else:
-              year = None
-
-            if "issue" in item: 
-              issue = item["issue"]
-            else:
-              issue = None
-
-            if "page" in item: 
-              page = item["page"]
-            else:
-              page = None
-
-            metadata_records.append({
-              "doi": item["DOI"],
-              "issn": item["ISSN"][0],
-              "title": item["title"][0],
-              "prefix": item["prefix"],
-              "journal": item["container-title"][0],
-              "publisher": item["publisher"],
-              "volume": volume,
-              "issue": issue,
-              "page": page,
-              "year": year,
-              "num_references": item['references-count'],
-              "times_cited": item['is-referenced-by-count']
-            })
-          except:
-            pass
+      for item in self.get_crossref_items(base_url, headers, METADATA_FIELDS, rows=max_rows):
+        try:
+          if "volume" in item: 
+            volume = item["volume"]
+          else:
+            volume = None
+
+          if "published-print" in item: 
+            year = item['published-print']['date-parts'][0][0] 
+          else:
+            year = None
+
+          if "issue" in item: 
+            issue = item["issue"]
+          else:
+            issue = None
+
+          if "page" in item: 
+            page = item["page"]
+          else:
+            page = None
+
+          metadata_records.append({
+            "doi": item["DOI"],
+            "issn": item["ISSN"][0],
+            "title": item["title"][0],
+            "prefix": item["prefix"],
+            "journal": item["container-title"][0],
+            "publisher": item["publisher"],
+            "volume": volume,
+            "issue": issue,
+            "page": page,
+            "year": year,
+            "num_references": item['references-count'],
+            "times_cited": item['is-referenced-by-count']
+          })
+        except:
+          pass
 
     return metadata_records
 
@@ -336,10 +863,9 @@ class ArticleDownloader:
           'Accept': 'text/xml'
         }
 
-        r = requests.get(xml_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(xml_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         # API download limit exceeded
@@ -353,10 +879,9 @@ class ArticleDownloader:
           'Accept': 'text/xml'
         }
 
-        r = requests.get(xml_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(xml_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         # API download limit exceeded
@@ -384,7 +909,7 @@ class ArticleDownloader:
     '''
 
     if mode == 'springer':
-      base_url = 'http://link.springer.com/'
+      base_url = self.base_urls['springer']
       api_url = base_url + doi + '.html'
 
       try:
@@ -392,17 +917,16 @@ class ArticleDownloader:
           'Accept': 'text/html',
           'User-agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(api_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         return False
       return False
 
     if mode == 'wiley':
-      base_url = 'http://onlinelibrary.wiley.com/doi/'
+      base_url = self.base_urls['wiley']
       api_url = base_url + doi + '/full'
 
       try:
@@ -410,17 +934,16 @@ class ArticleDownloader:
           'Accept': 'text/html',
           'User-agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(api_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         return False
       return False
 
     if mode == 'acs':
-      base_url = 'http://pubs.acs.org/doi/full/'
+      base_url = self.base_urls['acs']
       api_url = base_url + doi
 
       try:
@@ -428,17 +951,16 @@ class ArticleDownloader:
           'Accept': 'text/html',
           'User-agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(api_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         return False
       return False
 
     if mode == 'emerald':
-      base_url = 'http://www.emeraldinsight.com/doi/full/'
+      base_url = self.base_urls['emerald']
       api_url = base_url + doi
 
       try:
@@ -446,10 +968,9 @@ class ArticleDownloader:
           'Accept': 'text/html',
           'User-agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(api_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         return False
@@ -457,23 +978,22 @@ class ArticleDownloader:
 
     if mode == 'rsc':
       html_string = 'articlehtml'
-      download_url = 'https://doi.org/' + doi
+      download_url = self.base_urls['doi'] + doi
       headers = {
       'Accept': 'text/html',
       'User-agent': 'Mozilla/5.0'
       }
-      r = requests.get(download_url, headers=headers, timeout=self.timeout_sec)
+      r = self.get(download_url, rate_key=mode, headers=headers, timeout=self.timeout_sec)
       url = r.url
       url = url.encode('ascii')
       url = url.decode().split('/')
       url = url[0] + '//' + url[2] + '/' + url[3] + '/' + url[4] + '/' + html_string + '/' + url[6] + '/' + url[7] + '/' + url[8]
 
-      r = requests.get(url, stream=True, headers=headers, timeout=self.timeout_sec)
+      r = self.get(url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
 
       if r.status_code == 200:
         try:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
         except:
           return False
@@ -481,17 +1001,16 @@ class ArticleDownloader:
       return False
 
     if mode == 'nature':
-      download_url = 'https://doi.org/' + doi
+      download_url = self.base_urls['doi'] + doi
 
       headers = {
         'Accept': 'text/html',
         'User-agent': 'Mozilla/5.0'
       }
-      r = requests.get(download_url, stream=True, headers=headers, timeout=self.timeout_sec)
+      r = self.get(download_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
       if r.status_code == 200:
         try:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
         except:
           return False
@@ -504,16 +1023,15 @@ class ArticleDownloader:
         'User-agent': 'Mozilla/5.0'
       }
 
-      article_url = 'https://doi.org/' + doi
-      resp = requests.get(article_url, headers=headers, timeout=self.timeout_sec)
+      article_url = self.base_urls['doi'] + doi
+      resp = self.get(article_url, rate_key=mode, headers=headers, timeout=self.timeout_sec)
 
       download_url = resp.url + '.full'  #Capture fulltext from redirect
 
-      r = requests.get(download_url, stream=True, headers=headers, timeout=self.timeout_sec)
+      r = self.get(download_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
       if r.status_code == 200:
         try:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
         except:
           return False
@@ -525,16 +1043,15 @@ class ArticleDownloader:
         'User-agent': 'Mozilla/5.0'
       }
 
-      article_url = 'https://doi.org/' + doi
-      resp = requests.get(article_url, headers=headers, timeout=self.timeout_sec)
+      article_url = self.base_urls['doi'] + doi
+      resp = self.get(article_url, rate_key=mode, headers=headers, timeout=self.timeout_sec)
 
       download_url = resp.url + '.full'  #Capture fulltext from redirect
 
-      r = requests.get(download_url, stream=True, headers=headers, timeout=self.timeout_sec)
+      r = self.get(download_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
       if r.status_code == 200:
         try:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
         except:
           return False
@@ -569,16 +1086,15 @@ class ArticleDownloader:
       }
 
       try:
-        response = json.loads(requests.get(api_url, headers=headers, timeout=self.timeout_sec).text)
+        response = json.loads(self.get(api_url, rate_key=mode, headers=headers, timeout=self.timeout_sec).text)
         pdf_url = response['message']['link'][0]['URL']
         app_type = str(response['message']['link'][0]['content-type'])
 
         if app_type in ['application/pdf', 'unspecified']:
           headers['Accept'] = 'application/pdf'
-          r = requests.get(pdf_url, stream=True, headers=headers)
+          r = self.get(pdf_url, rate_key=mode, stream=True, headers=headers)
           if r.status_code == 200:
-            for chunk in r.iter_content(2048):
-              writefile.write(chunk)
+            self.write_content(r, writefile)
             return True
       except:
         return False
@@ -592,10 +1108,9 @@ class ArticleDownloader:
           'Accept': 'application/pdf'
         }
 
-        r = requests.get(pdf_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(pdf_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         # API download limit exceeded
@@ -607,7 +1122,7 @@ class ArticleDownloader:
       scrape_url = 'https://doi.org/' + doi
       download_url = None
 
-      r = requests.get(scrape_url, timeout=self.timeout_sec)
+      r = self.get(scrape_url, rate_key=mode, timeout=self.timeout_sec)
       if r.status_code == 200:
         scraper.feed(r.content)
 
@@ -618,11 +1133,10 @@ class ArticleDownloader:
         headers = {
           'Accept': 'application/pdf'
         }
-        r = requests.get(download_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(download_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
           try:
-            for chunk in r.iter_content(2048):
-              writefile.write(chunk)
+            self.write_content(r, writefile)
             return True
           except:
             return False
@@ -633,7 +1147,7 @@ class ArticleDownloader:
       scrape_url = 'https://doi.org/' + doi
       download_url = None
 
-      r = requests.get(scrape_url, timeout=self.timeout_sec)
+      r = self.get(scrape_url, rate_key=mode, timeout=self.timeout_sec)
       if r.status_code == 200:
         scraper.feed(r.content)
 
@@ -644,11 +1158,10 @@ class ArticleDownloader:
         headers = {
           'Accept': 'application/pdf'
         }
-        r = requests.get(download_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(download_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
           try:
-            for chunk in r.iter_content(2048):
-              writefile.write(chunk)
+            self.write_content(r, writefile)
             return True
           except:
             return False
@@ -660,7 +1173,7 @@ class ArticleDownloader:
       scrape_url = 'https://doi.org/' + doi
       download_url = None
 
-      r = requests.get(scrape_url, timeout=self.timeout_sec)
+      r = self.get(scrape_url, rate_key=mode, timeout=self.timeout_sec)
       if r.status_code == 200:
         scraper.feed(r.content)
 
@@ -671,11 +1184,10 @@ class ArticleDownloader:
         headers = {
           'Accept': 'application/pdf'
         }
-        r = requests.get(download_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(download_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
           try:
-            for chunk in r.iter_content(2048):
-              writefile.write(chunk)
+            self.write_content(r, writefile)
             return True
           except:
             return False
@@ -691,10 +1203,9 @@ class ArticleDownloader:
           'Accept': 'application/pdf',
           'User-agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(api_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         return False
@@ -709,10 +1220,9 @@ class ArticleDownloader:
           'Accept': 'application/pdf',
           'User-agent': 'Mozilla/5.0'
         }
-        r = requests.get(api_url, stream=True, headers=headers, timeout=self.timeout_sec)
+        r = self.get(api_url, rate_key=mode, stream=True, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
-          for chunk in r.iter_content(2048):
-            writefile.write(chunk)
+          self.write_content(r, writefile)
           return True
       except:
         return False
@@ -744,7 +1254,7 @@ class ArticleDownloader:
           'Accept': 'application/json'
         }
 
-        r = requests.get(url, headers=headers, timeout=self.timeout_sec)
+        r = self.get(url, rate_key=mode, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
           abstract = unicode(json.loads(r.text)['full-text-retrieval-response']['coredata']['dc:description'])
           return abstract
@@ -777,7 +1287,7 @@ class ArticleDownloader:
           'Accept': 'application/json'
         }
 
-        r = requests.get(url, headers=headers, timeout=self.timeout_sec)
+        r = self.get(url, rate_key=mode, headers=headers, timeout=self.timeout_sec)
         if r.status_code == 200:
           title = unicode(r.json()['message']['title'][0])
           return title
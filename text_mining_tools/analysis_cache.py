@@ -0,0 +1,177 @@
+#!/usr/local/bin/python
+import hashlib
+import os
+import pickle
+"""
+The analysis cache keeps the outputs of Article.full_analysis on disk,
+so reruns over a corpus do not parse every paper again. It lives next
+to AnalyzedResults:
+    basepath
+        |------AnalyzedResults
+        |------AnalysisCache
+                    |---ab
+                    |    |---ab12...ef.pickle
+                    |---c4
+                         |---c4d0...93.pickle
+
+Each entry is the Article.to_record() of one paper, stored under a key
+made from the SHA-256 of the HTML file and the extractor fingerprint:
+EXTRACTOR_VERSION plus the settings that change the outputs (parser,
+normalizer rules, prune rules, sentence tokenizer, full paper or not).
+A changed file, or a new extractor version, gives a new key, so the
+paper is parsed again and the stale entry is eventually evicted.
+
+Bump EXTRACTOR_VERSION whenever a change to the extraction code alters
+what full_analysis returns.
+
+The cache is bounded by max_bytes. When a write takes it over the
+limit, the least recently used entries (by file modification time,
+which is refreshed on every hit) are deleted until it is back under
+max_bytes*EVICT_TO. Entries are written to a temporary file and moved
+into place, so several worker processes can share one cache.
+
+    cache = AnalysisCache(basepath, max_bytes=2*1024**3)
+    article.full_analysis(cache=cache)
+"""
+
+EXTRACTOR_VERSION = '4'
+CACHE_DIRECTORY = 'AnalysisCache'
+DEFAULT_MAX_BYTES = 4*1024**3
+# Eviction goes below the limit, so it does not run on every write.
+EVICT_TO = 0.9
+
+
+def hash_file(filename, block_size=1024*1024):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extractor_fingerprint(article, parser, get_full_paper=True):
+    # Everything besides the HTML that changes the analysis outputs.
+    tokenizer = article.sentence_tokenizer
+    rules = article.prune_rules
+    parts = [EXTRACTOR_VERSION, str(parser), str(get_full_paper),
+             repr(article.normalizer.rules),
+             repr(sorted(rules.remove_tags)),
+             repr(sorted((name, sorted(classes)) for name, classes
+                         in rules.remove_classes.items())),
+             repr(sorted(rules.unwrap_tags)),
+             str(tokenizer.method), str(tokenizer.language),
+             repr(sorted(tokenizer.abbreviations))]
+    return '\n'.join(parts)
+
+
+class AnalysisCache:
+    def __init__(self, basepath, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+        # basepath is the ABSOLUTE PATH of the corpus.
+        # max_bytes is the size limit of the cache on disk.
+        # directory overrides where the cache is stored. Default is
+        #               basepath/AnalysisCache/.
+        if directory is None:
+            directory = os.path.join(basepath, CACHE_DIRECTORY)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        # Running size of the cache, counted on the first write and
+        # then kept up to date, so writes do not list the directory.
+        # Other processes' writes are picked up at each eviction.
+        self.total_bytes = None
+
+    def key(self, filename, fingerprint, file_hash=None):
+        # file_hash is the SHA-256 of the HTML, if already known (e.g.
+        #               from a ShardStore). Else filename is hashed.
+        if file_hash is None:
+            file_hash = hash_file(filename)
+        digest = hashlib.sha256(file_hash.encode('ascii'))
+        digest.update(fingerprint.encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key+'.pickle')
+
+    def get(self, key):
+        # Returns the cached record, or None.
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as fin:
+                record = pickle.load(fin)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        try:
+            # Marks the entry as recently used.
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return record
+
+    def put(self, key, record):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path+'.'+str(os.getpid())+'.tmp'
+        with open(temp_path, 'wb') as fout:
+            pickle.dump(record, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        # The entry being replaced, if any, no longer counts.
+        try:
+            replaced_bytes = os.path.getsize(path)
+        except OSError:
+            replaced_bytes = 0
+        os.replace(temp_path, path)
+        if self.max_bytes is None:
+            return
+        if self.total_bytes is None:
+            self.total_bytes = self.size()
+        else:
+            self.total_bytes += os.path.getsize(path) - replaced_bytes
+        if self.total_bytes > self.max_bytes:
+            self.evict(int(self.max_bytes*EVICT_TO))
+
+    def entries(self):
+        # Returns (modification time, size, path) for every entry.
+        entries = []
+        for subdirectory in os.listdir(self.directory):
+            subpath = os.path.join(self.directory, subdirectory)
+            if not os.path.isdir(subpath):
+                continue
+            for filename in os.listdir(subpath):
+                if not filename.endswith('.pickle'):
+                    continue
+                path = os.path.join(subpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Evicted by another process.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self, target_bytes=0):
+        # Deletes the least recently used entries until the cache is
+        # at most target_bytes. Returns the number of entries deleted.
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, path in entries)
+        n_evicted = 0
+        for mtime, size, path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+                n_evicted += 1
+            except OSError:
+                pass
+            total -= size
+        self.total_bytes = total
+        return n_evicted
+
+    def clear(self):
+        return self.evict(0)
@@ -2,8 +2,17 @@
 # Class written by Aditya Nandy for Kulik Group
 from articledownloader.articledownloader import ArticleDownloader
 from pybliometrics.scopus import AbstractRetrieval
-from bs4 import BeautifulSoup, NavigableString
-from nltk import sent_tokenize
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
+from bs4.builder import builder_registry
+from text_mining_tools.text_normalizer import default_normalizer
+from text_mining_tools.sentence_tokenizer import default_tokenizer
+from text_mining_tools.pruning import FULL_PAPER_RULES, prune_tree, pruned_strings
+from text_mining_tools.tables import read_tables
+from text_mining_tools.text_store import TextStore, SpanList
+from text_mining_tools.analysis_cache import extractor_fingerprint, hash_file
+from text_mining_tools.shard_store import find_store
+import io
+import mmap
 import os
 import regex as re
 import pandas as pd
@@ -49,15 +58,186 @@ Currently, I have set up support for articles in nature, RSC,
 and wiley journals. ACS journals require more explicit access.
 """
 
+# Anchor texts that are numbers (e.g. citation numbers) are emptied
+# before parsing so they do not end up in the mined text.
+ANCHOR_NUMBER_PATTERN = re.compile(rb">\d+\w*[</\w+>]*</a>")
+# Files larger than this are memory-mapped instead of read.
+MMAP_THRESHOLD = 1024*1024
+
+# Parser backends BeautifulSoup can build the soup with. lxml is
+# C-backed and several times faster. html.parser is pure python,
+# but always available, so it is the fallback.
+PARSER_BACKENDS = ['lxml', 'html5lib', 'html.parser']
+FALLBACK_PARSER = 'html.parser'
+default_parser = FALLBACK_PARSER
+
+
+def set_default_parser(parser):
+    # Sets the parser used by every Article that does not ask for
+    # a specific one, e.g. set_default_parser('lxml').
+    global default_parser
+    if parser not in PARSER_BACKENDS:
+        raise AssertionError('Unknown parser '+str(parser)+
+                             '. Choose from '+str(PARSER_BACKENDS)+'.')
+    default_parser = parser
+
+
+def resolve_parser(parser=None):
+    # Picks the requested parser, or the default one, and falls
+    # back to html.parser if that backend is not installed.
+    if parser is None:
+        parser = default_parser
+    if parser not in PARSER_BACKENDS:
+        raise AssertionError('Unknown parser '+str(parser)+
+                             '. Choose from '+str(PARSER_BACKENDS)+'.')
+    if builder_registry.lookup(parser) is None:
+        print('Parser '+str(parser)+' is not installed. Using '+
+              FALLBACK_PARSER+' instead.')
+        parser = FALLBACK_PARSER
+    return parser
+
+
+# The publisher (the getter the downloader uses) of each DOI prefix.
+PREFIX_PUBLISHERS = {'10.1039': 'rsc',
+                     '10.1002': 'wiley',
+                     '10.1111': 'wiley',
+                     '10.1560': 'wiley',
+                     '10.1562': 'wiley',
+                     '10.1038': 'nature',
+                     '10.1295': 'nature',
+                     '10.1013': 'nature',
+                     '10.1057': 'nature',
+                     '10.1126': 'aaas',
+                     '10.1021': 'acs',
+                     '10.1006': 'elsevier',
+                     '10.1016': 'elsevier',
+                     '10.1529': 'elsevier',
+                     '10.1007': 'springer',
+                     '10.1023': 'springer',
+                     '10.1134': 'springer',
+                     '10.1163': 'springer'}
+
+
+def publisher_of(doi):
+    # Returns the publisher of a DOI, or None if it is not supported.
+    prefix = str(doi.split('/', 1)[0]).strip()
+    return PREFIX_PUBLISHERS.get(prefix)
+
+
+def clean_html(html_doc):
+    # Empties the anchor numbers of HTML bytes.
+    return ANCHOR_NUMBER_PATTERN.sub(b'></a>', html_doc)
+
+
+def load_html(filename):
+    # Reads an HTML file and empties the anchor numbers in memory.
+    # Nothing is written to disk, so many files can be loaded at
+    # the same time from one working directory. Returns bytes,
+    # which the parser decodes.
+    with open(filename, 'rb') as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return clean_html(fin.read())
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return clean_html(buf)
+
+
+def build_meta_index(soup):
+    # Walks the meta tags once and maps each lowercased name to the
+    # list of (position, content) of its tags, position being the
+    # tag's place among the meta tags of the page. Tags with a
+    # property (Open Graph, e.g. og:title) are kept under
+    # 'property:' + the lowercased property, so they never add to
+    # the results of a name, as the getters only ever looked up names.
+    meta_index = {}
+    for position, tag in enumerate(soup.find_all('meta')):
+        content = tag.get('content')
+        if content is None:
+            continue
+        for attribute, namespace in [('name', ''), ('property', 'property:')]:
+            key = tag.get(attribute)
+            if key:
+                meta_index.setdefault(namespace+key.lower(), []).append((position, content))
+    return meta_index
+
+
+def read_meta_index(html_doc, parser=None):
+    # Builds the meta index straight from the HTML (bytes, as
+    # load_html returns), for metadata-only runs over a corpus. Only
+    # the meta tags are kept in the tree, which is much cheaper than
+    # a full parse.
+    soup = BeautifulSoup(html_doc, resolve_parser(parser),
+                         parse_only=SoupStrainer('meta'),
+                         from_encoding='UTF-8')
+    return build_meta_index(soup)
+
+
+# Article attributes computed on first access: attribute -> (method
+# that sets it, what it needs first). 'soup' is the parsed paper,
+# read if missing (a soup pruned in place is dropped and read again).
+# Other needs are attributes, computed first if missing. Metadata
+# only needs the meta tags, which are parsed alone if the paper has
+# not been read. Abstracts are mostly in the body, so they read the
+# whole paper once rather than the meta tags and then the paper.
+LAZY_ATTRIBUTES = {'f': ('read_paper', []),
+                   'original_f': ('read_paper', []),
+                   'meta_index': ('read_meta', []),
+                   'title': ('get_title', ['meta_index']),
+                   'authors': ('get_authors', ['meta_index']),
+                   'journal_name': ('get_journal_name', ['meta_index']),
+                   'publication_year': ('get_publication_date', ['meta_index']),
+                   'article_type': ('get_article_type', ['meta_index']),
+                   'abstract': ('get_abstract', ['soup']),
+                   'abstract_sentences': ('get_abstract', ['soup']),
+                   'citation_dict': ('get_cited_papers', ['soup']),
+                   'section_name_dict': ('get_section_names', ['soup']),
+                   'section_text_dict': ('get_section_text', ['section_name_dict', 'soup']),
+                   'section_text_dict_sentences': ('get_section_text',
+                                                   ['section_name_dict', 'soup']),
+                   'section_offsets': ('get_section_text', ['section_name_dict', 'soup']),
+                   'figure_captions': ('get_figure_captions', ['soup']),
+                   'table_caption_dict': ('get_table_captions', ['soup']),
+                   'table_dict': ('read_table_data', ['soup']),
+                   'table_header_rows': ('read_table_data', ['soup']),
+                   'full_paper': ('get_full_paper', ['soup']),
+                   'full_paper_sentences': ('get_full_paper', ['soup'])}
+
 
 class Article:
-    def __init__(self, doi, basepath, elsevier_key=False, download=True):
+    # The normalizer behind clean_text. Set it on an instance (or the
+    # class) to use a TextNormalizer with your own rules.
+    normalizer = default_normalizer
+    # What populate_full_paper drops from the tree (see pruning.py).
+    prune_rules = FULL_PAPER_RULES
+    # Splits text into sentences. Set it to a SentenceTokenizer('rules')
+    # for the faster rule-based splitter (see sentence_tokenizer.py).
+    sentence_tokenizer = default_tokenizer
+    # Strips boilerplate from papers as they are downloaded. Set it to
+    # an IngestStage (see ingest.py) to store smaller, faster papers.
+    ingest_stage = None
+    # Set per instance in __init__. The class defaults keep Articles
+    # pickled before these existed readable (default parser, .html
+    # files).
+    parser = None
+    store = None
+
+    def __init__(self, doi, basepath, elsevier_key=False, download=True,
+                 parser=None, store=None):
+        # parser picks the BeautifulSoup backend (see PARSER_BACKENDS).
+        #               If None, the module default_parser is used.
+        # store is a ShardStore to download to and read from (see
+        #               shard_store.py). If None, the corpus store is
+        #               used if basepath has one, else .html files.
         self.doi = doi
+        self.parser = parser
         self.split_doi()
         self.basepath = basepath
         if self.basepath.strip()[-1] != '/':
             self.basepath = self.basepath.strip() + '/'
         self.check_dir()
+        if store is None:
+            store = find_store(self.basepath)
+        self.store = store
         self.elsevier_key = elsevier_key
         if download:
             self.download_article()
@@ -65,6 +245,11 @@ class Article:
         # The class will stop at downloading the article
         # To do analysis, you would have to read the article
         # and break it apart into its pieces.
+        # Alternatively, the outputs in LAZY_ATTRIBUTES (title,
+        # abstract_sentences, section_text_dict, table_dict,
+        # full_paper_sentences...) are computed on first access and
+        # kept, reading only what they need. An abstract screen never
+        # touches sections or tables.
 
     def check_dir(self, append_to_basepath=False):
         if not os.path.exists(self.basepath):
@@ -112,158 +297,190 @@ class Article:
         else:
             print('ATTEMPTING DOWNLOAD!', self.doi)
             # The downloader will not overwrite existing downloads.
-            if not os.path.exists(self.basepath+str(prefix) +
-                             '/'+str(rest)+'.html'):
+            if not self.paper_exists():
                 downloader = ArticleDownloader(
                     str(self.elsevier_key), timeout_sec=150)
-                try:
-                    temp_file = open(self.basepath+str(prefix) +
-                                 '/'+str(rest)+'.html', 'wb')
-                    downloader.get_html_from_doi(self.doi, temp_file, getter)
-                    temp_file.close()
-                    failed = False
-                except:
-                    failed = True
-                if failed or (os.stat(self.basepath+str(prefix) +
-                                 '/'+str(rest)+'.html').st_size == 0):
-                    try:
-                        os.remove(self.basepath+str(prefix) +
-                                 '/'+str(rest)+'.html')
-                    except:
-                        print('nothing to remove')
-                    new_df = pd.DataFrame()
-                    doilist = []
-                    if os.path.exists(self.basepath+str(prefix)+\
-                        '/not_automatically_downloaded.csv'):
-                        not_auto_download = pd.read_csv(self.basepath+str(prefix)+\
-                            '/not_automatically_downloaded.csv')
-                        doilist = not_auto_download['doi'].tolist()
-                    doilist.append(self.doi)
-                    doilist = list(set(doilist))
-                    new_df['doi'] = doilist
-                    new_df.to_csv(self.basepath+str(prefix)+\
-                        '/not_automatically_downloaded.csv',index=False)
+                html_doc = self.fetch_paper(downloader)
+                if html_doc is None:
+                    self.not_downloaded(prefix)
+                    return
+                self.save_paper(html_doc)
+
+    def fetch_paper(self, downloader):
+        # Downloads the paper in memory with an ArticleDownloader.
+        # Returns the HTML (bytes), or None if the download failed or
+        # was empty. Nothing is written, so this can run in a thread.
+        temp_file = io.BytesIO()
+        try:
+            downloader.get_html_from_doi(self.doi, temp_file, self.getter)
+        except:
+            return None
+        if len(temp_file.getvalue()) == 0:
+            return None
+        return temp_file.getvalue()
+
+    def save_paper(self, html_doc):
+        # Writes a downloaded paper to the store, or to its file,
+        # after the ingest stage if one is set.
+        if self.ingest_stage is not None:
+            html_doc = self.ingest_stage.process(self, html_doc)
+        if self.store is not None:
+            self.store.put(self.doi, html_doc)
+        else:
+            with open(self.html_path(), 'wb') as fout:
+                fout.write(html_doc)
+
+    def not_downloaded(self, prefix):
+        # Adds the DOI to the not_automatically_downloaded list.
+        new_df = pd.DataFrame()
+        doilist = []
+        if os.path.exists(self.basepath+str(prefix)+\
+            '/not_automatically_downloaded.csv'):
+            not_auto_download = pd.read_csv(self.basepath+str(prefix)+\
+                '/not_automatically_downloaded.csv')
+            doilist = not_auto_download['doi'].tolist()
+        doilist.append(self.doi)
+        doilist = list(set(doilist))
+        new_df['doi'] = doilist
+        new_df.to_csv(self.basepath+str(prefix)+\
+            '/not_automatically_downloaded.csv',index=False)
 
     def split_doi(self):
         prefix = str(self.doi.split('/', 1)[0]).strip()
         rest = str(self.doi.split('/', 1)[1]).strip()
-        getter_dict = {'10.1039': 'rsc',
-                       '10.1002': 'wiley',
-                       '10.1111': 'wiley',
-                       '10.1560': 'wiley',
-                       '10.1562': 'wiley',
-                       '10.1038': 'nature',
-                       '10.1295': 'nature',
-                       '10.1013': 'nature',
-                       '10.1057': 'nature',
-                       '10.1126': 'aaas',
-                       '10.1021': 'acs',
-                       '10.1006': 'elsevier',
-                       '10.1016': 'elsevier',
-                       '10.1529': 'elsevier',
-                       '10.1007': 'springer',
-                       '10.1023': 'springer',
-                       '10.1134': 'springer',
-                       '10.1163': 'springer'}
-        if prefix not in getter_dict.keys():
-            getter = None
-        else:
-            getter = getter_dict[prefix]
+        getter = publisher_of(self.doi)
         self.prefix = prefix
         self.getter = getter
         return prefix, rest, getter
 
-    def read_paper(self):
+    def html_path(self):
+        prefix, rest, getter = self.split_doi()
+        return self.basepath + str(prefix) + '/'+str(rest)+'.html'
+
+    def paper_exists(self):
+        # True if the paper is a file, or is in the store.
+        if os.path.exists(self.html_path()):
+            return True
+        return self.store is not None and self.doi in self.store
+
+    def load_paper(self):
+        # The paper HTML (bytes, anchor numbers emptied), from its
+        # file if there is one, else from the store.
+        filename = self.html_path()
+        if os.path.exists(filename):
+            return load_html(filename)
+        if self.store is not None:
+            html_doc = self.store.get(self.doi)
+            if html_doc is not None:
+                return clean_html(html_doc)
+        raise AssertionError('This paper does not exist at '+\
+                             filename+'. Download it first.')
+
+    def paper_hash(self):
+        # SHA-256 of the paper HTML, or None if it does not exist.
+        filename = self.html_path()
+        if os.path.exists(filename):
+            return hash_file(filename)
+        if self.store is not None:
+            info = self.store.info(self.doi)
+            if info is not None:
+                return info['sha256']
+        return None
+
+    def read_paper(self, parser=None):
         # Once a paper is downloaded, this method is used
         # 'read' the paper. This is necessary for later steps.
-        def replace(fin_name, srcStr, desStr, fout_name):
-            fin = open(fin_name, "r")
-            fout = open(fout_name, "w")
-            txt = fin.read()
-            txtout = re.sub(srcStr, desStr, txt)
-            fout.write(txtout)
-            fin.close()
-            fout.close()
-        prefix, rest, getter = self.split_doi()
-        if os.path.exists(self.basepath + str(prefix) +
-                          '/'+str(rest)+'.html'):
-            filename = (self.basepath + str(prefix) +
-                        '/'+str(rest)+'.html')
-            replace(filename, ">\d+\w*[</\w+>]*</a>",
-                    "></\w+></a>", "temp.html")
-            html_doc = open("temp.html", encoding="UTF-8")
-            f = BeautifulSoup(html_doc, 'html.parser')
-            self.f = f
-            self.original_f = f  # This is the original soup doc. Do not touch.
-            os.remove("temp.html")
+        # The file is loaded and cleaned in memory, then handed
+        # straight to the parser. parser overrides the backend
+        # chosen for this article for this call only.
+        html_doc = self.load_paper()
+        if parser is None:
+            parser = self.parser
+        f = BeautifulSoup(html_doc, resolve_parser(parser),
+                          from_encoding='UTF-8')
+        self.f = f
+        self.original_f = f  # This is the original soup doc. Do not touch.
+        self.meta_index = build_meta_index(f)
+        self.pruned = False
+
+    def read_meta(self):
+        # Builds the meta index alone, from the soup if the paper was
+        # read, else with a meta-only parse of the file.
+        if 'f' in self.__dict__:
+            self.meta_index = build_meta_index(self.f)
         else:
-            raise AssertionError('This paper does not exist at '+\
-                                str(self.basepath) +str(prefix) + \
-                                '/' + str(rest)+'.html. Download it first.')
+            self.meta_index = read_meta_index(self.load_paper(), self.parser)
+        return self.meta_index
 
 
-    def populate_full_paper(self):
-        # DO THIS LAST!
+    def populate_full_paper(self, in_place=True):
+        # DO THIS LAST! (unless in_place=False)
         full_paper = False
         full_paper_sentences = []
         # After a paper is loaded, this method
         # replaces the special characters in the paper
         # breaks apart the sentences, recombines them
         # with correct closure. It stores the full paper
-        # and the paper in sentence form. This should be
-        # done LAST as it alters the tree.
-        for i in self.f(["script", "style", 'ol', 'ul', 'li', \
-                         'table', 'a', 'noscript', 'option']):
-            i.extract()
-            for i in self.f(["div"]):
-                # Get rid of citation tree which clutters the text.
-                if (i.get('class') == ['citationInfo'] or \
-                    i.get('class') == ['casRecord'] or \
-                    i.get('class') == ['casContent'] or \
-                    i.get('class') == ['casTitle'] or \
-                    i.get('class') == ['casAuthors'] or \
-                    i.get('class') == ['casAbstract']):
-                    i.extract()
-            for i in self.f(['sup', 'sub']):
-                # Flattens subscripts, which are difficult to mine
-                i.unwrap()
-        full_paper = self.f.get_text()
+        # and the paper in sentence form. With in_place,
+        # this should be done LAST as it alters the tree.
+        # Without it, the same text is read off a pruned
+        # view and the tree is left untouched.
+        if in_place:
+            prune_tree(self.f, self.prune_rules)
+            # Lazy attributes read afterwards re-read the paper.
+            self.pruned = True
+            full_paper = self.f.get_text()
+        else:
+            full_paper = ''.join(self.pruned_strings())
         if full_paper:
             full_paper_subbed = self.clean_text(full_paper)
-            full_paper_sentences = sent_tokenize(full_paper_subbed)
+            full_paper_sentences = self.sentence_tokenizer.tokenize(full_paper_subbed)
         self.full_paper = full_paper
         self.full_paper_sentences = full_paper_sentences
         return full_paper, full_paper_sentences
 
+    def get_full_paper(self):
+        # The full paper, read off a pruned view (the tree is kept).
+        return self.populate_full_paper(in_place=False)
+
+    def pruned_strings(self, tag=None):
+        # The text of the pruned paper, read without altering
+        # the tree (see pruning.pruned_strings).
+        if tag is None:
+            tag = self.f
+        return pruned_strings(tag, self.prune_rules)
+
+    def get_meta(self, keys):
+        # Looks up the contents of the meta tags named by any of keys
+        # (lowercase, 'property:og:title' for a property) in the meta
+        # index built by read_paper, in the order the tags appear on
+        # the page.
+        found = []
+        for key in set(keys):
+            found += self.meta_index.get(key, [])
+        return [content for position, content in sorted(found)]
+
     def get_title(self):
         title = None
-        meta_tags = self.f.find_all('meta')
-        for i, tag in enumerate(meta_tags):
-            if tag.has_attr('name'):
-                if tag['name'].lower() in ['dc.title','citation_title']:
-                    title = tag['content']
+        titles = self.get_meta(['dc.title', 'citation_title'])
+        if len(titles) > 0:
+            title = titles[-1]
         self.title = title
         return title
 
     def get_authors(self):
         author_list = []
-        meta_tags = self.f.find_all('meta')
-        for i, tag in enumerate(meta_tags):
-            if tag.has_attr('name'):
-                if (tag['name'].lower() in ['citation_author', 'dc.creator']):
-                    clean_text = self.clean_text(str(tag['content']))
-                    author_list.append(clean_text)
+        for author in self.get_meta(['citation_author', 'dc.creator']):
+            clean_text = self.clean_text(str(author))
+            author_list.append(clean_text)
         self.authors = list(set(author_list))
         return author_list
 
     def get_journal_name(self):
         journal_name = False
-        meta_tags = self.f.find_all('meta')
-        for i, tag in enumerate(meta_tags):
-            if tag.has_attr('name'):
-                if (tag['name'].lower() in ['citation_journal_title']):
-                    journal_name = "_".join(tag['content'].lower().split())
-                    break
+        journal_names = self.get_meta(['citation_journal_title'])
+        if len(journal_names) > 0:
+            journal_name = "_".join(journal_names[0].lower().split())
         if journal_name == False:
             temp = self.f.find_all('title')
             if len(temp)>0:
@@ -276,12 +493,10 @@ class Article:
 
     def get_publication_date(self):
         pub_year = False
-        meta_tags = self.f.find_all('meta')
-        for i, tag in enumerate(meta_tags):
-            if tag.has_attr('name'):
-                if tag['name'].lower() in ['citation_date', 'dc.date','citation_publication_date']:
-                    pub_year = tag['content']
-                    break
+        dates = self.get_meta(['citation_date', 'dc.date',
+                               'citation_publication_date'])
+        if len(dates) > 0:
+            pub_year = dates[0]
         self.publication_year = pub_year
         return pub_year
 
@@ -346,54 +561,62 @@ class Article:
         article_type = False
         article_type_list = []
         if self.getter == 'acs':
-            article_type_list = self.f.find_all('meta', attrs={'name': 'dc.Type'})
+            article_type_list = self.get_meta(['dc.type'])
         if self.getter == 'nature':
-            article_type_list = self.f.find_all('meta', attrs={'name': 'citation_article_type'})
+            article_type_list = self.get_meta(['citation_article_type'])
         if len(article_type_list)>0:
-            article_type = article_type_list[0].get_text()
+            article_type = article_type_list[0]
         self.article_type = article_type
         return article_type
 
-    def get_section_names(self):
-        section_name_dict = {}
-        counter = 0
+    def find_section_headings(self, f=None):
+        # Returns the (name, tag) pairs of the section headings, in
+        # the order they appear. The tag is where the section starts.
+        # f is the soup to look in. Default is the paper (self.f).
+        if f is None:
+            f = self.f
+        headings = []
         checked = set()
         if self.getter == 'rsc':
-            sections = self.f.find_all('span', attrs={'class': 'a_heading'})
+            sections = f.find_all('span', attrs={'class': 'a_heading'})
             for section in sections:
                 temp = section.get_text()
                 if (temp.lower() not in checked):
                     checked.add(temp.lower())
-                    counter += 1
-                    section_name_dict[counter] = temp
+                    headings.append((temp, section))
         if self.getter == 'acs':
-            sections = self.f.find_all(
+            sections = f.find_all(
                 'div', attrs={'class': 'article_content-title'})
             for section in sections:
                 temp = section.get_text()
                 if (temp.lower() not in checked):
                     checked.add(temp.lower())
-                    counter += 1
-                    section_name_dict[counter] = temp
+                    headings.append((temp, section))
                     if 'references' in temp.lower():
                         break
         if self.getter == 'nature':
-            sections = self.f.find_all('c-article-section__title')
+            sections = f.find_all(
+                'h2', attrs={'class': 'c-article-section__title'})
             for section in sections:
                 temp = section.get_text()
                 if (temp.lower() not in checked):
                     checked.add(temp.lower())
-                    counter += 1
-                    section_name_dict[counter] = temp
+                    headings.append((temp, section))
                     if 'references' in temp.lower():
                         break
         if self.getter == 'wiley':
-            for i in self.f(['h2']):
+            for i in f(['h2']):
                 temp = i.get('class')
                 if temp != None and len(temp)>0:
                     if 'article-section__title' in temp:
-                        counter += 1
-                        section_name_dict[counter] = i.get_text()
+                        # Wiley sections start at the parent of the title.
+                        headings.append((i.get_text(), i.parent))
+        return headings
+
+    def get_section_names(self):
+        section_name_dict = {}
+        for counter, (name, tag) in enumerate(self.find_section_headings()):
+            section_name_dict[counter+1] = name
         self.section_name_dict = section_name_dict
         return section_name_dict
 
@@ -401,45 +624,47 @@ class Article:
         # After the section names are obtained, we can split a paper apart
         # into its corresponding sections. This is helpful for doing section
         # specific sentiment analysis at a later time.
+        # The document is walked once, and every string is given to the
+        # section whose heading came last before it. The last section
+        # (usually the references) runs to the end of the page and is
+        # not stored. section_offsets holds the (start, end) character
+        # offsets of each section in the text of all sections joined
+        # by single spaces.
         section_text_dict = {}
         section_text_dict_sentences = {}
-
-        def between(cur, end):
-            # This function climbs down the tree.
-            while cur and cur != end:
-                if isinstance(cur, NavigableString):
-                    text = cur.strip()
-                    if len(text):
-                        yield text
-                cur = cur.next_element
+        section_offsets = {}
         if len(self.section_name_dict) != 0:
-            # Loop over everything between the sections
-            if self.getter == 'acs':
-                kw = 'div'
-            elif self.getter == 'rsc':
-                kw = 'span'
-            elif self.getter == 'wiley':
-                kw = 'h2'
-            sections_to_enumerate = list(self.section_name_dict.values())
-            for i, section in enumerate(sections_to_enumerate[:-1]):
-                if self.getter in ['acs','rsc']:
-                    section_text = ' '.join(text for text in between(self.f.find(kw,
-                                                                        text=section),
-                                                                 self.f.find(kw, 
-                                                                    text=sections_to_enumerate[i+1])))
-                elif self.getter in ['wiley']:
-                    section_text = ' '.join(text for text in between(self.f.find(kw,
-                                                                        text=section).parent,
-                                                                 self.f.find(kw, 
-                                                                    text=sections_to_enumerate[i+1])))
+            headings = self.find_section_headings()
+            section_index = dict((id(tag), i) for i, (name, tag)
+                                 in enumerate(headings))
+            pieces = [[] for val in headings]
+            current = None
+            for node in self.f.descendants:
+                if isinstance(node, NavigableString):
+                    if current is not None:
+                        text = node.strip()
+                        if len(text):
+                            pieces[current].append(text)
+                elif id(node) in section_index:
+                    current = section_index[id(node)]
+            offset = 0
+            section_texts = []
+            for i, (section, tag) in enumerate(headings[:-1]):
+                section_text = ' '.join(pieces[i])
                 section_text_dict[i] = {section: section_text}
-                # Next, preprocess text and store as sentences
-                subbed_section_text = self.clean_text(section_text)
-                subbed_section_text = subbed_section_text.lower()
-                sent_text = sent_tokenize(subbed_section_text)
-                section_text_dict_sentences[i] = {section: sent_text}
+                section_offsets[i] = (offset, offset + len(section_text))
+                offset += len(section_text) + 1
+                section_texts.append(section_text)
+            # Next, preprocess text and store as sentences, all
+            # sections at once.
+            subbed_section_texts = [val.lower() for val in
+                                    self.clean_texts(section_texts)]
+            sent_texts = self.sentence_tokenizer.tokenize_batch(subbed_section_texts)
+            for i, (section, tag) in enumerate(headings[:-1]):
+                section_text_dict_sentences[i] = {section: sent_texts[i]}
         self.section_text_dict = section_text_dict
         self.section_text_dict_sentences = section_text_dict_sentences
+        self.section_offsets = section_offsets
         return section_text_dict, section_text_dict_sentences
 
     def get_abstract(self, from_scopus = False):
@@ -458,9 +683,9 @@ class Article:
             if self.getter == 'acs':
                 temp = self.f.find_all('p', attrs={'class': 'articleBody_abstractText'})
             if self.getter == 'nature':
-                temp = self.f.find_all('meta', attrs={'name': 'description'})
+                temp = self.get_meta(['description'])
                 if len(temp)>0:
-                    abstract = temp[0]['content']
+                    abstract = temp[0]
             if self.getter == 'wiley':
                 temp = self.f.find_all('div', attrs={'class': 'abstract-group'})
                 if len(temp)>0:
@@ -471,7 +696,7 @@ class Article:
         if abstract:
             abstract_replaced = self.clean_text(abstract)
             abstract_replaced = abstract_replaced.lower()
-            abstract_sentences = sent_tokenize(abstract_replaced)
+            abstract_sentences = self.sentence_tokenizer.tokenize(abstract_replaced)
         self.abstract = abstract
         self.abstract_sentences = abstract_sentences
         return abstract, abstract_sentences
@@ -506,9 +731,11 @@ class Article:
         self.citation_dict = citation_dict
         return citation_dict
 
-    def populate_metadata(self):
-        # This populates important data after the paper is read
-        self.read_paper()
+    def populate_metadata(self, reread=True, parser=None):
+        # This populates important data after the paper is read.
+        # With reread=False, an already read soup is reused.
+        if reread or 'f' not in self.__dict__:
+            self.read_paper(parser=parser)
         self.get_article_type()
         self.get_title()
         self.get_journal_name()
@@ -517,185 +744,197 @@ class Article:
         self.get_abstract()
         self.get_cited_papers()
 
-    def populate_paper_by_section(self):
-        self.read_paper()
+    def populate_paper_by_section(self, reread=True, parser=None):
+        if reread or 'f' not in self.__dict__:
+            self.read_paper(parser=parser)
         self.get_section_names()
         self.get_section_text()
 
-    def populate_figure_and_table_captions(self):
-        self.read_paper()
+    def populate_figure_and_table_captions(self, reread=True, parser=None):
+        if reread or 'f' not in self.__dict__:
+            self.read_paper(parser=parser)
         self.get_table_captions()
         self.get_figure_captions()
 
-    def full_analysis(self, get_full_paper=True):
-        self.populate_metadata()
-        self.populate_paper_by_section()
-        self.populate_figure_and_table_captions()
+    def full_analysis(self, get_full_paper=True, parse_once=True, parser=None,
+                      compact=False, cache=None):
+        # With parse_once, the paper is parsed a single time and every
+        # getter shares that soup. The full paper text is then taken
+        # from a pruned view, so self.f is left intact afterwards.
+        # parse_once=False keeps the old behavior of re-reading the
+        # paper for each group and pruning self.f in place.
+        # parser overrides the backend for this analysis only.
+        # cache is an AnalysisCache (see analysis_cache.py). If the
+        #               outputs for this exact file and extractor are
+        #               cached, they are loaded instead of parsing the
+        #               paper (no soup is set). Otherwise they are
+        #               cached after the analysis.
+        key = None
+        file_hash = None
+        if cache is not None:
+            file_hash = self.paper_hash()
+        if file_hash is not None:
+            fingerprint = extractor_fingerprint(
+                self, resolve_parser(parser or self.parser), get_full_paper)
+            key = cache.key(None, fingerprint, file_hash)
+            record = cache.get(key)
+            if record is not None:
+                self.load_record(record)
+                if compact:
+                    self.compact()
+                return
+        if parse_once:
+            self.read_paper(parser=parser)
+        self.populate_metadata(reread=not parse_once, parser=parser)
+        self.populate_paper_by_section(reread=not parse_once, parser=parser)
+        self.populate_figure_and_table_captions(reread=not parse_once,
+                                                parser=parser)
         self.read_table_data()
         if get_full_paper:
-            self.populate_full_paper()
+            self.populate_full_paper(in_place=not parse_once)
+        if key is not None:
+            cache.put(key, self.to_record())
+        if compact:
+            self.compact()
+
+    def compact(self):
+        # Shrinks an analyzed article, e.g. before pickling it or
+        # keeping a whole query's article_dict in memory. The
+        # normalized texts are stored once in a TextStore, and the
+        # sentence lists become SpanLists (offsets into it) that
+        # build their strings on access. The soups are dropped.
+        # full_paper, section_text_dict and abstract are rebuilt
+        # from the store when accessed, as their normalized text
+        # (section text and abstract also lowercased, as in their
+        # sentences).
+        store = TextStore()
+        views = {}
+        if self.__dict__.get('full_paper', False):
+            start, end, sentences = store.add_sentences(
+                self.clean_text(self.full_paper), self.full_paper_sentences)
+            views['full_paper'] = (start, end)
+            self.full_paper_sentences = sentences
+            del self.full_paper
+        if 'section_text_dict' in self.__dict__:
+            section_views = {}
+            for i, section_dict in self.section_text_dict.items():
+                for section, section_text in section_dict.items():
+                    sentences = self.section_text_dict_sentences[i][section]
+                    start, end, sentences = store.add_sentences(
+                        self.clean_text(section_text).lower(), sentences)
+                    section_views[i] = (section, start, end)
+                    self.section_text_dict_sentences[i] = {section: sentences}
+            views['section_text_dict'] = section_views
+            del self.section_text_dict
+        if self.__dict__.get('abstract', False):
+            start, end, sentences = store.add_sentences(
+                self.clean_text(self.abstract).lower(), self.abstract_sentences)
+            views['abstract'] = (start, end)
+            self.abstract_sentences = sentences
+            del self.abstract
+        for soup in ['f', 'original_f']:
+            if soup in self.__dict__:
+                delattr(self, soup)
+        self.text_store = store.close()
+        self.text_views = views
+
+    # The analysis outputs kept by to_record, in order.
+    record_fields = ['doi', 'prefix', 'getter', 'title', 'authors',
+                     'journal_name', 'publication_year', 'article_type',
+                     'abstract', 'abstract_sentences', 'citation_dict',
+                     'section_name_dict', 'section_text_dict',
+                     'section_text_dict_sentences', 'section_offsets',
+                     'figure_captions', 'table_caption_dict',
+                     'table_dict', 'table_header_rows', 'full_paper',
+                     'full_paper_sentences']
+
+    def to_record(self):
+        # Returns the analysis outputs as a plain DICT (no soup), which
+        # is small and cheap to pickle or send between processes.
+        # Outputs that were not computed are None.
+        record = {}
+        for field in self.record_fields:
+            if not self.is_computed(field):
+                record[field] = None
+                continue
+            value = getattr(self, field)
+            if isinstance(value, SpanList):
+                value = list(value)
+            elif field == 'section_text_dict_sentences' and value is not None:
+                value = dict((i, dict((section, list(sentences))
+                                      for section, sentences in val.items()))
+                             for i, val in value.items())
+            record[field] = value
+        return record
+
+    def load_record(self, record):
+        # Sets the outputs of a record made by to_record() on this
+        # article. Outputs that were not computed (None) are skipped.
+        for field in self.record_fields:
+            value = record.get(field)
+            if value is not None:
+                setattr(self, field, value)
+
+    def is_computed(self, name):
+        # True if the attribute is set (or kept by compact()), without
+        # computing it.
+        return name in self.__dict__ or name in self.__dict__.get('text_views', {})
+
+    def __getattr__(self, name):
+        # Only called for missing attributes. After compact(), the
+        # texts that were dropped are rebuilt from the text store.
+        # Attributes in LAZY_ATTRIBUTES are computed and kept.
+        views = self.__dict__.get('text_views')
+        if views is None or name not in views:
+            if name in LAZY_ATTRIBUTES and 'doi' in self.__dict__:
+                return self.compute(name)
+            raise AttributeError(name)
+        store = self.__dict__['text_store']
+        if name == 'section_text_dict':
+            return dict((i, {section: store.view(start, end)})
+                        for i, (section, start, end) in views[name].items())
+        start, end = views[name]
+        return store.view(start, end)
+
+    def compute(self, name):
+        method, needs = LAZY_ATTRIBUTES[name]
+        if self.__dict__.get('pruned', False):
+            # The soup was pruned in place by populate_full_paper, so
+            # it is read again, whole, when next needed.
+            del self.f
+            del self.original_f
+            self.pruned = False
+        for need in needs:
+            if need == 'soup':
+                if 'f' not in self.__dict__:
+                    self.read_paper()
+            elif not self.is_computed(need):
+                self.compute(need)
+        getattr(self, method)()
+        if name not in self.__dict__:
+            raise AttributeError(name)
+        return self.__dict__[name]
 
     def clean_text(self, text):
-        # Currently, text is ridded of these characters,
-        # which make mining difficult. You can add to this
-        # list if other things are not enabling mining.
-        output_text = re.sub(u'\xa0', " ",text)
-        output_text = re.sub(u"\u2013", " ", output_text)
-        output_text = re.sub(u"\u2009", " ", output_text)
-        output_text = re.sub(u"\u2005", " ", output_text)
-        output_text = re.sub(u"\u2014", " ", output_text)
-        output_text = re.sub("\n", "", output_text)
-        output_text = re.sub("&thinsp;", "", output_text)
-        output_text = re.sub("&nbsp;", " ", output_text)
-        output_text = re.sub("-", " ", output_text)
-        return output_text
-
-    def read_table_data(self):
-        table_dict = {}
-        counter = 0
-        tables = self.f.find_all('table')
-        if len(tables)>0 and tables != None:
-            for table in tables:
-                if (table == None) or (table.find_all('table') != []):
-                    # Cannot handle nested tables.
-                    continue
-                counter += 1
-                data = []
-                table_head = table.thead
-                if table_head == None:
-                    # Could not identify tableheader, no use storing.
-                    continue
-                rows = table_head.find_all('tr')
-                if rows == None or len(rows)==0:
-                    # Not a real table.
-                    continue
-                rownum = 0
-                rownow = 0
-                for row in rows:
-                    rownum += 1
-                    if rownow < rownum:
-                        data.append([]) 
-                        rownow += 1
-                    cols = row.find_all('th')
-                    colnum = 0
-                    colnow = len(data[rownum - 1])
-                    for col in cols:
-                        text = col.get_text().strip()
-                        text = self.clean_text(text)
-                        colnum += 1
-                        if colnow < colnum:
-                            data[rownum-1].append([])
-                            colnow += 1
-                        while data[rownum-1][colnum-1] != []:
-                            colnum += 1
-                            if colnow < colnum:
-                                data[rownum-1].append([])
-                                colnow += 1
-                        colspannum = 1
-                        if (col.attrs.get('colspan') != None) and (col.attrs.get('colspan') != ''):
-                            colspannum = int(col['colspan'])
-                        rowspannum = 1
-                        if col.attrs.get('rowspan') != None:
-                            rowspannum = int(col['rowspan'])
-                        if rowspannum == 1 and colspannum == 1:
-                            temp = colnum
-                            while data[rownum-1][temp-1] != []:
-                                temp += 1
-                            data[rownum-1][temp-1].append(text)
-                        if rowspannum == 1 and colspannum != 1:
-                            for j in range(colspannum - 1):
-                                data[rownum-1].append([])
-                            colnow += colspannum - 1
-                            for i in range(colspannum):
-                                if data[rownum-1][colnum-1+i] == []:
-                                    data[rownum-1][colnum-1+i].append(text)
-                        if rowspannum != 1 and colspannum == 1:
-                            if rownow < rownum + rowspannum-1:
-                                for j in range(rownum + rowspannum - rownow - 1):
-                                    data.append([]) 
-                                    rownow += 1
-                            for i in range(rowspannum):
-                                if len(data[rownum+i-1]) < colnum + colspannum:
-                                    for j in range(colnum + colspannum - len(data[rownum+i-1])):
-                                        data[rownum+i-1].append([])
-                                for j in range(colspannum):
-                                    if data[rownum+i-1][colnum+j-1] == []:
-                                        data[rownum+i-1][colnum+j-1].append(text)
-                table_body = table.tbody
-                if table_body != None:
-                    rows = table_body.find_all('tr')
-                    head_row_num = len(data)
-                    if head_row_num == 0:
-                        head_row_num = 1
-                    rownum = len(data)
-                    rownow = len(data)
-                    for row in rows: 
-                        rownum += 1 
-                        if rownow < rownum:
-                            data.append([])
-                            rownow += 1 
-                        cols = row.find_all('td')
-                        colnum = 0 
-                        colnow = len(data[rownum - 1]) 
-                        for col in cols:
-                            text = col.get_text().strip()
-                            text = self.clean_text(text)
-                            colnum += 1
-                            if colnow < colnum:
-                                data[rownum-1].append([]) 
-                                colnow += 1 
-                            while data[rownum-1][colnum-1] != []:
-                                colnum += 1
-                                if colnow < colnum: 
-                                    data[rownum-1].append([])
-                                    colnow += 1
-                            colspannum = 1
-                            if col.attrs.get('colspan') != None and col.attrs.get('colspan') != '':
-                                colspannum = int(col['colspan'])
-                            rowspannum = 1
-                            if col.attrs.get('rowspan') != None:
-                                rowspannum = int(col['rowspan'])
-                            if rowspannum == 1 and colspannum == 1:
-                                temp = colnum
-                                while data[rownum-1][temp-1] != []:
-                                    temp += 1
-                                data[rownum-1][temp-1].append(text)
-                            if rowspannum == 1 and colspannum != 1:
-                                for j in range(colspannum - 1):
-                                    data[rownum-1].append([])
-                                colnow += colspannum - 1
-                                for i in range(colspannum):
-                                    if data[rownum-1][colnum-1+i] == []:
-                                        data[rownum-1][colnum-1+i].append(text)
-                            if rowspannum != 1 and colspannum == 1:
-                                if rownow < rownum + rowspannum-1:
-                                    for j in range(rownum + rowspannum - rownow - 1):
-                                        data.append([])
-                                        rownow += 1
-                                for i in range(rowspannum):
-                                    if len(data[rownum+i-1]) < colnum:
-                                        for j in range(colnum - len(data[rownum+i-1])):
-                                            data[rownum+i-1].append([])
-                                    if data[rownum+i-1][colnum-1] == []:
-                                        data[rownum+i-1][colnum-1].append(text) 
-                            if rowspannum != 1 and colspannum != 1:
-                                if rownow < rownum + rowspannum-1:
-                                    for j in range(rownum + rowspannum - rownow - 1): 
-                                        data.append([])
-                                        rownow += 1
-                                for i in range(rowspannum):
-                                    if len(data[rownum+i-1]) < colnum + colspannum:
-                                        for j in range(colnum + colspannum - len(data[rownum+i-1])):
-                                            data[rownum+i-1].append([]) 
-                                    for j in range(colspannum): 
-                                        if data[rownum+i-1][colnum+j-1] == []:
-                                            data[rownum+i-1][colnum+j-1].append(text)
-                for i in range(len(data)):
-                    for j in range(len(data[i])):
-                        if data[i][j] == []:
-                            data[i][j].append('')
-                table_dict[counter] = data
+        # Currently, text is ridded of the characters listed in
+        # text_normalizer.CLEAN_TEXT_RULES, which make mining
+        # difficult. You can add to that list if other things
+        # are not enabling mining.
+        return self.normalizer.normalize(text)
+
+    def clean_texts(self, texts):
+        # Same as clean_text, for a list of strings at once.
+        return self.normalizer.normalize_batch(texts)
+
+    def read_table_data(self, output='list', numeric=False):
+        # Reads every table into a grid of cell texts (see tables.py).
+        # output is 'list' (rows of single-element lists, the layout
+        # table_dict has always had), 'array' (NumPy object array) or
+        # 'frame' (pandas DataFrame, header rows as columns). numeric converts
+        # columns made only of numbers to floats. The number of
+        # header rows of each table is kept in table_header_rows.
+        table_dict, header_rows = read_tables(self.f, self.normalizer,
+                                              output, numeric)
         self.table_dict = table_dict
+        self.table_header_rows = header_rows
         return table_dict
-
-
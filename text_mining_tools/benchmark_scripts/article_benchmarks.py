@@ -0,0 +1,411 @@
+'''
+This script times the Article analysis on a local corpus of HTML files.
+It is run from the command line with the corpus basepath, and the
+benchmark to run:
+
+    python article_benchmarks.py <basepath> parse_once
+
+The parser_parity check is not a timing: it runs the extractors with
+every installed parser backend and reports the fields that differ
+from html.parser, per article.
+
+The corpus is expected to follow the layout described in article.py,
+(basepath/<doi prefix>/<rest of doi>.html). Each benchmark prints a
+line per article and a summary at the end.
+'''
+
+
+from text_mining_tools.article import Article, PARSER_BACKENDS
+from text_mining_tools.article import FALLBACK_PARSER
+from text_mining_tools.corpus import Corpus, list_corpus_dois
+from text_mining_tools.inverted_index import InvertedIndex, record_sentences
+from text_mining_tools.ingest import IngestStage, InMemoryArticle, records_equal
+from text_mining_tools.text_normalizer import default_normalizer
+from text_mining_tools.pruning import FULL_PAPER_RULES, prune_tree
+from text_mining_tools.sentence_tokenizer import SentenceTokenizer
+from nltk import sent_tokenize
+from bs4.builder import builder_registry
+import regex as re
+import os
+import sys
+import time
+
+
+def find_dois(basepath, limit=None):
+    dois = list_corpus_dois(basepath)
+    if limit:
+        dois = dois[:limit]
+    return dois
+
+
+def time_call(func, repeats=3):
+    # Best of a few runs, which is less noisy than the mean.
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark_parse_once(basepath, dois, repeats=3):
+    # Compares full_analysis re-reading the paper per group against
+    # the parse-once mode that shares a single soup.
+    totals = {'reread': 0.0, 'parse_once': 0.0}
+    for doi in dois:
+        article = Article(doi, basepath, download=False)
+        try:
+            reread = time_call(lambda: article.full_analysis(parse_once=False),
+                               repeats)
+            once = time_call(lambda: article.full_analysis(parse_once=True),
+                             repeats)
+        except Exception as e:
+            print('failed', doi, e)
+            continue
+        totals['reread'] += reread
+        totals['parse_once'] += once
+        print('%-45s reread %.3fs  parse_once %.3fs  speedup %.2fx'
+              % (doi, reread, once, reread/once))
+    if totals['parse_once'] > 0:
+        print('TOTAL reread %.3fs  parse_once %.3fs  speedup %.2fx'
+              % (totals['reread'], totals['parse_once'],
+                 totals['reread']/totals['parse_once']))
+    return totals
+
+
+def benchmark_lazy_abstracts(basepath, dois, repeats=3):
+    # An abstract screen: full_analysis against reading only
+    # abstract_sentences from a fresh Article (lazy attributes).
+    def full(doi):
+        article = Article(doi, basepath, download=False)
+        article.full_analysis()
+        return article.abstract_sentences
+
+    def lazy(doi):
+        return Article(doi, basepath, download=False).abstract_sentences
+    totals = {'full_analysis': 0.0, 'lazy': 0.0}
+    for doi in dois:
+        try:
+            full_time = time_call(lambda: full(doi), repeats)
+            lazy_time = time_call(lambda: lazy(doi), repeats)
+        except Exception as e:
+            print('failed', doi, e)
+            continue
+        totals['full_analysis'] += full_time
+        totals['lazy'] += lazy_time
+        print('%-45s full_analysis %.3fs  lazy %.3fs  speedup %.2fx'
+              % (doi, full_time, lazy_time, full_time/lazy_time))
+    if totals['lazy'] > 0:
+        print('TOTAL full_analysis %.3fs  lazy %.3fs  speedup %.2fx'
+              % (totals['full_analysis'], totals['lazy'],
+                 totals['full_analysis']/totals['lazy']))
+    return totals
+
+
+def installed_parsers():
+    return [val for val in PARSER_BACKENDS
+            if builder_registry.lookup(val) is not None]
+
+
+def benchmark_parsers(basepath, dois, repeats=3):
+    # Throughput of the full analysis with each parser backend.
+    totals = dict((parser, 0.0) for parser in installed_parsers())
+    n_bytes = 0
+    for doi in dois:
+        article = Article(doi, basepath, download=False)
+        prefix, rest, getter = article.split_doi()
+        n_bytes += os.path.getsize(basepath.rstrip('/')+'/'+prefix+'/'+rest+'.html')
+        line = '%-45s' % doi
+        for parser in totals:
+            elapsed = time_call(lambda: article.full_analysis(parser=parser),
+                                repeats)
+            totals[parser] += elapsed
+            line += '  %s %.3fs' % (parser, elapsed)
+        print(line)
+    for parser, elapsed in totals.items():
+        if elapsed > 0:
+            print('%-12s %7.1f articles/s  %7.2f MB/s'
+                  % (parser, len(dois)/elapsed, n_bytes/elapsed/1e6))
+    return totals
+
+
+def extractor_outputs(article):
+    return {'title': article.title,
+            'authors': sorted(article.authors),
+            'journal_name': article.journal_name,
+            'publication_year': article.publication_year,
+            'article_type': article.article_type,
+            'abstract_sentences': article.abstract_sentences,
+            'section_name_dict': article.section_name_dict,
+            'section_text_dict_sentences': article.section_text_dict_sentences,
+            'figure_captions': article.figure_captions,
+            'table_caption_dict': article.table_caption_dict,
+            'table_dict': article.table_dict,
+            'citation_dict': article.citation_dict,
+            'full_paper_sentences': article.full_paper_sentences}
+
+
+def check_parser_parity(basepath, dois):
+    # Compares every extractor against the html.parser reference.
+    mismatches = {}
+    for doi in dois:
+        outputs = {}
+        for parser in installed_parsers():
+            article = Article(doi, basepath, download=False, parser=parser)
+            article.full_analysis()
+            outputs[parser] = extractor_outputs(article)
+        reference = outputs[FALLBACK_PARSER]
+        for parser, output in outputs.items():
+            differing = [key for key in reference
+                         if not records_equal(output[key], reference[key])]
+            if differing:
+                mismatches[(doi, parser)] = differing
+                print(doi, parser, 'differs in', ', '.join(differing))
+    print(str(len(mismatches))+' article/parser pairs differ from '+
+          FALLBACK_PARSER)
+    return mismatches
+
+
+def legacy_clean_text(text):
+    # The clean_text implementation the normalizer replaced.
+    output_text = re.sub(u'\xa0', " ",text)
+    output_text = re.sub(u"\u2013", " ", output_text)
+    output_text = re.sub(u"\u2009", " ", output_text)
+    output_text = re.sub(u"\u2005", " ", output_text)
+    output_text = re.sub(u"\u2014", " ", output_text)
+    output_text = re.sub("\n", "", output_text)
+    output_text = re.sub("&thinsp;", "", output_text)
+    output_text = re.sub("&nbsp;", " ", output_text)
+    output_text = re.sub("-", " ", output_text)
+    return output_text
+
+
+def benchmark_clean_text(basepath, dois, repeats=5):
+    # Normalizes the full papers, sections and table cells of the
+    # corpus with the old clean_text, the normalizer one string at
+    # a time, and the normalizer in batches (one per article).
+    batches = []
+    for doi in dois:
+        article = Article(doi, basepath, download=False)
+        article.read_paper()
+        texts = [article.f.get_text()]
+        texts += [val.get_text() for val in article.f.find_all(['p', 'div', 'span'])]
+        texts += [val.get_text().strip() for val in article.f.find_all(['td', 'th'])]
+        batches.append(texts)
+    n_texts = sum(len(texts) for texts in batches)
+    for texts in batches:
+        if [legacy_clean_text(text) for text in texts] != default_normalizer.normalize_batch(texts):
+            print('Normalizer output differs from the old clean_text!')
+    timings = {'legacy': time_call(lambda: [[legacy_clean_text(text) for text in texts]
+                                            for texts in batches], repeats),
+               'normalize': time_call(lambda: [[default_normalizer.normalize(text) for text in texts]
+                                               for texts in batches], repeats),
+               'normalize_batch': time_call(lambda: [default_normalizer.normalize_batch(texts)
+                                                     for texts in batches], repeats)}
+    for name, elapsed in timings.items():
+        print('%-16s %.4fs  %9.0f strings/s  speedup %.1fx'
+              % (name, elapsed, n_texts/elapsed, timings['legacy']/elapsed))
+    return timings
+
+
+def legacy_prune(f):
+    # The pruning populate_full_paper did before pruning.py.
+    for i in f(["script", "style", 'ol', 'ul', 'li', \
+                'table', 'a', 'noscript', 'option']):
+        i.extract()
+        for i in f(["div"]):
+            if (i.get('class') == ['citationInfo'] or \
+                i.get('class') == ['casRecord'] or \
+                i.get('class') == ['casContent'] or \
+                i.get('class') == ['casTitle'] or \
+                i.get('class') == ['casAuthors'] or \
+                i.get('class') == ['casAbstract']):
+                i.extract()
+        for i in f(['sup', 'sub']):
+            i.unwrap()
+
+
+def benchmark_pruning(basepath, dois):
+    # Times the old quadratic pruning against prune_tree. Each run
+    # needs a fresh tree, so only the pruning itself is timed. The
+    # largest articles (long reviews) show the difference best.
+    totals = {'legacy': 0.0, 'prune_tree': 0.0}
+    for doi in dois:
+        article = Article(doi, basepath, download=False)
+        timings = {}
+        texts = {}
+        for name, prune in [('legacy', legacy_prune),
+                            ('prune_tree', lambda f: prune_tree(f, FULL_PAPER_RULES))]:
+            article.read_paper()
+            n_anchors = len(article.f.find_all('a'))
+            start = time.perf_counter()
+            prune(article.f)
+            timings[name] = time.perf_counter() - start
+            texts[name] = article.f.get_text()
+            totals[name] += timings[name]
+        same = 'same text' if texts['legacy'] == texts['prune_tree'] else 'TEXT DIFFERS'
+        print('%-45s %6d anchors  legacy %.3fs  prune_tree %.3fs  %s'
+              % (doi, n_anchors, timings['legacy'], timings['prune_tree'], same))
+    if totals['prune_tree'] > 0:
+        print('TOTAL legacy %.3fs  prune_tree %.3fs  speedup %.1fx'
+              % (totals['legacy'], totals['prune_tree'],
+                 totals['legacy']/totals['prune_tree']))
+    return totals
+
+
+def benchmark_tokenizers(basepath, dois, repeats=3):
+    # Sentence tokenization throughput on the texts an analysis
+    # tokenizes (full paper, sections, abstract): nltk.sent_tokenize
+    # one text at a time, then the SentenceTokenizer methods in
+    # batches. Agreement is the share of texts split exactly as
+    # nltk does.
+    texts = []
+    for doi in dois:
+        article = Article(doi, basepath, download=False)
+        article.read_paper()
+        article.get_section_names()
+        article.get_section_text()
+        article.get_abstract()
+        article.populate_full_paper(in_place=False)
+        texts.append(article.clean_text(article.full_paper or ''))
+        texts += [article.clean_text(list(val.values())[0]).lower()
+                  for val in article.section_text_dict.values()]
+        if article.abstract:
+            texts.append(article.clean_text(article.abstract).lower())
+    n_chars = sum(len(text) for text in texts)
+    reference = [sent_tokenize(text) for text in texts]
+    n_sentences = sum(len(val) for val in reference)
+    tokenizers = {'punkt': SentenceTokenizer('punkt'),
+                  'rules': SentenceTokenizer('rules')}
+    timings = {'sent_tokenize': time_call(lambda: [sent_tokenize(text) for text in texts],
+                                          repeats)}
+    for name, tokenizer in tokenizers.items():
+        timings[name] = time_call(lambda: tokenizer.tokenize_batch(texts), repeats)
+    for name, elapsed in timings.items():
+        if name in tokenizers:
+            output = tokenizers[name].tokenize_batch(texts)
+            agreement = sum(val == ref for val, ref in zip(output, reference))/float(len(texts))
+        else:
+            agreement = 1.0
+        print('%-14s %.4fs  %9.0f sentences/s  %6.2f MB/s  agreement %.0f%%'
+              % (name, elapsed, n_sentences/elapsed, n_chars/elapsed/1e6, 100*agreement))
+    return timings
+
+
+def benchmark_corpus_scaling(basepath, dois, chunksize=4):
+    # Runs the Corpus analysis with 1, 2, 4, ... workers (up to the
+    # number of cores) and reports the speedup over one worker and
+    # the parallel efficiency (speedup / workers), which should stay
+    # close to 1 for near-linear scaling. Use a corpus with many more
+    # articles than cores.
+    n_cores = os.cpu_count() or 1
+    worker_counts = [1]
+    while worker_counts[-1]*2 <= n_cores:
+        worker_counts.append(worker_counts[-1]*2)
+    if worker_counts[-1] != n_cores:
+        worker_counts.append(n_cores)
+    timings = {}
+    for workers in worker_counts:
+        corpus = Corpus(basepath, workers=workers, chunksize=chunksize)
+        start = time.perf_counter()
+        n_done = sum(1 for val in corpus.analyze(dois))
+        timings[workers] = time.perf_counter() - start
+        speedup = timings[1]/timings[workers]
+        print('%3d workers  %.2fs  %6.1f articles/s  speedup %5.2fx  efficiency %3.0f%%  (%d failed)'
+              % (workers, timings[workers], n_done/timings[workers], speedup,
+                 100*speedup/workers, len(corpus.failures)))
+    return timings
+
+
+SCREEN_KEYWORDS = ['thermogravimetric analysis', 'tga', 'weight loss',
+                   'mass loss', 'decomposition', 'collaps*', 'desolv*',
+                   'solvent removal']
+
+
+def benchmark_index_screen(basepath, dois, keywords=SCREEN_KEYWORDS):
+    # Compares a keyword screen done as a substring scan over every
+    # sentence with the same screen from the inverted index (built
+    # once, in a temporary file). Prefix keywords are scanned as
+    # their prefix, so the scan counts are an upper bound.
+    import tempfile
+    records = [record for doi, record in Corpus(basepath, workers=1).analyze(dois)]
+    start = time.perf_counter()
+    scan_hits = dict((keyword, 0) for keyword in keywords)
+    for record in records:
+        for section, i, sentence in record_sentences(record):
+            sentence = sentence.lower()
+            for keyword in keywords:
+                if keyword.rstrip('*') in sentence:
+                    scan_hits[keyword] += 1
+    scan_time = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        index = InvertedIndex(filename=os.path.join(directory, 'index.sqlite'))
+        start = time.perf_counter()
+        index.add(records)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        screen = index.screen(keywords)
+        screen_time = time.perf_counter() - start
+        index.close()
+    for keyword in keywords:
+        print('%-30s scan %6d  index %6d' % (keyword, scan_hits[keyword],
+                                               len(screen[keyword])))
+    print('%d articles: scan %.3fs, index build %.3fs, index screen %.3fs'
+          % (len(records), scan_time, build_time, screen_time))
+    return scan_time, build_time, screen_time
+
+
+def benchmark_ingest(basepath, dois, repeats=3):
+    # Strips each paper in memory (the corpus is not changed) and
+    # compares the size and full_analysis time of the original and
+    # stripped papers, and checks that every extractor output is
+    # unchanged.
+    stage = IngestStage(log=False)
+    totals = {'original_bytes': 0, 'stripped_bytes': 0, 'original': 0.0,
+              'stripped': 0.0}
+    n_differ = 0
+    for doi in dois:
+        article = Article(doi, basepath, download=False)
+        with open(article.html_path(), 'rb') as fin:
+            original = fin.read()
+        stripped, n_removed = stage.strip(article, original)
+        times = {}
+        for name, html_doc in [('original', original), ('stripped', stripped)]:
+            times[name] = time_call(
+                lambda: InMemoryArticle(article, html_doc).full_analysis(), repeats)
+            totals[name] += times[name]
+        differing = stage.differing_fields(article, original, stripped)
+        if differing:
+            n_differ += 1
+        totals['original_bytes'] += len(original)
+        totals['stripped_bytes'] += len(stripped)
+        print('%-40s %9d -> %9d bytes  %.4fs -> %.4fs  %s'
+              % (doi, len(original), len(stripped), times['original'],
+                 times['stripped'], ', '.join(differing) or 'same outputs'))
+    print('Bytes: %.1f%% smaller. Parse time: %.2fx faster. %d articles differ.'
+          % (100*(1 - totals['stripped_bytes']/max(totals['original_bytes'], 1)),
+             totals['original']/max(totals['stripped'], 1e-9), n_differ))
+    return totals
+
+
+BENCHMARKS = {'parse_once': benchmark_parse_once,
+              'lazy_abstracts': benchmark_lazy_abstracts,
+              'parsers': benchmark_parsers,
+              'parser_parity': check_parser_parity,
+              'clean_text': benchmark_clean_text,
+              'pruning': benchmark_pruning,
+              'tokenizers': benchmark_tokenizers,
+              'corpus_scaling': benchmark_corpus_scaling,
+              'index_screen': benchmark_index_screen,
+              'ingest': benchmark_ingest}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[2] not in BENCHMARKS:
+        print('usage: python article_benchmarks.py <basepath> <benchmark> [n_articles]')
+        print('benchmarks: ' + ', '.join(sorted(BENCHMARKS.keys())))
+        sys.exit(1)
+    basepath = sys.argv[1]
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    BENCHMARKS[sys.argv[2]](basepath, find_dois(basepath, limit))
@@ -0,0 +1,195 @@
+#!/usr/local/bin/python
+from articledownloader.articledownloader import ArticleDownloader
+from text_mining_tools.article import Article
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+"""
+The bulk downloader fetches many articles at once, instead of building
+one Article after another and waiting on each download (as Query does
+with automate_download). A 5,000 DOI harvest is then bounded by the
+politeness of each publisher, not by the sum of every download.
+
+Each getter (publisher) has its own pool of download threads, with a
+concurrency cap and a politeness delay (the minimum time between the
+starts of two downloads from that publisher), see GETTER_LIMITS. A
+slow publisher never holds up the others. Downloads only fetch the
+HTML in memory. Everything that is written (files, ShardStore,
+ingest stage, not_automatically_downloaded lists) is done by the
+calling thread, through the Article methods, as download_article does.
+
+ACS is never downloaded: ACS DOIs are added to the
+not_automatically_downloaded list, as Article does. So are DOIs of
+unsupported publishers.
+
+    downloader = BulkDownloader(basepath)
+    status = downloader.download(my_query.deduplicated_results)
+    print(downloader.counts())
+
+Progress (done, downloaded, failed, rate and time left) is printed
+every progress_every articles. The ArticleDownloader is made by
+downloader_factory, one per thread, so the whole engine can be run
+against a local test server:
+
+    BulkDownloader(basepath, downloader_factory=lambda: ArticleDownloader(
+        timeout_sec=5, base_urls={'doi': 'http://127.0.0.1:8000/'}))
+"""
+
+# getter -> (max concurrent downloads, seconds between download starts)
+GETTER_LIMITS = {'rsc': (2, 1.0),
+                 'wiley': (2, 2.0),
+                 'nature': (2, 1.0),
+                 'springer': (2, 1.0),
+                 'elsevier': (1, 1.0),
+                 'aaas': (1, 2.0)}
+# Never downloaded automatically (see article.py).
+EXCLUDED_GETTERS = ['acs']
+DOWNLOAD_STATUSES = ['downloaded', 'exists', 'failed', 'excluded', 'unsupported']
+
+
+def dois_from(source):
+    # Returns the DOI list of a LIST of DOIs, a Query, or the
+    # deduplicated_results (or query_results) DICT of a Query.
+    if hasattr(source, 'deduplicated_results'):
+        source = source.deduplicated_results
+    if isinstance(source, dict):
+        return list(source['doi'].values())
+    return list(source)
+
+
+class PolitenessGate:
+    # Spaces the download starts of one getter by delay seconds,
+    # across all of its threads.
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+class BulkDownloader:
+    def __init__(self, basepath, elsevier_key=False, limits=None, timeout_sec=150,
+                 downloader_factory=None, progress_every=10, parser=None):
+        # basepath is the ABSOLUTE PATH of the corpus.
+        # elsevier_key is passed on to the ArticleDownloader.
+        # limits is a DICT of getter -> (max concurrent downloads,
+        #               seconds between download starts), overriding
+        #               GETTER_LIMITS for those getters.
+        # timeout_sec is the timeout of each request.
+        # downloader_factory makes the ArticleDownloader of each
+        #               thread. Default is ArticleDownloader(elsevier_key,
+        #               timeout_sec=timeout_sec).
+        # progress_every prints progress every this many articles.
+        #               0 or None prints nothing.
+        # parser is the parser of the Articles (see article.py).
+        self.basepath = basepath
+        self.elsevier_key = elsevier_key
+        self.limits = dict(GETTER_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.timeout_sec = timeout_sec
+        if downloader_factory is None:
+            downloader_factory = lambda: ArticleDownloader(str(self.elsevier_key),
+                                                           timeout_sec=self.timeout_sec)
+        self.downloader_factory = downloader_factory
+        self.progress_every = progress_every
+        self.parser = parser
+        self.local = threading.local()
+        self.status = {}
+
+    def downloader(self):
+        # One ArticleDownloader per thread.
+        if getattr(self.local, 'downloader', None) is None:
+            self.local.downloader = self.downloader_factory()
+        return self.local.downloader
+
+    def fetch(self, article, gate):
+        # Runs in a download thread.
+        gate.wait()
+        return article.fetch_paper(self.downloader())
+
+    def download(self, source):
+        # Downloads every article of source (a LIST of DOIs, a Query,
+        # or its deduplicated_results) that is not in the corpus yet.
+        # Returns a DICT of doi -> status (see DOWNLOAD_STATUSES).
+        self.status = {}
+        articles = {}
+        for doi in dois_from(source):
+            if doi in self.status or doi in articles:
+                continue
+            article = Article(doi, self.basepath, self.elsevier_key, download=False,
+                              parser=self.parser)
+            prefix, rest, getter = article.split_doi()
+            if getter is None or getter in EXCLUDED_GETTERS:
+                article.check_dir(prefix)
+                article.not_downloaded(prefix)
+                self.status[doi] = 'unsupported' if getter is None else 'excluded'
+            elif article.paper_exists():
+                self.status[doi] = 'exists'
+            else:
+                articles[doi] = article
+        self.n_total = len(articles)
+        self.n_done = 0
+        self.start_time = time.monotonic()
+        if self.progress_every:
+            print('Downloading '+str(self.n_total)+' articles ('+
+                  str(len(self.status))+' skipped).')
+        getters = sorted(set(article.getter for article in articles.values()))
+        executors = {}
+        futures = {}
+        try:
+            for getter in getters:
+                max_workers, delay = self.limits.get(getter, (1, 1.0))
+                executors[getter] = ThreadPoolExecutor(max_workers=max_workers)
+                gate = PolitenessGate(delay)
+                for doi, article in articles.items():
+                    if article.getter == getter:
+                        futures[executors[getter].submit(self.fetch, article, gate)] = doi
+            for future in as_completed(futures):
+                self.finish(articles[futures[future]], future)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+        return self.status
+
+    def finish(self, article, future):
+        # Writes a finished download, in the calling thread.
+        prefix, rest, getter = article.split_doi()
+        try:
+            html_doc = future.result()
+        except Exception:
+            html_doc = None
+        if html_doc is None:
+            article.check_dir(prefix)
+            article.not_downloaded(prefix)
+            self.status[article.doi] = 'failed'
+        else:
+            article.check_dir(prefix)
+            article.save_paper(html_doc)
+            self.status[article.doi] = 'downloaded'
+        self.n_done += 1
+        if self.progress_every and (self.n_done % self.progress_every == 0 or
+                                    self.n_done == self.n_total):
+            self.print_progress()
+
+    def counts(self):
+        counts = dict((status, 0) for status in DOWNLOAD_STATUSES)
+        for status in self.status.values():
+            counts[status] += 1
+        return counts
+
+    def print_progress(self):
+        elapsed = time.monotonic() - self.start_time
+        rate = self.n_done/elapsed if elapsed > 0 else 0.0
+        left = (self.n_total - self.n_done)/rate if rate > 0 else 0.0
+        counts = self.counts()
+        print('%d/%d done (%d downloaded, %d failed), %.2f articles/s, %.0fs left'
+              % (self.n_done, self.n_total, counts['downloaded'], counts['failed'],
+                 rate, left))
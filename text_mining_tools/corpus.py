@@ -0,0 +1,274 @@
+#!/usr/local/bin/python
+from text_mining_tools.article import Article, resolve_parser, publisher_of
+from text_mining_tools.analysis_cache import EXTRACTOR_VERSION, hash_file
+from text_mining_tools.shard_store import STORE_DIRECTORY, find_store
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+"""
+The corpus class runs the Article analysis over a whole corpus (the
+basepath/<doi prefix>/<rest of doi>.html layout described in
+article.py), on many cores.
+
+The HTML files are found under basepath, and their DOIs are split into
+chunks (work units) that are handed to a pool of worker processes.
+Each worker analyzes its chunk and sends back one slim record per
+article (Article.to_record(), no soup), so little is pickled between
+processes. (doi, record) pairs are yielded as a stream, in the order
+of the DOIs, while the other chunks are still being analyzed.
+
+An article that fails does not stop the run: the error is stored in
+corpus.failures under its DOI, and the run goes on.
+
+    corpus = Corpus(basepath, workers=16)
+    for doi, record in corpus.analyze():
+        ...
+    print(corpus.failures)
+
+With an AnalysisCache (see analysis_cache.py), a rerun loads the
+records of unchanged papers instead of parsing them again. With a
+Manifest (see manifest.py), a rerun skips them altogether and only
+yields the new or changed papers.
+
+iter_corpus walks the corpus lazily, in the same (sorted) order on
+every run, and yields an ArticleHandle per HTML file. A handle only
+holds the DOI, path, size and publisher of the file, so filters on
+prefix, publisher, size or a DOI list are applied before anything is
+read. The file is read or parsed only when the handle is used, and
+nothing is kept once the loop moves on. Papers kept in a ShardStore
+(see shard_store.py) are listed from its index, with the files:
+
+    for handle in iter_corpus(basepath, publishers=['rsc', 'wiley'],
+                              max_size=5*1024*1024):
+        article = handle.analyze()
+        ...
+"""
+
+
+# Directories under basepath that hold results, not papers.
+RESULT_DIRECTORIES = ['AnalyzedResults', 'AnalysisCache', 'ResponseCache', STORE_DIRECTORY]
+
+
+class ArticleHandle:
+    __slots__ = ('doi', 'prefix', 'filename', 'path', 'size', 'publisher',
+                 'basepath', 'store')
+
+    def __init__(self, basepath, prefix, filename, size, store=None):
+        # store is the ShardStore holding the paper, or None if it is
+        #               a file (see shard_store.py).
+        self.basepath = basepath
+        self.prefix = prefix
+        self.filename = filename
+        self.doi = prefix+'/'+filename[:-len('.html')]
+        self.store = store
+        self.path = None
+        if store is None:
+            self.path = os.path.join(basepath, prefix, filename)
+        self.size = size
+        self.publisher = publisher_of(self.doi)
+
+    def open(self):
+        # The raw HTML file, in binary mode.
+        if self.store is not None:
+            return io.BytesIO(self.store.get(self.doi))
+        return open(self.path, 'rb')
+
+    def stat(self):
+        # Returns (size, modification time in ns) of the paper.
+        if self.store is not None:
+            info = self.store.info(self.doi)
+            return info['size'], info['mtime_ns']
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def sha256(self):
+        if self.store is not None:
+            return self.store.info(self.doi)['sha256']
+        return hash_file(self.path)
+
+    def article(self, parser=None):
+        # A new (unread) Article for this file. Nothing is downloaded.
+        return Article(self.doi, self.basepath, download=False, parser=parser,
+                       store=self.store)
+
+    def analyze(self, parser=None, **kwargs):
+        # A new Article with full_analysis done (kwargs are passed on).
+        article = self.article(parser)
+        article.full_analysis(parser=parser, **kwargs)
+        return article
+
+    def __repr__(self):
+        return 'ArticleHandle('+repr(self.doi)+')'
+
+
+def iter_corpus(basepath, prefixes=None, publishers=None, dois=None,
+                min_size=None, max_size=None, use_store=True):
+    # Yields an ArticleHandle for every HTML file under
+    # basepath/<prefix>/ that passes the filters, sorted by prefix
+    # then file name.
+    # prefixes is a LIST of DOI prefixes (directories) to walk.
+    # publishers is a LIST of publishers (e.g. 'rsc', see
+    #               article.PREFIX_PUBLISHERS).
+    # dois is a LIST of DOIs to keep.
+    # min_size and max_size bound the file size, in bytes.
+    # use_store also yields the papers of the corpus ShardStore, if
+    #               it has one (see shard_store.py). A paper that is
+    #               both a file and stored is yielded once, as a file.
+    if dois is not None:
+        dois = set(dois)
+        # Only the directories of these DOIs need to be walked.
+        doi_prefixes = set(val.split('/', 1)[0] for val in dois)
+    store = None
+    store_prefixes = []
+    if use_store:
+        store = find_store(basepath)
+        if store is not None:
+            store_prefixes = store.prefixes()
+    for prefix in sorted(set(os.listdir(basepath)) | set(store_prefixes)):
+        if prefix in RESULT_DIRECTORIES or prefix.startswith('.'):
+            continue
+        if prefixes and prefix not in prefixes:
+            continue
+        if dois is not None and prefix not in doi_prefixes:
+            continue
+        if publishers and publisher_of(prefix+'/') not in publishers:
+            continue
+        # File name -> (size, store), files first.
+        files = {}
+        directory = os.path.join(basepath, prefix)
+        if os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.html'):
+                        files[entry.name] = (entry, None)
+        if prefix in store_prefixes:
+            for doi, size in store.entries(prefix):
+                filename = doi.split('/', 1)[1]+'.html'
+                if filename not in files:
+                    files[filename] = (size, store)
+        for filename in sorted(files):
+            if dois is not None and prefix+'/'+filename[:-len('.html')] not in dois:
+                continue
+            size, source = files[filename]
+            if source is None:
+                size = size.stat().st_size
+            if min_size is not None and size < min_size:
+                continue
+            if max_size is not None and size > max_size:
+                continue
+            yield ArticleHandle(basepath, prefix, filename, size, source)
+
+
+def list_corpus_dois(basepath, prefixes=None, **filters):
+    # Returns the DOIs of every HTML file under basepath/<prefix>/,
+    # sorted, so runs always see the corpus in the same order.
+    # prefixes is a LIST of DOI prefixes to limit the search to. The
+    # other filters of iter_corpus can also be given.
+    return [handle.doi for handle in iter_corpus(basepath, prefixes, **filters)]
+
+
+def analyze_chunk(basepath, dois, options):
+    # Runs in a worker process. Returns (doi, record, error) for each
+    # DOI of the chunk, with error None on success.
+    results = []
+    for doi in dois:
+        try:
+            article = Article(doi, basepath, download=False,
+                              parser=options.get('parser'))
+            article.full_analysis(get_full_paper=options.get('get_full_paper', True),
+                                  cache=options.get('cache'))
+            results.append((doi, article.to_record(), None))
+        except Exception as e:
+            results.append((doi, None, type(e).__name__+': '+str(e)))
+    return results
+
+
+class Corpus:
+    def __init__(self, basepath, prefixes=None, workers=None, chunksize=8,
+                 parser=None, cache=None):
+        # basepath is the ABSOLUTE PATH of the corpus.
+        # prefixes is a LIST of DOI prefixes to analyze. Default is all.
+        # workers is the number of worker processes. Default is the
+        #               number of cores. With 1, the analysis runs in
+        #               this process.
+        # chunksize is the number of articles in each work unit.
+        # parser is the BeautifulSoup backend (see article.py).
+        # cache is an AnalysisCache shared by the workers, so reruns
+        #               only parse new or changed papers.
+        self.basepath = basepath
+        if not os.path.exists(self.basepath):
+            raise AssertionError('The basepath you specified for the corpus does\
+                                 not exist.')
+        self.prefixes = prefixes
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.chunksize = chunksize
+        # Resolved here so workers use the parser the caller would get.
+        self.parser = resolve_parser(parser)
+        self.cache = cache
+        self.failures = {}
+
+    def find_dois(self):
+        return list_corpus_dois(self.basepath, self.prefixes)
+
+    def chunks(self, dois):
+        for i in range(0, len(dois), self.chunksize):
+            yield dois[i:i + self.chunksize]
+
+    def analyze(self, dois=None, get_full_paper=True, manifest=None, pipeline=None):
+        # Yields the record of every article analyzed successfully, in
+        # the order of dois (default: every DOI in the corpus). Failed
+        # DOIs are stored in self.failures instead.
+        # manifest is a Manifest (see manifest.py). If given, only the
+        #               articles that are new or changed since the
+        #               last run are analyzed, and each one yielded is
+        #               marked done. Save the manifest once the records
+        #               are written.
+        # pipeline is the name the run is recorded under in the
+        #               manifest. Default is 'full_analysis', or
+        #               'abstract_analysis' without the full paper.
+        if dois is None:
+            dois = self.find_dois()
+        dois = list(dois)
+        if manifest is not None:
+            if pipeline is None:
+                pipeline = 'full_analysis' if get_full_paper else 'abstract_analysis'
+            handles = dict((handle.doi, handle) for handle in manifest.pending(
+                pipeline, EXTRACTOR_VERSION, iter_corpus(self.basepath, dois=dois)))
+            dois = [doi for doi in dois if doi in handles]
+        for doi, record in self.run(dois, get_full_paper):
+            if manifest is not None:
+                manifest.mark_done(pipeline, EXTRACTOR_VERSION, handles[doi])
+            yield doi, record
+
+    def run(self, dois, get_full_paper=True):
+        self.failures = {}
+        options = {'parser': self.parser, 'get_full_paper': get_full_paper,
+                   'cache': self.cache}
+        chunks = list(self.chunks(dois))
+        if self.workers <= 1:
+            results = (analyze_chunk(self.basepath, chunk, options) for chunk in chunks)
+            for doi, record in self.collect(results):
+                yield doi, record
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(analyze_chunk, self.basepath, chunk, options)
+                       for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # The worker itself died (e.g. out of memory).
+                    results = [(doi, None, 'Worker failed: '+type(e).__name__+': '+str(e))
+                               for doi in chunk]
+                for doi, record in self.collect([results]):
+                    yield doi, record
+
+    def collect(self, chunk_results):
+        for results in chunk_results:
+            for doi, record, error in results:
+                if error is None:
+                    yield doi, record
+                else:
+                    self.failures[doi] = error
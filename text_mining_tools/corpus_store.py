@@ -0,0 +1,283 @@
+#!/usr/local/bin/python
+import os
+import time
+import numpy as np
+import pandas as pd
+from text_mining_tools.tables import as_grid, table_records
+"""
+The corpus store keeps the analysis of a whole corpus in columnar
+form (Arrow IPC files), instead of one pickle per Query or Article.
+It lives in AnalyzedResults:
+    basepath
+        |------AnalyzedResults
+                    |---corpus_store
+                            |---articles
+                            |      |---part-...arrow
+                            |---sections
+                            |---sentences
+                            |---captions
+                            |---tables
+                            |---query_hits
+
+There is one table per kind of output (see STORE_TABLES). Each append
+writes new part files, so existing data is never rewritten. Reads
+memory-map the part files and only touch the columns asked for, so
+nothing is unpickled and no soup is rebuilt:
+
+    store = CorpusStore(basepath)
+    store.append(Corpus(basepath).analyze())
+    store.append_query(my_query, 'mof_stability')
+    jacs = store.read_frame('articles', columns=['doi', 'abstract'],
+                            filters={'journal_name':
+                                     ['journal_of_the_american_chemical_society']})
+
+Tables:
+    articles     doi, prefix, publisher, title, authors, journal_name,
+                 publication_year, article_type, abstract, full_paper
+    sections     doi, section, name, text
+    sentences    doi, part ('abstract', 'section' or 'full_paper'),
+                 section (-1 outside sections), position, text
+    captions     doi, kind ('figure' or 'table'), number, text
+    tables       doi, table, row, col, header, text, value (see tables.py)
+    query_hits   query_name, query, doi, journal, issn, api, deduplicated
+
+This needs pyarrow (pip install pyarrow).
+"""
+
+STORE_DIRECTORY = 'corpus_store'
+STORE_TABLES = ['articles', 'sections', 'sentences', 'captions', 'tables',
+                'query_hits']
+
+
+def import_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('The corpus store needs pyarrow '
+                          '(pip install pyarrow).')
+    return pa
+
+
+def store_schemas(pa):
+    return {'articles': pa.schema([('doi', pa.string()), ('prefix', pa.string()),
+                                   ('publisher', pa.string()), ('title', pa.string()),
+                                   ('authors', pa.list_(pa.string())),
+                                   ('journal_name', pa.string()),
+                                   ('publication_year', pa.string()),
+                                   ('article_type', pa.string()),
+                                   ('abstract', pa.string()),
+                                   ('full_paper', pa.string())]),
+            'sections': pa.schema([('doi', pa.string()), ('section', pa.int32()),
+                                   ('name', pa.string()), ('text', pa.string())]),
+            'sentences': pa.schema([('doi', pa.string()), ('part', pa.string()),
+                                    ('section', pa.int32()), ('position', pa.int32()),
+                                    ('text', pa.string())]),
+            'captions': pa.schema([('doi', pa.string()), ('kind', pa.string()),
+                                   ('number', pa.int32()), ('text', pa.string())]),
+            'tables': pa.schema([('doi', pa.string()), ('table', pa.int32()),
+                                 ('row', pa.int32()), ('col', pa.int32()),
+                                 ('header', pa.bool_()), ('text', pa.string()),
+                                 ('value', pa.float64())]),
+            'query_hits': pa.schema([('query_name', pa.string()), ('query', pa.string()),
+                                     ('doi', pa.string()), ('journal', pa.string()),
+                                     ('issn', pa.string()), ('api', pa.string()),
+                                     ('deduplicated', pa.bool_())])}
+
+
+def as_string(value):
+    # The article getters use False for missing values.
+    if value is None or value is False:
+        return None
+    return str(value)
+
+
+def record_rows(record, rows):
+    # Appends the rows of one Article.to_record() to rows, a DICT of
+    # table name -> DICT of column name -> LIST.
+    doi = record['doi']
+    articles = rows['articles']
+    articles['doi'].append(doi)
+    articles['prefix'].append(as_string(record.get('prefix')))
+    articles['publisher'].append(as_string(record.get('getter')))
+    for field in ['title', 'journal_name', 'publication_year',
+                  'article_type', 'abstract', 'full_paper']:
+        articles[field].append(as_string(record.get(field)))
+    authors = record.get('authors')
+    articles['authors'].append(list(authors) if authors else None)
+    sentences = rows['sentences']
+
+    def add_sentences(part, section, values):
+        for position, text in enumerate(values or []):
+            sentences['doi'].append(doi)
+            sentences['part'].append(part)
+            sentences['section'].append(section)
+            sentences['position'].append(position)
+            sentences['text'].append(text)
+    add_sentences('abstract', -1, record.get('abstract_sentences'))
+    for i, section_dict in sorted((record.get('section_text_dict') or {}).items()):
+        for name, text in section_dict.items():
+            rows['sections']['doi'].append(doi)
+            rows['sections']['section'].append(i)
+            rows['sections']['name'].append(name)
+            rows['sections']['text'].append(text)
+    for i, section_dict in sorted((record.get('section_text_dict_sentences') or {}).items()):
+        for name, values in section_dict.items():
+            add_sentences('section', i, values)
+    add_sentences('full_paper', -1, record.get('full_paper_sentences'))
+    for kind, field in [('figure', 'figure_captions'), ('table', 'table_caption_dict')]:
+        for number, text in sorted((record.get(field) or {}).items()):
+            rows['captions']['doi'].append(doi)
+            rows['captions']['kind'].append(kind)
+            rows['captions']['number'].append(number)
+            rows['captions']['text'].append(text)
+    header_rows = record.get('table_header_rows') or {}
+    for counter, table in sorted((record.get('table_dict') or {}).items()):
+        if not isinstance(table, (list, np.ndarray)):
+            # DataFrame outputs are not stored.
+            continue
+        grid = as_grid(table)
+        cells = table_records(doi, counter, grid, header_rows.get(counter, 0))
+        for name, values in cells.items():
+            rows['tables'][name] += values
+
+
+class CorpusStore:
+    def __init__(self, basepath, directory=None):
+        # basepath is the ABSOLUTE PATH of the corpus.
+        # directory overrides where the store is kept. Default is
+        #               basepath/AnalyzedResults/corpus_store/.
+        self.pa = import_pyarrow()
+        if directory is None:
+            directory = os.path.join(basepath, 'AnalyzedResults', STORE_DIRECTORY)
+        self.directory = directory
+        self.schemas = store_schemas(self.pa)
+        for table in STORE_TABLES:
+            os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+        self.n_parts = 0
+
+    def empty_rows(self, tables=STORE_TABLES):
+        return dict((table, dict((name, []) for name in self.schemas[table].names))
+                    for table in tables)
+
+    def part_path(self, table):
+        # Unique across processes and appends, and sorted by time.
+        self.n_parts += 1
+        name = ('part-%d-%d-%d.arrow' % (time.time()*1e6, os.getpid(), self.n_parts))
+        return os.path.join(self.directory, table, name)
+
+    def write_part(self, table, batches):
+        batches = [batch for batch in batches if batch.num_rows > 0]
+        if len(batches) == 0:
+            return
+        path = self.part_path(table)
+        temp_path = path+'.tmp'
+        with self.pa.OSFile(temp_path, 'wb') as sink:
+            with self.pa.ipc.new_file(sink, self.schemas[table]) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        # Readers never see a half-written part.
+        os.replace(temp_path, path)
+
+    def append(self, records, batch_size=500):
+        # Appends analyzed articles. records is an iterable of
+        # Article.to_record() dicts, of (doi, record) pairs as
+        # Corpus.analyze() yields, or of analyzed Articles. Each
+        # call writes one new part per table. Returns the number of
+        # articles appended.
+        batches = dict((table, []) for table in STORE_TABLES)
+        rows = self.empty_rows()
+        n_articles = 0
+        for record in records:
+            if isinstance(record, tuple):
+                record = record[1]
+            elif not isinstance(record, dict):
+                record = record.to_record()
+            record_rows(record, rows)
+            n_articles += 1
+            if n_articles % batch_size == 0:
+                self.flush_rows(rows, batches)
+                rows = self.empty_rows()
+        self.flush_rows(rows, batches)
+        for table in STORE_TABLES:
+            self.write_part(table, batches[table])
+        return n_articles
+
+    def flush_rows(self, rows, batches):
+        for table, columns in rows.items():
+            batches[table].append(self.pa.RecordBatch.from_pydict(
+                columns, schema=self.schemas[table]))
+
+    def append_query(self, query, query_name=None):
+        # Appends the hits of a Query (every row of query_results,
+        # flagged if it was kept by the deduplication).
+        if query.query_results is None:
+            return 0
+        hits = pd.DataFrame(query.query_results)
+        kept = set()
+        if query.deduplicated_results is not None:
+            kept = set(query.deduplicated_results['doi'].keys())
+        columns = self.empty_rows(['query_hits'])['query_hits']
+        for index, row in hits.iterrows():
+            columns['query_name'].append(as_string(query_name))
+            for name in ['query', 'doi', 'journal', 'issn', 'api']:
+                columns[name].append(as_string(row.get(name)))
+            columns['deduplicated'].append(index in kept)
+        self.write_part('query_hits', [self.pa.RecordBatch.from_pydict(
+            columns, schema=self.schemas['query_hits'])])
+        return hits.shape[0]
+
+    def query_names(self):
+        return set(self.read('query_hits', columns=['query_name'])['query_name'].to_pylist())
+
+    def unique_query_name(self, name=None):
+        # Returns name if no query in the store has it yet, else
+        # name_1, name_2, etc. Default is query_1, query_2, etc.,
+        # as for pickled queries (see name_pickle in full_text_mine.py).
+        taken = self.query_names()
+        if name is not None and name not in taken:
+            return name
+        base = 'query' if name is None else str(name)
+        number = 1
+        while base+'_'+str(number) in taken:
+            number += 1
+        return base+'_'+str(number)
+
+    def parts(self, table):
+        if table not in STORE_TABLES:
+            raise AssertionError('Unknown store table '+str(table)+
+                                 '. Choose from '+str(STORE_TABLES)+'.')
+        table_path = os.path.join(self.directory, table)
+        return [os.path.join(table_path, filename)
+                for filename in sorted(os.listdir(table_path))
+                if filename.endswith('.arrow')]
+
+    def read(self, table, columns=None, filters=None):
+        # Returns a pyarrow Table. The part files are memory-mapped,
+        # so only the columns read are paged in.
+        # columns is a LIST of columns. Default is all.
+        # filters is a DICT of column -> LIST of accepted values.
+        import pyarrow.compute as pc
+        filters = filters or {}
+        schema = self.schemas[table]
+        if columns is None:
+            columns = schema.names
+        needed = list(columns) + [name for name in filters if name not in columns]
+        pieces = []
+        for path in self.parts(table):
+            # Not closed here: the table keeps using the mapped buffers.
+            source = self.pa.memory_map(path, 'r')
+            piece = self.pa.ipc.open_file(source).read_all().select(needed)
+            if filters:
+                mask = None
+                for name, values in filters.items():
+                    this_mask = pc.is_in(piece[name], value_set=self.pa.array(
+                        values, type=schema.field(name).type))
+                    mask = this_mask if mask is None else pc.and_(mask, this_mask)
+                piece = piece.filter(mask)
+            pieces.append(piece.select(list(columns)))
+        if len(pieces) == 0:
+            return self.pa.schema([schema.field(name) for name in columns]).empty_table()
+        return self.pa.concat_tables(pieces)
+
+    def read_frame(self, table, columns=None, filters=None):
+        return self.read(table, columns, filters).to_pandas()
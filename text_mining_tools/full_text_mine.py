@@ -2,6 +2,8 @@
 # functions written by Aditya Nandy for Kulik Group
 from text_mining_tools.query import Query
 from text_mining_tools.article import Article
+from text_mining_tools.corpus_store import CorpusStore
+from text_mining_tools.keyword_matcher import KeywordMatcher
 import pickle
 import glob, os
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
@@ -26,16 +28,25 @@ in the article class as analysis is person dependent!
 """
 
 def execute_query(basepath, keywords, elsevier_key=None,journal_limit=False, \
-                  number_of_results=10000, query_name=False, automate_download=False):
+                  number_of_results=10000, query_name=False, automate_download=False,
+                  columnar=False):
     # query_name is the name of the query class that will be 
     #                written to basepath/AnalyzedResults/.
     #                If nothing is provided, will be query0,
     #                query1, query2, etc. Stored as pickle.
     # number_of_results is PER JOURNAL.
+    # columnar appends the query hits to the corpus store (see
+    #                corpus_store.py) instead of pickling the query,
+    #                under query_name, made unique among the queries
+    #                already in the store.
     # This function instantiates a query, then stores the query as a pickle.
     my_query = Query(basepath=basepath, keywords=keywords, 
                      elsevier_key=elsevier_key, journal_limit=journal_limit,
                      number_of_results=number_of_results,automate_download=automate_download)
+    if columnar:
+        store = CorpusStore(basepath)
+        store.append_query(my_query, store.unique_query_name(query_name or None))
+        return my_query
     pickle_name = name_pickle(basepath, name=query_name)
     filename = open(str(basepath)+'/AnalyzedResults/'+str(pickle_name), 'wb')
     pickle.dump(my_query, filename)
@@ -51,6 +62,18 @@ def pickle_object(basepath, python_class, name=False, query=True):
     pickle.dump(python_class, filename)
     return query
 
+def store_articles(basepath, articles):
+    # Analyzes the articles that were not analyzed yet and appends
+    # them to the corpus store in AnalyzedResults/, instead of
+    # pickling them. articles is a LIST of Article classes, e.g.
+    # the values of a query's article_dict.
+    def analyzed(articles):
+        for article in articles:
+            if not article.is_computed('section_text_dict'):
+                article.full_analysis()
+            yield article
+    return CorpusStore(basepath).append(analyzed(articles))
+
 def VADER_analysis(sentences, keywords):
     ##### This helper function takes sentences that are already broken apart.
     ##### You should be able to already work with sentences assigned to an 
@@ -60,12 +83,16 @@ def VADER_analysis(sentences, keywords):
     # Input keywords should be a list of keywords.
     if not isinstance(keywords,list):
         keywords = [keywords]
+    # Both keyword sets are checked in one pass per sentence.
+    matcher = KeywordMatcher({'kw': keywords,
+                              'negated': ['not '+val for val in keywords]})
     kw_found = False
     kw_in_list = []
     polarity_list = []
     for sent_num, sent in enumerate(sentences):
-        if any([val in sent for val in keywords]):
-            if any([('not '+val) in sent for val in keywords]):
+        found = matcher.found_by_label(sent)
+        if len(found['kw']) > 0:
+            if len(found['negated']) > 0:
                 kw_found = False
             else:
                 kw_in_list.append(sent_num)
@@ -0,0 +1,228 @@
+#!/usr/local/bin/python
+from text_mining_tools.article import Article, clean_html, publisher_of, resolve_parser
+from text_mining_tools.pruning import PruneRules, walk_tags, pruned_strings
+from bs4 import BeautifulSoup, Comment, NavigableString
+import numpy as np
+import os
+import time
+"""
+The ingest stage strips the boilerplate of publisher pages (scripts,
+styles, menus, tracking frames, comments...) once, when a paper is
+downloaded, so it is neither stored nor parsed again on every run.
+
+Only what no extractor reads is stripped. An element matched by the
+publisher rules (see PUBLISHER_INGEST_RULES) is removed only if:
+    - it adds no text to the full paper (Article.prune_rules drops all
+      of its text anyway),
+    - it lies outside the stored sections (get_section_text keeps
+      every string, scripts included, between the first and the last
+      section heading),
+    - it holds none of the tags the getters look for (meta, title,
+      tables, figures, headings) or a section heading.
+Comments outside the stored sections are removed as well. Everything
+else, including text-bearing boilerplate, is kept.
+
+With verify=True, the extractors are run on the original and the
+stripped paper, and the original is kept if any output differs. The
+size of every paper before and after is appended to
+basepath/AnalyzedResults/ingest_log.csv:
+
+    Article.ingest_stage = IngestStage(verify=True)
+    Article(doi, basepath)    # downloads, strips, stores
+
+Papers already in a corpus are stripped with ingest_corpus().
+"""
+
+INGEST_LOG_FILENAME = 'ingest_log.csv'
+INGEST_LOG_COLUMNS = ['doi', 'publisher', 'original_bytes', 'stripped_bytes',
+                      'removed', 'kept_original', 'time']
+
+# Elements that only serve the page, never the paper.
+INGEST_TAGS = ['script', 'style', 'noscript', 'link', 'iframe', 'template',
+               'svg', 'button', 'select', 'option', 'input', 'nav']
+# Tags the getters look for. Elements holding them are kept.
+PROTECTED_TAGS = ['meta', 'title', 'table', 'figure', 'figcaption',
+                  'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+INGEST_RULES = PruneRules(INGEST_TAGS)
+# Menus, "Jump To" lists and banners of each publisher. They are only
+# removed if they pass the checks above.
+PUBLISHER_INGEST_RULES = {
+    'rsc': INGEST_RULES.extend(remove_classes={
+        'div': ['navigation', 'autopopup', 'article-nav', 'cookie-banner']}),
+    'wiley': INGEST_RULES.extend(remove_classes={
+        'div': ['article-section__inline-jump-to', 'article-row-right',
+                'cookie-banner', 'pb-dropzone'],
+        'section': ['article-section__jump-to']}),
+    'nature': INGEST_RULES.extend(remove_classes={
+        'div': ['c-header', 'c-cookie-banner', 'c-reading-companion',
+                'c-article-extras'],
+        'aside': ['c-reading-companion']}),
+    'acs': INGEST_RULES.extend(remove_classes={
+        'div': ['article_header-links', 'cookie-banner', 'pb-dropzone']})}
+
+
+def is_blank(node):
+    # True for a whitespace-only string (not a comment).
+    return (type(node) is NavigableString and len(node) > 0 and
+            len(node.strip()) == 0)
+
+
+def records_equal(first, second):
+    # Compares two Article.to_record() outputs (tables can be arrays).
+    if isinstance(first, np.ndarray) or isinstance(second, np.ndarray):
+        return (isinstance(first, np.ndarray) and isinstance(second, np.ndarray) and
+                first.shape == second.shape and bool(np.all(first == second)))
+    if isinstance(first, dict) and isinstance(second, dict):
+        return (list(first.keys()) == list(second.keys()) and
+                all(records_equal(first[key], second[key]) for key in first))
+    if isinstance(first, (list, tuple)) and isinstance(second, (list, tuple)):
+        return (len(first) == len(second) and
+                all(records_equal(a, b) for a, b in zip(first, second)))
+    return first == second
+
+
+class InMemoryArticle(Article):
+    # An Article read from HTML bytes instead of its file, so the
+    # original and stripped papers can be analyzed side by side.
+    def __init__(self, article, html_doc):
+        Article.__init__(self, article.doi, article.basepath, download=False,
+                         parser=article.parser, store=article.store)
+        self.html_doc = html_doc
+
+    def load_paper(self):
+        return clean_html(self.html_doc)
+
+    def paper_hash(self):
+        return None
+
+
+class IngestStage:
+    def __init__(self, verify=False, rules=None, parser=None, log=True):
+        # verify runs the extractors on the original and the stripped
+        #               paper, and keeps the original if any output
+        #               differs. Slower, but outputs never change.
+        # rules is a DICT of publisher -> PruneRules of the elements
+        #               that can be removed. Default is
+        #               PUBLISHER_INGEST_RULES (INGEST_RULES for others).
+        # parser is the BeautifulSoup backend. Default is the
+        #               article's parser, as later reads use it.
+        # log appends each paper's sizes to the ingest log.
+        self.verify = verify
+        if rules is None:
+            rules = PUBLISHER_INGEST_RULES
+        self.rules = rules
+        self.parser = parser
+        self.log = log
+        self.mismatches = {}
+
+    def rules_for(self, doi):
+        return self.rules.get(publisher_of(doi), INGEST_RULES)
+
+    def strip(self, article, html_doc):
+        # Returns the stripped HTML (bytes) and the number of elements
+        # removed.
+        parser = resolve_parser(self.parser or article.parser)
+        soup = BeautifulSoup(html_doc, parser, from_encoding='UTF-8')
+        positions = dict((id(node), i) for i, node in enumerate(soup.descendants))
+        headings = [tag for name, tag in article.find_section_headings(soup)]
+        heading_ids = set(id(tag) for tag in headings)
+        if len(headings) > 0:
+            first = min(positions[id(tag)] for tag in headings)
+            last = max(positions[id(tag)] for tag in headings)
+        else:
+            first, last = 0, -1
+
+        def outside_sections(node):
+            return not (first <= positions[id(node)] <= last)
+
+        removed = []
+        for node, is_removed in walk_tags(soup, self.rules_for(article.doi)):
+            if not is_removed or not outside_sections(node):
+                continue
+            if node.find(PROTECTED_TAGS) is not None:
+                continue
+            if any(id(val) in heading_ids for val in node.descendants):
+                continue
+            if (not article.prune_rules.is_removed(node) and
+                    next(pruned_strings(node, article.prune_rules), None) is not None):
+                continue
+            removed.append(node)
+        comments = [node for node in soup.find_all(string=lambda val: isinstance(val, Comment))
+                    if outside_sections(node)]
+        for node in removed + comments:
+            if is_blank(node.previous_sibling) and is_blank(node.next_sibling):
+                # The parser would merge the two blank strings into one
+                # and drop whitespace from the text, so they are kept
+                # apart by an empty comment.
+                node.replace_with(Comment(''))
+            else:
+                node.extract()
+        return soup.decode().encode('utf-8'), len(removed) + len(comments)
+
+    def differing_fields(self, article, original, stripped):
+        # The to_record() fields that differ between the two papers.
+        records = []
+        for html_doc in [original, stripped]:
+            copy = InMemoryArticle(article, html_doc)
+            copy.full_analysis()
+            records.append(copy.to_record())
+        return [field for field in records[0]
+                if not records_equal(records[0][field], records[1][field])]
+
+    def process(self, article, html_doc):
+        # Returns the HTML to store for the article.
+        stripped, n_removed = self.strip(article, html_doc)
+        kept_original = False
+        if len(stripped) >= len(html_doc):
+            stripped, kept_original = html_doc, True
+        elif self.verify:
+            differing = self.differing_fields(article, html_doc, stripped)
+            if differing:
+                print('Stripping changes '+', '.join(differing)+' for '+
+                      article.doi+'. Keeping the original.')
+                self.mismatches[article.doi] = differing
+                stripped, kept_original = html_doc, True
+        if self.log:
+            self.write_log(article, len(html_doc), len(stripped), n_removed,
+                           kept_original)
+        return stripped
+
+    def write_log(self, article, original_bytes, stripped_bytes, n_removed, kept_original):
+        directory = os.path.join(article.basepath, 'AnalyzedResults')
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, INGEST_LOG_FILENAME)
+        new_file = not os.path.exists(filename)
+        with open(filename, 'a') as fout:
+            if new_file:
+                fout.write(','.join(INGEST_LOG_COLUMNS)+'\n')
+            fout.write(','.join([article.doi, str(publisher_of(article.doi)),
+                                 str(original_bytes), str(stripped_bytes),
+                                 str(n_removed), str(kept_original),
+                                 '%.0f' % time.time()])+'\n')
+
+
+def ingest_corpus(basepath, stage=None, **filters):
+    # Strips the papers already in a corpus (files or ShardStore), in
+    # place. filters are passed to iter_corpus. Returns the total
+    # (original bytes, stripped bytes).
+    from text_mining_tools.corpus import iter_corpus
+    if stage is None:
+        stage = IngestStage(verify=True)
+    original_bytes, stripped_bytes = 0, 0
+    for handle in iter_corpus(basepath, **filters):
+        with handle.open() as fin:
+            html_doc = fin.read()
+        stripped = stage.process(handle.article(), html_doc)
+        original_bytes += len(html_doc)
+        stripped_bytes += len(stripped)
+        if stripped is html_doc:
+            continue
+        if handle.store is not None:
+            handle.store.put(handle.doi, stripped)
+        else:
+            temp_path = handle.path+'.tmp'
+            with open(temp_path, 'wb') as fout:
+                fout.write(stripped)
+            os.replace(temp_path, handle.path)
+    return original_bytes, stripped_bytes
@@ -0,0 +1,275 @@
+#!/usr/local/bin/python
+import os
+import sqlite3
+import regex as re
+"""
+The inverted index maps every normalized term of a corpus to where it
+occurs, so keyword screens look up postings instead of scanning every
+sentence of every paper. It is an SQLite file, next to the other
+analysis outputs:
+    basepath
+        |------AnalyzedResults
+                    |---inverted_index.sqlite
+
+A posting is (doc, section, sentence, position). Sections are numbered
+as in Article.section_name_dict (1, 2, ...), so section n holds the
+sentences of section_text_dict_sentences[n-1]. The abstract is section
+ABSTRACT_SECTION (0), and papers without sections are indexed from
+their full paper sentences as section FULL_PAPER_SECTION. Terms are the
+lowercased words (\\w+) of the sentences, so hyphens, brackets and
+other punctuation split terms, in sentences and in queries alike.
+
+The index is built incrementally, one analyzed article at a time (an
+Article, or a record from Article.to_record() or Corpus.analyze()).
+Articles already indexed are skipped unless replace=True.
+
+    index = InvertedIndex(basepath)
+    index.add(Corpus(basepath).analyze())
+    index.search('thermogravimetric analysis')    # phrase
+    index.search('collaps*')                      # prefix
+    index.cooccur(['desolv*', 'collaps*'], window=2)
+
+Queries return sets of (doi, section, sentence) hits. search() takes
+one word, a prefix (ending in *), or a phrase of several words (each
+of which can be a prefix). cooccur() returns the places where every
+query matches within the same sentence, or within window sentences
+of the same section, or in the same paper (scope='doc').
+"""
+
+INDEX_FILENAME = 'inverted_index.sqlite'
+ABSTRACT_SECTION = 0
+FULL_PAPER_SECTION = -1
+TERM_PATTERN = re.compile(r'\w+')
+COOCCUR_SCOPES = ['sentence', 'section', 'doc']
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS docs (doc_id INTEGER PRIMARY KEY, doi TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS terms (term_id INTEGER PRIMARY KEY, term TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS postings (term_id INTEGER, doc_id INTEGER,
+    section INTEGER, sentence INTEGER, position INTEGER,
+    PRIMARY KEY (term_id, doc_id, section, sentence, position)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sentences (doc_id INTEGER, section INTEGER,
+    sentence INTEGER, text TEXT,
+    PRIMARY KEY (doc_id, section, sentence)) WITHOUT ROWID;
+'''
+
+
+def tokenize_terms(text):
+    return [val.lower() for val in TERM_PATTERN.findall(text)]
+
+
+def record_sentences(record):
+    # Yields (section, sentence number, text) for the sentences of an
+    # Article.to_record() that are indexed.
+    for i, sentence in enumerate(record.get('abstract_sentences') or []):
+        yield ABSTRACT_SECTION, i, sentence
+    section_sentences = record.get('section_text_dict_sentences') or {}
+    for section, section_dict in sorted(section_sentences.items()):
+        # section_text_dict_sentences counts from 0, section_name_dict
+        # (and the index) from 1, leaving 0 to the abstract.
+        for name, sentences in section_dict.items():
+            for i, sentence in enumerate(sentences):
+                yield section + 1, i, sentence
+    if len(section_sentences) == 0:
+        for i, sentence in enumerate(record.get('full_paper_sentences') or []):
+            yield FULL_PAPER_SECTION, i, sentence
+
+
+class InvertedIndex:
+    def __init__(self, basepath=None, filename=None, store_text=True):
+        # basepath is the ABSOLUTE PATH of the corpus. The index is
+        #               basepath/AnalyzedResults/inverted_index.sqlite.
+        # filename overrides where the index is stored.
+        # store_text keeps the text of every indexed sentence, so hits
+        #               can be read back without the papers.
+        if filename is None:
+            if basepath is None:
+                raise AssertionError('Give the corpus basepath or an index filename.')
+            directory = os.path.join(basepath, 'AnalyzedResults')
+            os.makedirs(directory, exist_ok=True)
+            filename = os.path.join(directory, INDEX_FILENAME)
+        self.filename = filename
+        self.store_text = store_text
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(INDEX_SCHEMA)
+        self.term_ids = {}
+
+    def close(self):
+        self.connection.close()
+
+    def term_id(self, term):
+        # Returns the id of a term, adding it if it is new.
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO terms (term) VALUES (?)', (term,))
+            if cursor.rowcount == 1:
+                term_id = cursor.lastrowid
+            else:
+                term_id = self.connection.execute(
+                    'SELECT term_id FROM terms WHERE term = ?', (term,)).fetchone()[0]
+            self.term_ids[term] = term_id
+        return term_id
+
+    def doc_id(self, doi):
+        row = self.connection.execute('SELECT doc_id FROM docs WHERE doi = ?',
+                                      (doi,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def __contains__(self, doi):
+        return self.doc_id(doi) is not None
+
+    def dois(self):
+        return [row[0] for row in
+                self.connection.execute('SELECT doi FROM docs ORDER BY doi')]
+
+    def remove(self, doi):
+        doc_id = self.doc_id(doi)
+        if doc_id is None:
+            return
+        with self.connection:
+            self.connection.execute('DELETE FROM postings WHERE doc_id = ?', (doc_id,))
+            self.connection.execute('DELETE FROM sentences WHERE doc_id = ?', (doc_id,))
+            self.connection.execute('DELETE FROM docs WHERE doc_id = ?', (doc_id,))
+
+    def add(self, articles, replace=False, commit_every=100):
+        # Indexes analyzed articles. articles is an iterable of
+        # Articles, Article.to_record() dicts, or the (doi, record)
+        # pairs Corpus.analyze() yields. Returns the number of
+        # articles indexed.
+        n_added = 0
+        for article in articles:
+            if isinstance(article, tuple):
+                article = article[1]
+            elif not isinstance(article, dict):
+                article = article.to_record()
+            if self.add_record(article, replace):
+                n_added += 1
+                if n_added % commit_every == 0:
+                    self.connection.commit()
+        self.connection.commit()
+        return n_added
+
+    def add_record(self, record, replace=False):
+        doi = record['doi']
+        if doi in self:
+            if not replace:
+                return False
+            self.remove(doi)
+        doc_id = self.connection.execute('INSERT INTO docs (doi) VALUES (?)',
+                                         (doi,)).lastrowid
+        postings = []
+        sentences = []
+        for section, i, sentence in record_sentences(record):
+            for position, term in enumerate(tokenize_terms(sentence)):
+                postings.append((self.term_id(term), doc_id, section, i, position))
+            if self.store_text:
+                sentences.append((doc_id, section, i, sentence))
+        self.connection.executemany('INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?, ?)',
+                                    postings)
+        self.connection.executemany('INSERT OR IGNORE INTO sentences VALUES (?, ?, ?, ?)',
+                                    sentences)
+        return True
+
+    def matching_term_ids(self, word):
+        # Term ids of a query word, or of every term it is a prefix of
+        # when it ends in *.
+        if word.endswith('*'):
+            prefix = word[:-1].lower()
+            if prefix == '':
+                raise AssertionError('A prefix query needs at least one character.')
+            # Range scan on the term index: prefix <= term < prefix + max char.
+            rows = self.connection.execute(
+                'SELECT term_id FROM terms WHERE term >= ? AND term < ?',
+                (prefix, prefix + u'\U0010ffff'))
+            return [row[0] for row in rows]
+        row = self.connection.execute('SELECT term_id FROM terms WHERE term = ?',
+                                      (word.lower(),)).fetchone()
+        if row is None:
+            return []
+        return [row[0]]
+
+    def postings(self, word):
+        # Returns the set of (doc_id, section, sentence, position) of a
+        # query word.
+        found = set()
+        for term_id in self.matching_term_ids(word):
+            found.update(self.connection.execute(
+                'SELECT doc_id, section, sentence, position FROM postings '
+                'WHERE term_id = ?', (term_id,)))
+        return found
+
+    def search(self, query):
+        # Returns the set of (doi, section, sentence) where the query
+        # (a word, a prefix ending in *, or a phrase) occurs.
+        words = [val for val in re.findall(r'\w+\*?', query)]
+        if len(words) == 0:
+            return set()
+        # Each next word keeps the phrase starts it continues.
+        starts = self.postings(words[0])
+        for offset, word in enumerate(words[1:], 1):
+            if len(starts) == 0:
+                break
+            following = set((doc_id, section, sentence, position - offset)
+                            for doc_id, section, sentence, position
+                            in self.postings(word))
+            starts &= following
+        return self.with_dois(set((doc_id, section, sentence) for doc_id, section,
+                                  sentence, position in starts))
+
+    def with_dois(self, hits):
+        doc_ids = set(val[0] for val in hits)
+        dois = {}
+        for doc_id in doc_ids:
+            dois[doc_id] = self.connection.execute(
+                'SELECT doi FROM docs WHERE doc_id = ?', (doc_id,)).fetchone()[0]
+        return set((dois[doc_id],) + tuple(rest) for doc_id, *rest in hits)
+
+    def cooccur(self, queries, scope='sentence', window=0):
+        # Returns where all queries match together. With scope
+        # 'sentence', hits are the (doi, section, sentence) of the
+        # first query that have a hit of every other query within
+        # window sentences in the same section. With 'section' they
+        # are (doi, section), and with 'doc' they are dois.
+        if scope not in COOCCUR_SCOPES:
+            raise AssertionError('Unknown scope '+str(scope)+
+                                 '. Choose from '+str(COOCCUR_SCOPES)+'.')
+        hit_sets = [self.search(query) for query in queries]
+        if len(hit_sets) == 0:
+            return set()
+        if scope == 'doc':
+            found = set(val[0] for val in hit_sets[0])
+            for hits in hit_sets[1:]:
+                found &= set(val[0] for val in hits)
+            return found
+        if scope == 'section':
+            found = set(val[:2] for val in hit_sets[0])
+            for hits in hit_sets[1:]:
+                found &= set(val[:2] for val in hits)
+            return found
+        found = hit_sets[0]
+        for hits in hit_sets[1:]:
+            nearby = set()
+            for doi, section, sentence in hits:
+                for shift in range(-window, window + 1):
+                    nearby.add((doi, section, sentence + shift))
+            found = set(val for val in found if val in nearby)
+        return found
+
+    def sentence_text(self, hit):
+        # Returns the text of a (doi, section, sentence) hit, if the
+        # index stores text.
+        doi, section, sentence = hit
+        row = self.connection.execute(
+            'SELECT text FROM sentences WHERE doc_id = ? AND section = ? AND sentence = ?',
+            (self.doc_id(doi), section, sentence)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def screen(self, keywords):
+        # Corpus-wide keyword screen. Returns a DICT of keyword ->
+        # sorted LIST of (doi, section, sentence) hits.
+        return dict((keyword, sorted(self.search(keyword))) for keyword in keywords)
@@ -0,0 +1,184 @@
+#!/usr/local/bin/python
+import regex as re
+"""
+The keyword matcher finds every keyword of a set in a text in one pass,
+instead of one `in` test or re.search per keyword. It is compiled once
+per keyword set and then used on every sentence of a corpus.
+
+Two engines are available:
+    ahocorasick   An Aho-Corasick automaton (pyahocorasick). Every
+                  keyword is found in a single pass over the text,
+                  however many keywords there are. Used if installed.
+    regex         A single overlapped regex over all keywords (longest
+                  first), with the keywords that are prefixes of each
+                  match added. Always available.
+Both return the same hits.
+
+Hits are (start, end, keyword), with the positions in the original
+text, sorted by start then end, overlapping hits included (so 'stable'
+is found inside 'unstable', as with `'stable' in text`).
+
+Options:
+    ignore_case   Matches regardless of case (both text and keywords
+                  are lowercased).
+    boundary      'none' matches anywhere, like `in`. 'start' only
+                  matches at the start of a word ('collaps' matches
+                  'collapsed', not 'recollapse'). 'word' only matches
+                  whole words.
+
+Keywords can be a LIST, or a DICT of label -> LIST to screen several
+keyword groups in the same pass:
+
+    matcher = KeywordMatcher({'collapse': ['collaps', 'amorph'],
+                              'stable': ['stability', ' stable']})
+    matcher.found(sentence)          # ['collaps', ' stable']
+    matcher.found_by_label(sentence) # {'collapse': ['collaps'], ...}
+
+    pip install pyahocorasick
+"""
+
+MATCHER_ENGINES = ['ahocorasick', 'regex']
+MATCH_BOUNDARIES = ['none', 'start', 'word']
+
+
+def default_engine():
+    try:
+        import ahocorasick
+        return 'ahocorasick'
+    except ImportError:
+        return 'regex'
+
+
+def is_word_character(character):
+    return character.isalnum() or character == '_'
+
+
+def fold_case(text):
+    # Lowercases the text, keeping its length so positions in the
+    # folded text are positions in the original one. The few
+    # characters whose lowercase is longer are left as they are.
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return ''.join(val.lower() if len(val.lower()) == 1 else val for val in text)
+
+
+class KeywordMatcher:
+    def __init__(self, keywords, ignore_case=False, boundary='none', engine=None):
+        # keywords is a LIST of keywords, or a DICT of label -> LIST.
+        # ignore_case matches regardless of case.
+        # boundary is 'none', 'start' or 'word' (see MATCH_BOUNDARIES).
+        # engine is 'ahocorasick' or 'regex'. If None, ahocorasick is
+        #               used when it is installed.
+        if boundary not in MATCH_BOUNDARIES:
+            raise AssertionError('Unknown boundary '+str(boundary)+
+                                 '. Choose from '+str(MATCH_BOUNDARIES)+'.')
+        if engine is None:
+            engine = default_engine()
+        if engine not in MATCHER_ENGINES:
+            raise AssertionError('Unknown engine '+str(engine)+
+                                 '. Choose from '+str(MATCHER_ENGINES)+'.')
+        self.ignore_case = ignore_case
+        self.boundary = boundary
+        self.engine = engine
+        if isinstance(keywords, dict):
+            self.labels = list(keywords.keys())
+            entries = [(keyword, label) for label in self.labels
+                       for keyword in keywords[label]]
+        else:
+            self.labels = [None]
+            entries = [(keyword, None) for keyword in keywords]
+        # Kept in the order given (with repeats), as `found` returns them.
+        self.entries = entries
+        self.compile()
+
+    def fold(self, text):
+        if self.ignore_case:
+            return fold_case(text)
+        return text
+
+    def compile(self):
+        # Maps each (folded) keyword to the keywords it stands for.
+        self.keyword_map = {}
+        for keyword, label in self.entries:
+            if len(keyword) == 0:
+                raise AssertionError('Keywords cannot be empty.')
+            self.keyword_map.setdefault(self.fold(keyword), [])
+            if keyword not in self.keyword_map[self.fold(keyword)]:
+                self.keyword_map[self.fold(keyword)].append(keyword)
+        if self.engine == 'ahocorasick':
+            import ahocorasick
+            self.automaton = ahocorasick.Automaton()
+            for key in self.keyword_map:
+                self.automaton.add_word(key, key)
+            self.automaton.make_automaton()
+        else:
+            # At each start, the longest keyword is matched. The shorter
+            # keywords matching at the same start are its prefixes.
+            keys = sorted(self.keyword_map.keys(), key=len, reverse=True)
+            self.pattern = re.compile('(?:'+'|'.join(re.escape(val) for val in keys)+')')
+            self.prefixes = dict((key, [val for val in keys if key.startswith(val)])
+                                 for key in keys)
+
+    def raw_matches(self, folded):
+        # Yields (start, end, folded keyword) for every occurrence.
+        if len(self.keyword_map) == 0:
+            return
+        if self.engine == 'ahocorasick':
+            for last, key in self.automaton.iter(folded):
+                yield last + 1 - len(key), last + 1, key
+        else:
+            for match in self.pattern.finditer(folded, overlapped=True):
+                for key in self.prefixes[match.group(0)]:
+                    yield match.start(), match.start() + len(key), key
+
+    def findall(self, text):
+        # Returns every hit (start, end, keyword) in the text.
+        hits = []
+        for start, end, key in self.raw_matches(self.fold(text)):
+            if self.boundary != 'none':
+                if start > 0 and is_word_character(text[start - 1]):
+                    continue
+                if (self.boundary == 'word' and end < len(text) and
+                        is_word_character(text[end])):
+                    continue
+            for keyword in self.keyword_map[key]:
+                hits.append((start, end, keyword))
+        hits.sort(key=lambda val: (val[0], val[1]))
+        return hits
+
+    def search(self, text):
+        # True if any keyword is in the text.
+        if self.boundary == 'none':
+            for val in self.raw_matches(self.fold(text)):
+                return True
+            return False
+        return len(self.findall(text)) > 0
+
+    def found_keywords(self, text):
+        # Returns the SET of keywords found in the text.
+        if self.boundary == 'none':
+            # No positions needed, only which keywords occur.
+            keys = set(key for start, end, key in self.raw_matches(self.fold(text)))
+            return set(keyword for key in keys for keyword in self.keyword_map[key])
+        return set(keyword for start, end, keyword in self.findall(text))
+
+    def found(self, text):
+        # Returns the keywords found in the text, in the order they
+        # were given, as [val for val in keywords if val in text] does.
+        keywords = self.found_keywords(text)
+        if len(keywords) == 0:
+            return []
+        return [keyword for keyword, label in self.entries if keyword in keywords]
+
+    def found_by_label(self, text):
+        # Returns a DICT of label -> LIST of keywords found, in order.
+        keywords = self.found_keywords(text)
+        found = dict((label, []) for label in self.labels)
+        for keyword, label in self.entries:
+            if keyword in keywords:
+                found[label].append(keyword)
+        return found
+
+    # Allows matcher(text), like found(text).
+    __call__ = found
@@ -0,0 +1,130 @@
+#!/usr/local/bin/python
+import json
+import os
+import time
+"""
+The manifest records, for every HTML file of a corpus, its size,
+modification time and hash, and which pipelines (at which version)
+have processed it. Jobs use it to process only the files that are new
+or changed since their last run, and merge the results into their
+existing outputs. It is a JSON file in AnalyzedResults:
+    basepath
+        |------AnalyzedResults
+                    |---manifest.json
+
+A file is only hashed again when its size or modification time
+changed, so checking a large corpus is cheap. A file whose content
+changed gets a new hash, so every pipeline processes it again. A new
+pipeline version processes every file again.
+
+    manifest = Manifest(basepath)
+    for handle in manifest.pending('thermal', '2', iter_corpus(basepath)):
+        ...
+        manifest.mark_done('thermal', '2', handle)
+    # Write the outputs, then:
+    manifest.save()
+
+Files that were removed from the corpus are listed by missing(), so
+their results can be dropped from the outputs:
+
+    removed = manifest.missing('thermal')
+    # Drop their results from the outputs, then:
+    manifest.forget('thermal', removed)
+
+Each pipeline forgets a removed file on its own run, so pipelines that
+share the manifest all drop it from their outputs.
+"""
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+class Manifest:
+    def __init__(self, basepath, filename=None, autosave=None):
+        # basepath is the ABSOLUTE PATH of the corpus.
+        # filename overrides where the manifest is kept. Default is
+        #               basepath/AnalyzedResults/manifest.json.
+        # autosave saves the manifest every autosave files marked
+        #               done. Only use it if the job writes its
+        #               results as it goes: the manifest should never
+        #               be saved ahead of the outputs. Default is to
+        #               save on save() only.
+        if filename is None:
+            directory = os.path.join(basepath, 'AnalyzedResults')
+            os.makedirs(directory, exist_ok=True)
+            filename = os.path.join(directory, MANIFEST_FILENAME)
+        self.filename = filename
+        self.autosave = autosave
+        self.files = {}
+        self.pipelines = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as fin:
+                saved = json.load(fin)
+            self.files = saved.get('files', {})
+            self.pipelines = saved.get('pipelines', {})
+        self.n_marked = 0
+        self.seen = set()
+
+    def save(self):
+        # Written to a temporary file, then moved into place, so the
+        # manifest is never left half written.
+        temp_filename = self.filename+'.tmp'
+        with open(temp_filename, 'w') as fout:
+            json.dump({'files': self.files, 'pipelines': self.pipelines}, fout)
+        os.replace(temp_filename, self.filename)
+
+    def check(self, handle):
+        # Updates the record of a file (an ArticleHandle, see
+        # corpus.py) and returns its hash. The file is only hashed if
+        # it is new or its size or modification time changed.
+        self.seen.add(handle.doi)
+        size, mtime = handle.stat()
+        record = self.files.get(handle.doi)
+        if (record is not None and record['size'] == size and
+                record['mtime'] == mtime):
+            return record['sha256']
+        record = {'size': size, 'mtime': mtime, 'sha256': handle.sha256()}
+        self.files[handle.doi] = record
+        return record['sha256']
+
+    def is_done(self, pipeline, version, handle):
+        sha256 = self.check(handle)
+        done = self.pipelines.get(pipeline, {}).get(handle.doi)
+        return (done is not None and done['version'] == str(version) and
+                done['sha256'] == sha256)
+
+    def pending(self, pipeline, version, handles):
+        # Yields the handles this pipeline version has not processed
+        # in their current state (new files, changed files, or all of
+        # them for a new version).
+        for handle in handles:
+            if not self.is_done(pipeline, version, handle):
+                yield handle
+
+    def mark_done(self, pipeline, version, handle):
+        sha256 = self.check(handle)
+        self.pipelines.setdefault(pipeline, {})[handle.doi] = {
+            'version': str(version), 'sha256': sha256, 'time': time.time()}
+        self.n_marked += 1
+        if self.autosave and self.n_marked % self.autosave == 0:
+            self.save()
+
+    def missing(self, pipeline):
+        # DOIs this pipeline processed that were not seen since the
+        # manifest was loaded (files removed from the corpus, after a
+        # full pass over it).
+        return sorted(set(self.pipelines.get(pipeline, {}).keys()) - self.seen)
+
+    def forget(self, pipeline, dois):
+        # Drops removed files from this pipeline. Their file record
+        # is only dropped once no other pipeline still lists them, so
+        # every pipeline sharing the manifest sees them in missing().
+        done = self.pipelines.get(pipeline, {})
+        for doi in dois:
+            done.pop(doi, None)
+            if not any(doi in other for other in self.pipelines.values()):
+                self.files.pop(doi, None)
+
+    def reset(self, pipeline):
+        # Marks every file as not done by this pipeline, e.g. when
+        # its output was lost.
+        self.pipelines.pop(pipeline, None)
@@ -0,0 +1,124 @@
+#!/usr/local/bin/python
+from bs4 import NavigableString, CData
+"""
+Pruning drops the parts of a parsed paper that clutter the mined text
+(scripts, lists, tables, anchors, citation boxes...) and flattens the
+tags that are difficult to mine (sub/superscripts).
+
+A PruneRules object says which tags are removed with everything under
+them, which tags are removed only when they carry a given class, and
+which tags are unwrapped (replaced by their children). prune_tree
+applies the rules in place in a single walk over the tree, so its cost
+grows linearly with the document instead of with
+(number of pruned elements) x (document size).
+"""
+
+
+# Tags dropped (with everything under them) before the full paper text
+# is taken. Divs carrying exactly one of the citation classes are also
+# dropped, since they clutter the text with the citation tree.
+PRUNED_TAGS = ['script', 'style', 'ol', 'ul', 'li', 'table',
+               'a', 'noscript', 'option']
+CITATION_DIV_CLASSES = ['citationInfo', 'casRecord', 'casContent',
+                        'casTitle', 'casAuthors', 'casAbstract']
+# Subscripts and superscripts are flattened, they are difficult to mine.
+UNWRAPPED_TAGS = ['sup', 'sub']
+
+
+class PruneRules:
+    def __init__(self, remove_tags=(), remove_classes=None, unwrap_tags=()):
+        # remove_tags is a LIST of tag names dropped with their subtree.
+        # remove_classes is a DICT of tag name -> LIST of classes. A tag
+        #               whose class attribute is exactly one of these
+        #               classes is dropped with its subtree.
+        # unwrap_tags is a LIST of tag names replaced by their children.
+        self.remove_tags = set(remove_tags)
+        self.remove_classes = {}
+        if remove_classes:
+            for name, classes in remove_classes.items():
+                self.remove_classes[name] = set(classes)
+        self.unwrap_tags = set(unwrap_tags)
+
+    def is_removed(self, tag):
+        if tag.name in self.remove_tags:
+            return True
+        if tag.name in self.remove_classes:
+            classes = tag.get('class')
+            if (classes != None and len(classes) == 1 and
+                    classes[0] in self.remove_classes[tag.name]):
+                return True
+        return False
+
+    def is_unwrapped(self, tag):
+        return tag.name in self.unwrap_tags
+
+    def extend(self, remove_tags=(), remove_classes=None, unwrap_tags=()):
+        # Returns a new rule set with these rules added.
+        merged_classes = dict((name, set(classes)) for name, classes
+                              in self.remove_classes.items())
+        if remove_classes:
+            for name, classes in remove_classes.items():
+                merged_classes.setdefault(name, set()).update(classes)
+        return PruneRules(self.remove_tags | set(remove_tags), merged_classes,
+                          self.unwrap_tags | set(unwrap_tags))
+
+
+def walk_tags(tag, rules):
+    # Yields every tag under tag that is not itself removed or
+    # inside a removed subtree, paired with whether it is removed.
+    # Removed tags are yielded (with True) but not descended into.
+    stack = [iter(tag.contents)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, NavigableString):
+                continue
+            if rules.is_removed(node):
+                yield node, True
+            else:
+                yield node, False
+                stack.append(iter(node.contents))
+                break
+        else:
+            stack.pop()
+
+
+def pruned_strings(tag, rules):
+    # Yields the strings that tag.get_text() would return after
+    # prune_tree(tag, rules), without altering the tree. Unwrapping
+    # does not change the text, so only removed subtrees are skipped.
+    stack = [iter(tag.contents)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, NavigableString):
+                # get_text() keeps plain strings and CDATA only,
+                # not comments, doctypes or script contents.
+                if type(node) in (NavigableString, CData):
+                    yield node
+            elif not rules.is_removed(node):
+                stack.append(iter(node.contents))
+                break
+        else:
+            stack.pop()
+
+
+def prune_tree(tag, rules):
+    # Applies the rules to the tree under tag, in place. The tree is
+    # walked once to find what to remove and unwrap, and the changes
+    # are made afterwards so the walk is not disturbed.
+    removed = []
+    unwrapped = []
+    for node, is_removed in walk_tags(tag, rules):
+        if is_removed:
+            removed.append(node)
+        elif rules.is_unwrapped(node):
+            unwrapped.append(node)
+    for node in removed:
+        node.extract()
+    # Innermost first, so each unwrap moves children that are final.
+    for node in reversed(unwrapped):
+        node.unwrap()
+    return len(removed), len(unwrapped)
+
+
+FULL_PAPER_RULES = PruneRules(PRUNED_TAGS, {'div': CITATION_DIV_CLASSES},
+                              UNWRAPPED_TAGS)
@@ -1,10 +1,13 @@
 #!/usr/local/bin/python
 # class written by Aditya Nandy for Kulik Group
-from articledownloader.articledownloader import ArticleDownloader
+from articledownloader.articledownloader import ArticleDownloader, ResponseCache
 from pybliometrics.scopus import ScopusSearch
 from text_mining_tools.article import Article
+from text_mining_tools.corpus import iter_corpus
+from text_mining_tools.bulk_download import BulkDownloader
 from requests.utils import quote
 from csv import reader
+from concurrent.futures import ThreadPoolExecutor
 import itertools
 import pandas as pd
 import os
@@ -47,14 +50,34 @@ Article classes.
 
 The query class allows setting journal limitations 
 (so that you do not query broadly, should you choose.) 
+
+Every (query, ISSN) pair of the search is run concurrently, by
+max_workers threads sharing one ArticleDownloader (whose rate limiter
+keeps CrossRef within its limits). The results are put together in
+the order of the queries and ISSNs, as if run one after another. A
+pair that fails is recorded in query_failures, and the others still
+run.
+
+The CrossRef responses are cached in basepath/ResponseCache for
+cache_days, and Scopus searches are only fetched again once the
+pybliometrics cache of them is that old, so rerunning a Query (e.g.
+with a few more keywords) only queries what is new. refresh_cache
+fetches everything again.
 '''
 
+# Threads running the (query, ISSN) searches of execute_queries.
+QUERY_WORKERS = 8
+RESPONSE_CACHE_DIRECTORY = 'ResponseCache'
+# Days before cached CrossRef and Scopus responses are fetched again.
+RESPONSE_CACHE_DAYS = 7
+
 
 class Query:
     def __init__(self, basepath, keywords, elsevier_key=None,
                  journal_limit=[], number_of_results=10000,
                  automate_download=False, analyze_downloaded=False,
-                 query_result_path=False):
+                 query_result_path=False, max_workers=QUERY_WORKERS,
+                 cache_days=RESPONSE_CACHE_DAYS, refresh_cache=False):
         # basepath is an ABSOLUTE PATH where the corpus of papers
         #                will be stored.
         # keywords is a LIST of arguments that will be searched for.
@@ -71,6 +94,12 @@ class Query:
         #               If this is not done, the query class can still
         #               be tied to all of its article classes with a 
         #               bound method (tie_articles_to_query).
+        # max_workers is the number of (query, ISSN) searches run at
+        #               once. 1 runs them one after another.
+        # cache_days is the age (in days) after which cached CrossRef
+        #               and Scopus responses are fetched again. None
+        #               never fetches them again.
+        # refresh_cache fetches every response again (and caches it).
         
         self.basepath = basepath
         self.check_dir()
@@ -83,6 +112,10 @@ class Query:
         self.number_of_results = number_of_results
         self.query_results = None
         self.deduplicated_results = None
+        self.max_workers = max_workers
+        self.cache_days = cache_days
+        self.refresh_cache = refresh_cache
+        self.query_failures = []
         self.execute_queries(query_result_path=query_result_path)
         if automate_download:
             reply = str(input('You are about to download '+
@@ -94,22 +127,73 @@ class Query:
                 print('Will not download papers at this time.')
             elif reply[0] == 'y':
                 print('OK, beginning download.')
+                self.download_articles()
                 article_dict = {}
-                print(self.deduplicated_results['doi'].values())
                 for i, doi in enumerate(self.deduplicated_results['doi'].values()):
-                    print('doi',doi)
-                    this_article = Article(doi=doi, basepath=self.basepath, elsevier_key=self.elsevier_key)
+                    this_article = Article(doi=doi, basepath=self.basepath,
+                                           elsevier_key=self.elsevier_key, download=False)
                     article_dict[doi] = this_article
                 self.article_dict = article_dict
 
-    def execute_queries(self, query_result_path = False):
-        downloader = ArticleDownloader(self.elsevier_key, timeout_sec=150)
+    def search_cell(self, downloader, query, issn, rows):
+        # Runs the searches of one (query, ISSN) pair, in a worker
+        # thread. Returns the DOIs, the api that found each, and a LIST
+        # of (api, error) for the searches that failed.
+        dois = []
+        found_by = []
+        failures = []
+        prefix = self.issn_to_doi_prefix_mapper(issn)
+        try:
+            downloader_dois = downloader.get_dois_from_search(query,rows=rows, prefix=prefix, issn=issn)
+            dois += downloader_dois
+            found_by += ['crossref']*len(downloader_dois)
+        except Exception as e:
+            failures.append(('crossref', e))
+        if self.elsevier_key:
+            try:
+                s = ScopusSearch('KEY(' + str(query) + '), ISSN(' + str(issn) +
+                                 ')', refresh=self.scopus_refresh())
+                df = pd.DataFrame(pd.DataFrame(s.results))
+                if df.shape[0] >= 1:
+                    scopus_dois = df['doi'].tolist()
+                    found_by += ['scopus']*len(scopus_dois)
+                    dois += scopus_dois
+            except Exception as e:
+                failures.append(('scopus', e))
+        return dois, found_by, failures
+
+    def response_cache(self):
+        # The cache of the CrossRef responses of the corpus.
+        cache_days = getattr(self, 'cache_days', RESPONSE_CACHE_DAYS)
+        return ResponseCache(os.path.join(self.basepath, RESPONSE_CACHE_DIRECTORY),
+                             ttl_sec=cache_days*24*3600 if cache_days is not None else None,
+                             refresh=getattr(self, 'refresh_cache', False))
+
+    def scopus_refresh(self):
+        # pybliometrics refreshes a cached search that is older than
+        # refresh days (an int), or always (True).
+        cache_days = getattr(self, 'cache_days', RESPONSE_CACHE_DAYS)
+        if getattr(self, 'refresh_cache', False):
+            return True
+        if cache_days is None:
+            return False
+        if cache_days <= 0:
+            return True
+        return max(1, int(cache_days))
+
+    def execute_queries(self, query_result_path = False, max_workers = None):
+        # max_workers overrides the number of searches run at once.
+        cache = self.response_cache()
+        downloader = ArticleDownloader(self.elsevier_key, timeout_sec=150,
+                                       response_cache=cache)
         dois = []
         query_list = []
         journal_list = []
         issn_list = []
         found_by = []
         rows = self.number_of_results  # Number of results
+        if max_workers is None:
+            max_workers = getattr(self, 'max_workers', QUERY_WORKERS)
         queries = self.prep_queries()
         print('THESE ARE THE QUERIES',queries)
         if (len(self.journal_limit)==0):
@@ -118,28 +202,41 @@ class Query:
             issns = [self.map_journal_to_ISSN(
                 journal=val) for val in self.journal_limit]
         self.issns = issns
-        for query in queries:
-            for issn in issns:
-                print('Now querying ' + str(query) + ' in ' +
-                      str(self.map_journal_to_ISSN(issn=issn)))
-                prefix = self.issn_to_doi_prefix_mapper(issn)
-                downloader_dois = downloader.get_dois_from_search(query,rows=rows, prefix=prefix, issn=issn)
-                print(downloader_dois)
-                found_by += ['crossref']*len(downloader_dois)
-                if self.elsevier_key:
-                    print('Elsevier key provided. Executing scopus query.')
-                    s = ScopusSearch('KEY(' + str(query) + '), ISSN(' + str(issn) +
-                                     ')', refresh=True)
-                    df = pd.DataFrame(pd.DataFrame(s.results))
-                    if df.shape[0] >= 1:
-                        scopus_dois = df['doi'].tolist()
-                        found_by += ['scopus']*len(scopus_dois)
-                        downloader_dois += scopus_dois
-                dois += downloader_dois
-                query_list += [query]*len(downloader_dois)
-                journal_list += ([str(self.map_journal_to_ISSN(issn=issn))] *
-                                 len(downloader_dois))
-                issn_list += [issn]*len(downloader_dois)
+        if self.elsevier_key:
+            print('Elsevier key provided. Executing scopus queries.')
+        cells = [(query, issn) for query in queries for issn in issns]
+        print('Now querying '+str(len(queries))+' queries in '+str(len(issns))+
+              ' journals ('+str(len(cells))+' searches, '+str(max_workers)+' at a time).')
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [executor.submit(self.search_cell, downloader, query, issn, rows)
+                       for query, issn in cells]
+            # Results are gathered in the order of the cells, not as
+            # they finish, so the DataFrame (and which row of a
+            # duplicate DOI is kept) does not depend on timing.
+            self.query_failures = []
+            for (query, issn), future in zip(cells, futures):
+                journal = str(self.map_journal_to_ISSN(issn=issn))
+                try:
+                    cell_dois, cell_found_by, failures = future.result()
+                except Exception as e:
+                    cell_dois, cell_found_by, failures = [], [], [('all', e)]
+                for api, error in failures:
+                    print('The '+api+' search of '+str(query)+' in '+journal+
+                          ' failed: '+repr(error))
+                    self.query_failures.append({'query': query, 'issn': issn,
+                                                'journal': journal, 'api': api,
+                                                'error': repr(error)})
+                dois += cell_dois
+                found_by += cell_found_by
+                query_list += [query]*len(cell_dois)
+                journal_list += [journal]*len(cell_dois)
+                issn_list += [issn]*len(cell_dois)
+        downloader.close()
+        print('CrossRef responses: '+str(cache.hits)+' cached, '+
+              str(cache.misses)+' fetched.')
+        if self.query_failures:
+            print(str(len(self.query_failures))+' of '+str(len(cells))+
+                  ' searches failed (see query_failures).')
         merged = list(itertools.chain.from_iterable(dois))
         doi_list = pd.DataFrame()
         doi_list['doi'] = dois
@@ -159,13 +256,35 @@ class Query:
         self.query_results = doi_list.to_dict()
         self.deduplicated_results = dropped_doi_list.to_dict()
 
+    def download_articles(self, **kwargs):
+        # Downloads every article of the query that is not in the
+        # corpus yet, many at a time (see bulk_download.py). kwargs are
+        # passed to the BulkDownloader (limits, progress_every...).
+        # Returns a DICT of doi -> download status.
+        downloader = BulkDownloader(self.basepath, self.elsevier_key, **kwargs)
+        self.download_status = downloader.download(self.deduplicated_results)
+        print(downloader.counts())
+        return self.download_status
+
     def tie_articles_to_query(self):
+        # Builds (and downloads, if needed) an Article for every DOI at
+        # once. To go through the downloaded articles one at a time
+        # instead, use iter_articles.
+        self.download_articles()
         article_dict = {}
         for i, doi in enumerate(self.deduplicated_results['doi'].values()):
-            this_article = Article(doi, self.basepath, self.elsevier_key)
+            this_article = Article(doi, self.basepath, self.elsevier_key, download=False)
             article_dict[doi] = this_article
         self.article_dict = article_dict
 
+    def iter_articles(self, **filters):
+        # Yields an ArticleHandle (see corpus.py) for every downloaded
+        # article of the query, in a fixed order, without building or
+        # keeping Article classes. filters are those of iter_corpus
+        # (publishers, min_size, max_size...).
+        dois = list(self.deduplicated_results['doi'].values())
+        return iter_corpus(self.basepath, dois=dois, **filters)
+
     def prep_queries(self):
         queries = []
         # We need to prep all keywords to be API friendly.
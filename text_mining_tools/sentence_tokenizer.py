@@ -0,0 +1,122 @@
+#!/usr/local/bin/python
+import regex as re
+"""
+The sentence tokenizer splits text into sentences for the Article
+class. It loads the NLTK Punkt model once per process (per language)
+and keeps it, instead of going through NLTK's loader on every
+sent_tokenize call, and it tokenizes lists of texts in one call.
+
+Two methods are available:
+    punkt   NLTK's Punkt model. Gives the same sentences as
+            nltk.sent_tokenize. This is the default.
+    rules   A fast rule-based splitter tuned for chemistry text. It
+            splits after . ! or ? followed by whitespace, unless the
+            word before is a known abbreviation (ca., Fig., et al.,
+            e.g., ...) or a single capital letter (initials). It does
+            not otherwise rely on capitalization, so it also works on
+            lowercased text (where "150 k." still ends a sentence).
+
+Both return substrings of the text they are given, so their output
+can be stored as offsets (see text_store.py).
+
+    tokenizer = SentenceTokenizer('rules')
+    tokenizer.add_abbreviations(['calcd', 'obsd'])
+    tokenizer.tokenize_batch(list_of_texts)
+"""
+
+# Lowercase, without the final period.
+CHEMISTRY_ABBREVIATIONS = ['ca', 'fig', 'figs', 'al', 'e.g', 'i.e', 'eg', 'ie',
+                           'vs', 'cf', 'eq', 'eqs', 'eqn', 'ref', 'refs',
+                           'approx', 'tab', 'no', 'nos', 'vol', 'ch', 'sect',
+                           'resp', 'wt', 'mol', 'equiv', 'conc', 'temp',
+                           'min', 'max', 'calc', 'exp', 'etc', 'dr', 'prof',
+                           'inc', 'co', 'ltd', 'corp', 'st', 'aq', 'sat',
+                           'soln', 'ppt', 'anal', 'chem', 'phys', 'j', 'am',
+                           'soc', 'int', 'ed', 'supp', 'suppl', 'ph', 'p',
+                           'pp', 'cat', 'vide', 'infra', 'supra']
+TOKENIZER_METHODS = ['punkt', 'rules']
+
+# The Punkt models loaded in this process, by language.
+punkt_models = {}
+
+
+def load_punkt(language='english'):
+    # Loads the Punkt model for a language once per process.
+    if language not in punkt_models:
+        try:
+            # NLTK >= 3.8.2 ships the model as punkt_tab.
+            from nltk.tokenize.punkt import PunktTokenizer
+            punkt_models[language] = PunktTokenizer(language)
+        except ImportError:
+            import nltk.data
+            punkt_models[language] = nltk.data.load(
+                'tokenizers/punkt/'+str(language)+'.pickle')
+    return punkt_models[language]
+
+
+# Sentence end: terminal punctuation, closing quotes or brackets,
+# then whitespace. The word before it is checked separately, with a
+# reverse search so only that word is scanned.
+SENTENCE_END_PATTERN = re.compile(r'[.!?]["\')\]]*\s+')
+LAST_WORD_PATTERN = re.compile(r'(?r)\S+')
+
+
+class SentenceTokenizer:
+    def __init__(self, method='punkt', language='english',
+                 abbreviations=None):
+        # method is 'punkt' or 'rules' (see TOKENIZER_METHODS).
+        # abbreviations is a LIST of abbreviations (lowercase, no
+        #               final period) for the rules method. If None,
+        #               CHEMISTRY_ABBREVIATIONS is used.
+        if method not in TOKENIZER_METHODS:
+            raise AssertionError('Unknown tokenizer method '+str(method)+
+                                 '. Choose from '+str(TOKENIZER_METHODS)+'.')
+        self.method = method
+        self.language = language
+        if abbreviations is None:
+            abbreviations = CHEMISTRY_ABBREVIATIONS
+        self.abbreviations = set()
+        self.add_abbreviations(abbreviations)
+
+    def add_abbreviations(self, abbreviations):
+        self.abbreviations |= set(val.lower().rstrip('.') for val in abbreviations)
+
+    def tokenize(self, text):
+        if self.method == 'punkt':
+            return load_punkt(self.language).tokenize(text)
+        return self.split_by_rules(text)
+
+    def tokenize_batch(self, texts):
+        # Tokenizes a list of texts. Returns a list of sentence lists.
+        if self.method == 'punkt':
+            model = load_punkt(self.language)
+            return [model.tokenize(text) for text in texts]
+        return [self.split_by_rules(text) for text in texts]
+
+    def split_by_rules(self, text):
+        sentences = []
+        start = 0
+        for match in SENTENCE_END_PATTERN.finditer(text):
+            word = LAST_WORD_PATTERN.search(text, start, match.start() + 1)
+            if word is not None:
+                last_word = word.group(0).lstrip('(["\'')
+                if last_word.endswith('.'):
+                    last_word = last_word[:-1]
+                if ((last_word.lower() in self.abbreviations) or
+                        (len(last_word) == 1 and last_word.isupper())):
+                    # Abbreviation or initial, not a sentence end.
+                    continue
+            sentence = text[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        sentence = text[start:].strip()
+        if sentence:
+            sentences.append(sentence)
+        return sentences
+
+    # Allows tokenizer(text), like sent_tokenize(text).
+    __call__ = tokenize
+
+
+default_tokenizer = SentenceTokenizer()
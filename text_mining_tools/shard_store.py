@@ -0,0 +1,325 @@
+#!/usr/local/bin/python
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+"""
+The shard store is an optional way of keeping the HTML of a corpus.
+Instead of one .html file per paper in each DOI prefix directory, the
+papers are compressed and appended to a few large shard files, with
+an index from DOI to (shard, offset, length):
+    basepath
+        |------HTMLShards
+        |           |---index.sqlite
+        |           |---shard-00000.bin
+        |           |---shard-00001.bin
+        |------AnalyzedResults
+
+A corpus of hundreds of thousands of papers is then a handful of files,
+so listing, backing up and syncing it is fast, and the HTML takes much
+less disk. Each paper is compressed on its own (zlib), so reading one
+is a single seek and read, whatever the size of the shard.
+
+Shards are only ever appended to. A new shard is started once the
+current one reaches max_shard_bytes. Storing a DOI again appends the
+new copy and points the index at it; the old bytes stay in the shard
+until the store is rebuilt with repack(). One process should write
+to a store at a time. Any number can read, from any number of threads:
+each thread (and each forked process) opens its own connection to the
+index.
+
+Article finds the store by itself: if basepath/HTMLShards exists,
+download_article writes to it and read_paper reads from it (a paper
+that is still a file in its prefix directory is read from the file).
+iter_corpus lists the papers of both. An existing corpus is moved
+into a store with:
+
+    store = ShardStore(basepath)
+    migrate_directory_corpus(basepath, store, remove_files=True)
+"""
+
+STORE_DIRECTORY = 'HTMLShards'
+INDEX_FILENAME = 'index.sqlite'
+DEFAULT_MAX_SHARD_BYTES = 1024**3
+DEFAULT_COMPRESSION_LEVEL = 6
+
+STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS articles (doi TEXT PRIMARY KEY, prefix TEXT,
+    shard INTEGER, offset INTEGER, length INTEGER, size INTEGER,
+    mtime_ns INTEGER, sha256 TEXT);
+CREATE INDEX IF NOT EXISTS articles_prefix ON articles (prefix, doi);
+'''
+
+# Open stores, by directory, so every Article of a corpus shares one.
+open_stores = {}
+
+
+def store_directory(basepath):
+    return os.path.join(basepath, STORE_DIRECTORY)
+
+
+def has_store(basepath):
+    return os.path.exists(os.path.join(store_directory(basepath), INDEX_FILENAME))
+
+
+def find_store(basepath):
+    # Returns the ShardStore of a corpus, or None if it has none.
+    directory = os.path.abspath(store_directory(basepath))
+    store = open_stores.get(directory)
+    if store is None:
+        if not has_store(basepath):
+            return None
+        store = ShardStore(basepath)
+    return store
+
+
+class ShardStore:
+    def __init__(self, basepath, directory=None, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL, first_shard=0):
+        # basepath is the ABSOLUTE PATH of the corpus.
+        # directory overrides where the store is kept. Default is
+        #               basepath/HTMLShards/.
+        # max_shard_bytes is the size at which a new shard is started.
+        # compression_level is the zlib level (1 fastest, 9 smallest).
+        # first_shard is the number of the first shard of an empty
+        #               store.
+        if directory is None:
+            directory = store_directory(basepath)
+        self.directory = os.path.abspath(directory)
+        self.max_shard_bytes = max_shard_bytes
+        self.compression_level = compression_level
+        self.first_shard = first_shard
+        os.makedirs(self.directory, exist_ok=True)
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.connect()
+        open_stores[self.directory] = self
+
+    def connect(self):
+        # Returns the connection of the calling thread. SQLite
+        # connections are not shared between threads, nor with forked
+        # worker processes.
+        local = self.local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            # Opened for this thread only, but closable by close()
+            # from any thread.
+            local.connection = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME),
+                                               check_same_thread=False)
+            local.connection.executescript(STORE_SCHEMA)
+            local.pid = os.getpid()
+            with self.connections_lock:
+                self.connections.append(local.connection)
+        return local.connection
+
+    def close(self):
+        # Closes the connections of every thread.
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = threading.local()
+        open_stores.pop(self.directory, None)
+
+    # Articles holding a store are pickled (and sent to worker
+    # processes) without the connections, which are opened again on use.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['local']
+        del state['connections_lock']
+        state['connections'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+        self.connections_lock = threading.Lock()
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, 'shard-%05d.bin' % shard)
+
+    def info(self, doi):
+        # Returns the index row of a DOI as a DICT, or None.
+        row = self.connect().execute(
+            'SELECT doi, prefix, shard, offset, length, size, mtime_ns, sha256 '
+            'FROM articles WHERE doi = ?', (doi,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['doi', 'prefix', 'shard', 'offset', 'length', 'size',
+                         'mtime_ns', 'sha256'], row))
+
+    def __contains__(self, doi):
+        return self.connect().execute('SELECT 1 FROM articles WHERE doi = ?',
+                                      (doi,)).fetchone() is not None
+
+    def __len__(self):
+        return self.connect().execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+    def prefixes(self):
+        return [row[0] for row in self.connect().execute(
+            'SELECT DISTINCT prefix FROM articles ORDER BY prefix')]
+
+    def entries(self, prefix=None):
+        # Returns (doi, size) for every stored article, sorted by DOI.
+        if prefix is None:
+            rows = self.connect().execute('SELECT doi, size FROM articles ORDER BY doi')
+        else:
+            rows = self.connect().execute(
+                'SELECT doi, size FROM articles WHERE prefix = ? ORDER BY doi', (prefix,))
+        return list(rows)
+
+    def dois(self, prefix=None):
+        return [doi for doi, size in self.entries(prefix)]
+
+    def get(self, doi):
+        # Returns the HTML of a DOI as bytes, or None if it is not stored.
+        info = self.info(doi)
+        if info is None:
+            return None
+        with open(self.shard_path(info['shard']), 'rb') as fin:
+            fin.seek(info['offset'])
+            data = fin.read(info['length'])
+        return zlib.decompress(data)
+
+    def current_shard(self, n_bytes):
+        # The shard the next write goes to: the last one, or a new one
+        # if it would grow past max_shard_bytes.
+        row = self.connect().execute('SELECT MAX(shard) FROM articles').fetchone()
+        shard = row[0] if row[0] is not None else self.first_shard
+        # Shards can be ahead of the index if a write was interrupted.
+        while os.path.exists(self.shard_path(shard + 1)):
+            shard += 1
+        path = self.shard_path(shard)
+        if (os.path.exists(path) and os.path.getsize(path) > 0 and
+                os.path.getsize(path) + n_bytes > self.max_shard_bytes):
+            shard += 1
+        return shard
+
+    def put(self, doi, data, replace=True, commit=True):
+        # Stores the HTML (bytes) of a DOI. Returns False if the DOI is
+        # already stored and replace is False.
+        # commit commits the index at once. Bulk writers pass False
+        #               and call commit() every so many articles.
+        if not replace and doi in self:
+            return False
+        compressed = zlib.compress(data, self.compression_level)
+        shard = self.current_shard(len(compressed))
+        # The bytes are written before the index points at them, so an
+        # interrupted write leaves the store as it was.
+        with open(self.shard_path(shard), 'ab') as fout:
+            offset = fout.tell()
+            fout.write(compressed)
+        prefix = str(doi.split('/', 1)[0]).strip()
+        connection = self.connect()
+        connection.execute(
+            'INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (doi, prefix, shard, offset, len(compressed), len(data),
+             int(time.time()*1e9), hashlib.sha256(data).hexdigest()))
+        if commit:
+            connection.commit()
+        return True
+
+    def commit(self):
+        self.connect().commit()
+
+    def remove(self, doi, commit=True):
+        # commit is as in put().
+        connection = self.connect()
+        connection.execute('DELETE FROM articles WHERE doi = ?', (doi,))
+        if commit:
+            connection.commit()
+
+    def size_on_disk(self):
+        return sum(os.path.getsize(os.path.join(self.directory, filename))
+                   for filename in os.listdir(self.directory)
+                   if filename.startswith('shard-'))
+
+    def repack(self):
+        # Rewrites the shards with only the current copy of each
+        # article, dropping replaced and removed ones. Returns the
+        # number of bytes freed.
+        # The new shards are numbered after the old ones, so nothing
+        # is overwritten: they are moved in, then the new index
+        # replaces the old one (a single rename), and only then are
+        # the old shards deleted. An interrupted repack leaves either
+        # store whole, with some unused shards.
+        before = self.size_on_disk()
+        old_shards = sorted(filename for filename in os.listdir(self.directory)
+                            if filename.startswith('shard-'))
+        next_shard = max([int(filename[len('shard-'):-len('.bin')])
+                          for filename in old_shards] + [-1]) + 1
+        repack_directory = os.path.join(self.directory, 'repack')
+        # Left over by an interrupted repack.
+        shutil.rmtree(repack_directory, ignore_errors=True)
+        repacked = ShardStore(None, directory=repack_directory,
+                              max_shard_bytes=self.max_shard_bytes,
+                              compression_level=self.compression_level,
+                              first_shard=next_shard)
+        for doi in self.dois():
+            info = self.info(doi)
+            repacked.put(doi, self.get(doi), commit=False)
+            # Keeps the time the article was stored, not repacked.
+            repacked.connect().execute('UPDATE articles SET mtime_ns = ? WHERE doi = ?',
+                                       (info['mtime_ns'], doi))
+        repacked.commit()
+        repacked.close()
+        self.close()
+        for filename in sorted(os.listdir(repacked.directory)):
+            if filename.startswith('shard-'):
+                os.replace(os.path.join(repacked.directory, filename),
+                           os.path.join(self.directory, filename))
+        os.replace(os.path.join(repacked.directory, INDEX_FILENAME),
+                   os.path.join(self.directory, INDEX_FILENAME))
+        for filename in old_shards:
+            os.remove(os.path.join(self.directory, filename))
+        shutil.rmtree(repacked.directory, ignore_errors=True)
+        self.connect()
+        open_stores[self.directory] = self
+        return before - self.size_on_disk()
+
+def migrate_directory_corpus(basepath, store=None, prefixes=None, remove_files=False,
+                             verify=True, commit_every=1000):
+    # Moves the .html files of a directory corpus into a ShardStore.
+    # Returns the number of articles stored.
+    # prefixes is a LIST of DOI prefixes to migrate. Default is all.
+    # remove_files deletes each file once it is stored (and read back
+    #               identical if verify). The not_automatically_downloaded
+    #               lists stay where they are.
+    # verify reads every article back from the store and compares it
+    #               with the file.
+    # commit_every commits the index every this many articles. Files
+    #               are only removed once their articles are committed.
+    from text_mining_tools.corpus import iter_corpus
+    if store is None:
+        store = ShardStore(basepath)
+    n_stored = 0
+    stored_paths = []
+
+    def commit():
+        store.commit()
+        if remove_files:
+            for path in stored_paths:
+                os.remove(path)
+        del stored_paths[:]
+
+    for handle in iter_corpus(basepath, prefixes, use_store=False):
+        with handle.open() as fin:
+            data = fin.read()
+        store.put(handle.doi, data, commit=False)
+        if verify and store.get(handle.doi) != data:
+            # The bad copy is dropped before the earlier articles are
+            # committed. The file stays, so the DOI is still read from it.
+            store.remove(handle.doi, commit=False)
+            commit()
+            raise AssertionError('The stored copy of '+handle.doi+' does not match '+
+                                 handle.path+'.')
+        n_stored += 1
+        stored_paths.append(handle.path)
+        if n_stored % commit_every == 0:
+            commit()
+            print('Migrated', n_stored, 'articles')
+    commit()
+    return n_stored
@@ -0,0 +1,272 @@
+#!/usr/local/bin/python
+from text_mining_tools.text_normalizer import default_normalizer
+import numpy as np
+import re
+import pandas as pd
+"""
+The table engine turns an HTML table into a grid of cell texts.
+
+The table is read in two passes over its rows. The first pass measures
+the grid: it places every cell, honoring rowspan and colspan, and
+records where it goes. The grid is then allocated once as a NumPy
+object array and filled, with cells spanning several rows or columns
+repeated in each position they cover. All cell texts of a table are
+normalized in one batch.
+
+Header rows are the rows in <thead>, or, if there is none, the leading
+rows made only of <th> cells. A table can be returned in the nested
+list layout Article.read_table_data returns by default, as the grid,
+or as a pandas DataFrame (header rows become the columns). coerce_numeric
+turns columns whose cells all parse as numbers into floats.
+
+For a corpus, stream_tables yields every table of many articles, and
+write_tables writes them to a Parquet file in long format (one row per
+cell, with the number when the cell parses as one), which needs
+pyarrow.
+"""
+
+# Spans larger than this are treated as malformed and capped.
+MAX_SPAN = 1000
+# What a cell must look like to parse as a number (after thousands
+# separators are dropped). float() alone would also take 'NaN', 'Inf',
+# 'infinity' and '1_000', which are text in a table.
+NUMBER_PATTERN = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+TABLE_OUTPUTS = ['array', 'frame', 'list']
+
+
+def get_span(cell, attr):
+    value = cell.get(attr)
+    if value is None:
+        return 1
+    try:
+        span = int(str(value).strip())
+    except ValueError:
+        return 1
+    if span < 0:
+        return 1
+    return min(span, MAX_SPAN)
+
+
+def measure_table(rows):
+    # First pass. Returns the grid shape and, for every cell, the
+    # (row, column, rowspan, colspan, cell) where it is placed.
+    placements = []
+    # covered[j] is the number of rows (from the current one) that
+    # column j is still taken by a rowspan from above.
+    covered = []
+    n_cols = 0
+    n_rows = len(rows)
+    for r, row in enumerate(rows):
+        c = 0
+        for cell in row.find_all(['td', 'th'], recursive=False):
+            while c < len(covered) and covered[c] > 0:
+                c += 1
+            rowspan = get_span(cell, 'rowspan')
+            colspan = get_span(cell, 'colspan') or 1
+            if rowspan == 0 or r + rowspan > n_rows:
+                # rowspan="0" spans to the end of the table.
+                rowspan = n_rows - r
+            placements.append((r, c, rowspan, colspan, cell))
+            if len(covered) < c + colspan:
+                covered += [0]*(c + colspan - len(covered))
+            for j in range(c, c + colspan):
+                covered[j] = rowspan
+            c += colspan
+        n_cols = max(n_cols, c, len(covered))
+        covered = [val - 1 if val > 0 else 0 for val in covered]
+    return n_rows, n_cols, placements
+
+
+def count_header_rows(rows):
+    # Rows inside <thead> are the header. Without a thead, the
+    # leading rows made only of th cells are.
+    if any(row.parent.name == 'thead' for row in rows):
+        n_header = 0
+        while n_header < len(rows) and rows[n_header].parent.name == 'thead':
+            n_header += 1
+        return n_header
+    n_header = 0
+    for row in rows:
+        cells = row.find_all(['td', 'th'], recursive=False)
+        if len(cells) == 0 or any(cell.name != 'th' for cell in cells):
+            break
+        n_header += 1
+    return n_header
+
+
+def parse_table(table, normalizer=None):
+    # Returns the grid (an object array of strings) of an HTML table
+    # and its number of header rows. Returns (None, 0) for tables
+    # with no cells.
+    if normalizer is None:
+        normalizer = default_normalizer
+    rows = table.find_all('tr')
+    if len(rows) == 0:
+        return None, 0
+    n_rows, n_cols, placements = measure_table(rows)
+    if n_cols == 0:
+        return None, 0
+    texts = normalizer.normalize_batch([cell.get_text().strip()
+                                        for (r, c, rowspan, colspan, cell)
+                                        in placements])
+    grid = np.full((n_rows, n_cols), '', dtype=object)
+    for (r, c, rowspan, colspan, cell), text in zip(placements, texts):
+        grid[r:r + rowspan, c:c + colspan] = text
+    return grid, count_header_rows(rows)
+
+
+def as_grid(table):
+    # Returns the grid of a table in the list layout (or the grid
+    # itself).
+    if isinstance(table, np.ndarray):
+        return table
+    grid = np.full((len(table), max([len(row) for row in table] + [0])), '', dtype=object)
+    for i, row in enumerate(table):
+        for j, cell in enumerate(row):
+            grid[i, j] = cell[0] if len(cell) > 0 else ''
+    return grid
+
+
+def to_number(text):
+    text = text.strip().replace(u'\u2212', '-').replace(',', '')
+    if text == '':
+        return np.nan
+    if not NUMBER_PATTERN.match(text):
+        raise ValueError('Not a number: '+text)
+    return float(text)
+
+
+def coerce_numeric(grid, n_header=0):
+    # Converts, in a copy, the columns whose body cells are all numbers
+    # (or empty) to floats. Header rows are left as text.
+    grid = grid.copy()
+    for j in range(grid.shape[1]):
+        column = grid[n_header:, j]
+        try:
+            values = [to_number(val) for val in column]
+        except ValueError:
+            continue
+        if all(np.isnan(val) for val in values):
+            continue
+        grid[n_header:, j] = values
+    return grid
+
+
+def format_table(grid, n_header=0, output='array', numeric=False):
+    # Turns a grid into the requested output (see TABLE_OUTPUTS).
+    if output not in TABLE_OUTPUTS:
+        raise AssertionError('Unknown table output '+str(output)+
+                             '. Choose from '+str(TABLE_OUTPUTS)+'.')
+    if numeric:
+        grid = coerce_numeric(grid, n_header)
+    if output == 'array':
+        return grid
+    if output == 'list':
+        return [[[val] for val in row] for row in grid.tolist()]
+    body = grid[n_header:]
+    if n_header == 0:
+        frame = pd.DataFrame(body)
+    elif n_header == 1:
+        frame = pd.DataFrame(body, columns=list(grid[0]))
+    else:
+        columns = pd.MultiIndex.from_arrays([list(val) for val in grid[:n_header]])
+        frame = pd.DataFrame(body, columns=columns)
+    if numeric:
+        frame = frame.infer_objects()
+    return frame
+
+
+def read_tables(soup, normalizer=None, output='array', numeric=False):
+    # Returns a DICT of table number -> table for every table in the
+    # soup. Tables holding other tables are skipped (their inner
+    # tables are kept), and numbering follows the remaining tables.
+    table_dict = {}
+    header_rows = {}
+    counter = 0
+    for table in soup.find_all('table'):
+        if table.find('table') is not None:
+            # Cannot handle nested tables.
+            continue
+        counter += 1
+        grid, n_header = parse_table(table, normalizer)
+        if grid is None:
+            # Not a real table.
+            continue
+        table_dict[counter] = format_table(grid, n_header, output, numeric)
+        header_rows[counter] = n_header
+    return table_dict, header_rows
+
+
+def stream_tables(articles):
+    # Yields (doi, table number, grid, number of header rows) for
+    # every table of every article. Articles are read if needed, and
+    # their soup is dropped once their tables are out.
+    for article in articles:
+        was_read = 'f' in article.__dict__
+        if not was_read:
+            article.read_paper()
+        table_dict, header_rows = read_tables(article.f, article.normalizer)
+        if not was_read:
+            del article.f
+            del article.original_f
+        for counter, grid in table_dict.items():
+            yield article.doi, counter, grid, header_rows[counter]
+
+
+def table_records(doi, counter, grid, n_header):
+    # Long format: one record per cell. value is the cell as a number
+    # when it parses as one.
+    records = {'doi': [], 'table': [], 'row': [], 'col': [],
+               'header': [], 'text': [], 'value': []}
+    for i in range(grid.shape[0]):
+        for j in range(grid.shape[1]):
+            text = grid[i, j]
+            try:
+                value = to_number(text)
+            except ValueError:
+                value = np.nan
+            records['doi'].append(doi)
+            records['table'].append(counter)
+            records['row'].append(i)
+            records['col'].append(j)
+            records['header'].append(i < n_header)
+            records['text'].append(text)
+            records['value'].append(value)
+    return records
+
+
+def write_tables(articles, path, batch_size=100):
+    # Streams every table of the articles into one Parquet file in long
+    # format (doi, table, row, col, header, text, value). Tables are
+    # written in batches so memory stays flat. Returns the number of
+    # tables written.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Writing tables to Parquet needs pyarrow '
+                          '(pip install pyarrow).')
+    schema = pa.schema([('doi', pa.string()), ('table', pa.int32()),
+                        ('row', pa.int32()), ('col', pa.int32()),
+                        ('header', pa.bool_()), ('text', pa.string()),
+                        ('value', pa.float64())])
+    n_tables = 0
+    batch = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for doi, counter, grid, n_header in stream_tables(articles):
+            batch.append(table_records(doi, counter, grid, n_header))
+            n_tables += 1
+            if len(batch) >= batch_size:
+                writer.write_table(merge_records(batch, schema, pa))
+                batch = []
+        if len(batch) > 0:
+            writer.write_table(merge_records(batch, schema, pa))
+    return n_tables
+
+
+def merge_records(batch, schema, pa):
+    columns = dict((name, []) for name in schema.names)
+    for records in batch:
+        for name in schema.names:
+            columns[name] += records[name]
+    return pa.table(columns, schema=schema)
@@ -0,0 +1,104 @@
+#!/usr/local/bin/python
+from collections import OrderedDict
+"""
+The text normalizer replaces characters that make mining difficult
+(non-breaking and thin spaces, dashes, newlines, leftover HTML
+entities). It is what Article.clean_text uses.
+
+The rules are a plain table of (source, replacement) pairs, applied
+in order, with the output of replacing them one by one. They are
+compiled once: each run of consecutive single-character rules goes
+into one str.translate table, and longer strings are replaced with
+str.replace. With the default rules, a string is copied four times
+rather than once per rule. As the rules are applied in order, newlines
+are removed before '&thinsp;' is, so an entity broken by a newline is
+still removed.
+
+A list of strings (e.g. all table cells of a paper) can be normalized
+in one call with normalize_batch, which joins them, normalizes the
+joined string once, and splits it again.
+
+To extend the rules, either pass your own table, or add to the
+default one:
+
+    normalizer = TextNormalizer()
+    normalizer.add_rules([(u'\u2212', ' '), ('&lt;', '<')])
+"""
+
+# Currently, text is ridded of these characters, which make mining
+# difficult. You can add to this list if other things are not
+# enabling mining.
+CLEAN_TEXT_RULES = [(u'\xa0', ' '),
+                    (u'\u2013', ' '),
+                    (u'\u2009', ' '),
+                    (u'\u2005', ' '),
+                    (u'\u2014', ' '),
+                    ('\n', ''),
+                    ('&thinsp;', ''),
+                    ('&nbsp;', ' '),
+                    ('-', ' ')]
+
+# Joins the strings of a batch. It is not touched by any rule, and
+# the batch is normalized one by one if any string contains it.
+BATCH_SEPARATOR = u'\x00'
+
+
+class TextNormalizer:
+    def __init__(self, rules=None):
+        # rules is a LIST of (source, replacement) string pairs.
+        #               If None, CLEAN_TEXT_RULES is used.
+        if rules is None:
+            rules = CLEAN_TEXT_RULES
+        self.rules = list(rules)
+        self.compile()
+
+    def add_rules(self, rules):
+        # Later rules for the same source override earlier ones, in
+        # the place of the earlier rule.
+        self.rules += list(rules)
+        self.compile()
+
+    def compile(self):
+        rules = OrderedDict()
+        for source, replacement in self.rules:
+            if len(source) == 0:
+                raise AssertionError('Normalizer rules need a non-empty source.')
+            if BATCH_SEPARATOR in source or BATCH_SEPARATOR in replacement:
+                raise AssertionError('Normalizer rules cannot use the batch separator.')
+            rules[source] = replacement
+        # Each stage is a translate table (dict) for a run of single
+        # characters, or one (source, replacement) longer rule. A run
+        # is split where a source appears in an earlier replacement of
+        # the run, so that replacements chain as they would one by one.
+        self.stages = []
+        for source, replacement in rules.items():
+            if len(source) > 1:
+                self.stages.append((source, replacement))
+                continue
+            if (len(self.stages) == 0 or not isinstance(self.stages[-1], dict) or
+                    any(source in val for val in self.stages[-1].values())):
+                self.stages.append({})
+            self.stages[-1][ord(source)] = replacement
+
+    def normalize(self, text):
+        for stage in self.stages:
+            if isinstance(stage, dict):
+                text = text.translate(stage)
+            else:
+                text = text.replace(stage[0], stage[1])
+        return text
+
+    def normalize_batch(self, texts):
+        # Normalizes a list of strings at once. Returns a list.
+        texts = list(texts)
+        if len(texts) == 0:
+            return []
+        joined = BATCH_SEPARATOR.join(texts)
+        if joined.count(BATCH_SEPARATOR) != len(texts) - 1:
+            return [self.normalize(text) for text in texts]
+        return self.normalize(joined).split(BATCH_SEPARATOR)
+
+    __call__ = normalize
+
+
+default_normalizer = TextNormalizer()
@@ -0,0 +1,111 @@
+#!/usr/local/bin/python
+from collections.abc import Sequence
+import numpy as np
+"""
+The text store keeps the normalized text of an article once, in a
+single string, and everything else (sentences, sections) as integer
+(start, end) offset arrays into it.
+
+Callers that expect a list of sentences get a SpanList, a range of
+the store spans. It behaves as a read-only list of strings (len,
+indexing, slicing, iteration, comparison with a list), but builds
+each string only when it is asked for. Pickling an article pickles
+the store once, however many SpanLists point into it.
+
+This is what Article.compact() uses to shrink analyzed articles.
+"""
+
+
+class SpanList(Sequence):
+    __slots__ = ('store', 'first', 'last')
+
+    def __init__(self, store, first, last):
+        # store is the TextStore the spans point into. The list is
+        # made of the spans store.spans[first:last].
+        self.store = store
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return self.last - self.first
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first, last, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(first, last, step)]
+            return SpanList(self.store, self.first + first,
+                            self.first + max(first, last))
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('SpanList index out of range')
+        start, end = self.store.spans[self.first + index]
+        return self.store.text[start:end]
+
+    def __iter__(self):
+        text = self.store.text
+        for start, end in self.store.spans[self.first:self.last].tolist():
+            yield text[start:end]
+
+    def __eq__(self, other):
+        if isinstance(other, (SpanList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __getstate__(self):
+        return (self.store, self.first, self.last)
+
+    def __setstate__(self, state):
+        self.store, self.first, self.last = state
+
+
+class TextStore:
+    def __init__(self):
+        self.parts = []
+        self.span_parts = []
+        self.length = 0
+        self.text = None
+        self.spans = None
+
+    def add(self, text):
+        # Appends a text and returns its (start, end) offsets.
+        if self.text is not None:
+            raise AssertionError('This text store is already closed.')
+        start = self.length
+        self.parts.append(text)
+        self.length += len(text)
+        return start, self.length
+
+    def add_sentences(self, text, sentences):
+        # Appends a text and the spans of its sentences, which are
+        # expected to be substrings of it, in order. A sentence that
+        # cannot be found (e.g. a tokenizer that rewrites the text)
+        # is appended on its own so its span is still valid. Returns
+        # the offsets of the text and a SpanList of the sentences.
+        start, end = self.add(text)
+        first = len(self.span_parts)
+        position = 0
+        for sentence in sentences:
+            found = text.find(sentence, position)
+            if found == -1:
+                self.span_parts.append(self.add(sentence))
+                continue
+            self.span_parts.append((start + found, start + found + len(sentence)))
+            position = found + len(sentence)
+        return start, end, SpanList(self, first, len(self.span_parts))
+
+    def close(self):
+        # Joins the parts into the single string the spans point into,
+        # and the spans into a single (n, 2) integer array.
+        self.text = ''.join(self.parts)
+        self.spans = np.array(self.span_parts, dtype=np.int64).reshape(-1, 2)
+        self.parts = []
+        self.span_parts = []
+        return self
+
+    def view(self, start, end):
+        return self.text[start:end]